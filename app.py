@@ -1,17 +1,29 @@
 import os
-import re
-from collections import defaultdict
+import contextlib
 import json
 import yaml
 import time
 import math
+import random
 from loguru import logger
-from PIL import Image
-import pytesseract
 from user_data_handler import UserDataHandler
 from pdf_handler import PdfHandler
 from OutputHandler import OutputHandler
 from chains import Chains
+from ocr_handler import OcrHandler
+from extraction_handler import ExtractionHandler
+from response_cache import ResponseCache
+from pipeline import Pipeline, Stage, PageJob
+from receipt_parser import ReceiptParser
+from metrics import Metrics, TOKEN_BUCKETS
+from manifest import Manifest
+from results_store import ResultsStore
+from text_compactor import TextCompactor
+from validation import ReceiptValidator
+from assignment import AssignmentEngine
+from artifact_catalog import ArtifactCatalog
+from atomic_files import is_complete, remove_partial_files, save_pixmap, write_text
+from dedup import DuplicateIndex, text_hash
 
 
 class IndentDumper(yaml.Dumper):
@@ -20,33 +32,144 @@ class IndentDumper(yaml.Dumper):
 
 
 class Main:
-    def __init__(self, pdf_file_path=None, data_directory_path=None):
+    log_sink_added = False
+
+    def __init__(self, pdf_file_path=None, data_directory_path=None, ocr_workers=None, ocr_chunk_size=1,
+                 extraction_concurrency=1, requests_per_second=None, max_retries=5, llm_base_url=None,
+                 cache_path=None, cache_max_bytes=64 * 1024 * 1024, in_memory=False, save_images=True,
+                 queue_size=4, signature_image_path=None, use_text_layer=True, min_text_layer_chars=25,
+                 use_local_parser=True, min_parser_confidence=0.9, metrics_path=None, llm_debug=False,
+                 resources=None, document_id=None, results_store_path=None, ocr_preprocessor=None,
+                 ocr_backend="auto", llm_batch_token_budget=None, llm_batch_size=8,
+                 compact_llm_text=True, max_llm_text_tokens=600, validate=True, reextract_invalid=True,
+                 assignment_seed=0, global_assignment=True, page_chunk_size=50, deduplicate=True,
+                 text_duplicate_distance=6, duplicate_index_path=None):
+        """
+        resources (dict): Shared objects to use instead of creating new ones, e.g. from BatchRunner:
+            user_data_handler, pdf_handler, ocr_handler, extraction_handler, response_cache, chains, metrics,
+            results_store, artifact_catalog, duplicate_index.
+        ocr_preprocessor (ImagePreprocessor): Optional image preprocessing and tesseract config for OCR.
+        ocr_backend (str): "auto", "tesserocr" or "pytesseract", see ocr_backends.
+        llm_batch_token_budget (int): Send the pages that need the LLM several per request, within
+            this estimated token budget. Only used by the phased run.
+        compact_llm_text (bool): Strip the OCR text down to the lines that matter before prompting,
+            to at most max_llm_text_tokens estimated tokens. The local parser always sees the full text.
+        validate (bool): Check totals, VAT and tips of all pages after extraction; see validation.
+        reextract_invalid (bool): Extract failing pages once more with the LLM, bypassing the cache.
+        assignment_seed (int): Seed for the attendees and topics, so re-runs give the same ones.
+        global_assignment (bool): In the phased run, assign attendees and topics across all pages
+            at once (balanced, no repeats within a window) instead of per page; see assignment.
+        page_chunk_size (int): Pages per chunk of the phased run. Each chunk is rendered, OCRed and
+            extracted before the next one starts, and progress is saved after every chunk, so an
+            interrupted run resumes at the chunk it stopped in. The streaming run saves as often.
+        deduplicate (bool): Skip the extraction of pages whose text matches an earlier page (within
+            text_duplicate_distance of 64 bits, below 8 to be found for certain; see dedup) and whose
+            parsed total, date and, where both can be read, address are equal. Duplicates reuse the
+            earlier result, are linked with duplicate_of, listed in duplicates.json and left out of
+            the results store, so totals count them once.
+        """
+        resources = resources or {}
+        # Prefixes the page ids in metrics when several documents share one Metrics instance.
+        self.document_id = document_id
         self.pdf_file_path = pdf_file_path if pdf_file_path is not None else input(
             "Enter PDF source pdf_file_path: ")
         self.data_directory_path = data_directory_path if data_directory_path is not None else input(
             "Enter PDF data_directory_path: ")
         self.logger = logger
-        self.logger.add("output.log", level="DEBUG",
-                        format="{level}: {message}")
+        if not Main.log_sink_added:
+            self.logger.add("output.log", level="DEBUG",
+                            format="{level}: {message}")
+            Main.log_sink_added = True
+
+        # Spans, counters and histograms; exported to metrics_path (.json or .prom) after each run.
+        self.metrics = resources.get("metrics") or Metrics()
+        self.metrics_path = metrics_path
 
-        self.user_data_handler = UserDataHandler(
-            logger, self.data_directory_path)
-        self.pdf_handler = PdfHandler()
+        self.user_data_handler = resources.get("user_data_handler") or UserDataHandler(
+            logger, self.data_directory_path, seed=assignment_seed)
+        self.pdf_handler = resources.get("pdf_handler") or PdfHandler(logger)
+        # in_memory OCRs the rendered pixmaps directly; PNGs are then only written if save_images is set.
+        self.in_memory = in_memory
+        self.save_images = save_images
+        self.queue_size = queue_size
+        # Pages with a usable embedded text layer skip OCR.
+        self.use_text_layer = use_text_layer
+        self.min_text_layer_chars = min_text_layer_chars
+        self.page_sources = {}
+        self.signature_image_path = signature_image_path or os.path.join(
+            self.data_directory_path, "signature.png")
+        # The OCR worker pool is closed after each run unless it is shared.
+        self.owns_ocr_handler = "ocr_handler" not in resources
+        self.ocr_handler = resources.get("ocr_handler") or OcrHandler(
+            logger, workers=ocr_workers, chunk_size=ocr_chunk_size, preprocessor=ocr_preprocessor,
+            backend=ocr_backend)
         self.output_handler = OutputHandler
-        self.chains = Chains(logger)
+        self.extraction_handler = resources.get("extraction_handler") or ExtractionHandler(
+            logger, concurrency=extraction_concurrency,
+            requests_per_second=requests_per_second, max_retries=max_retries)
+        self.response_cache = resources.get("response_cache") or ResponseCache(
+            cache_path or os.path.join(
+                self.data_directory_path, "llm_cache.sqlite"),
+            max_bytes=cache_max_bytes, logger=logger)
+        # Retries are handled by the extraction handler.
+        self.chains = resources.get("chains") or Chains(
+            logger, base_url=llm_base_url, max_retries=0, cache=self.response_cache,
+            debug=llm_debug, metrics=self.metrics)
+        self.billing_data_json = self.chains.BillingDataJson(
+            self.chains, guard=self.extraction_handler.guard)
+        self.batch_billing_data_json = self.chains.BatchBillingDataJson(
+            self.billing_data_json, guard=self.extraction_handler.guard,
+            token_budget=llm_batch_token_budget, max_batch_size=llm_batch_size) if llm_batch_token_budget else None
+        # The local parser handles the common case; the LLM only sees receipts it can't read.
+        self.receipt_parser = ReceiptParser(logger) if use_local_parser else None
+        # Confirms duplicate texts even without the local parser.
+        self.total_parser = self.receipt_parser or ReceiptParser(logger)
+        self.min_parser_confidence = min_parser_confidence
+        self.text_compactor = TextCompactor(max_tokens=max_llm_text_tokens, logger=logger) \
+            if compact_llm_text else None
 
         self.processed_images_paths = []
         self.processed_images_text_paths = []
         self.extracted_json_paths = []
         self.extracted_billing_paths = []
+        self.page_chunk_size = max(1, page_chunk_size)
+        self.page_count = 0
+        self.pending_text_entries = {}
 
         # @TODO: does it make sense to build this into an agent with a testing/correction feature?
         self.extraction_steps = [
-            self.chains.BillingDataJson().run,
+            self.extract_billing_values,
             self.add_tip,
             self.add_topic,
             self.add_names,
         ]
+        # Steps that depend on user_data.txt; editing it only re-runs these.
+        self.user_data_steps = [self.add_topic, self.add_names]
+        self.assignment_seed = assignment_seed
+        self.assignment_engine = AssignmentEngine(
+            self.user_data_handler, seed=assignment_seed, logger=logger) if global_assignment else None
+
+        # Every written YAML is also upserted here, so year-end queries don't re-read the files.
+        self.results_store = resources.get("results_store") or ResultsStore(
+            results_store_path or os.path.join(self.data_directory_path, "results.sqlite"), logger=logger)
+
+        self.validator = ReceiptValidator(logger=logger) if validate else None
+        self.reextract_invalid = reextract_invalid
+        self.anomalies = {}
+        self.reextracted_pages = set()
+
+        # Hashes of earlier pages, shared across documents when it is passed in as a resource.
+        self.duplicate_index = resources.get("duplicate_index") or DuplicateIndex(
+            duplicate_index_path or os.path.join(self.data_directory_path, "duplicates.sqlite"),
+            logger=logger) if deduplicate else None
+        self.text_duplicate_distance = text_duplicate_distance
+        self.duplicates = {}
+
+        # Input hashes per stage, so re-runs only recompute stale artifacts.
+        self.manifest = Manifest(self.data_directory_path, logger=logger)
+        # document -> page -> stage -> file, updated as the stages write their artifacts.
+        self.artifact_catalog = resources.get("artifact_catalog") or ArtifactCatalog(
+            self.data_directory_path, logger=logger)
 
     def is_pdf(self, file_path):
         _, file_extension = os.path.splitext(file_path)
@@ -65,6 +188,40 @@ class Main:
             self.logger.error(
                 f"Error creating directory for data extraction for {self.data_directory_path}: {str(e)}")
 
+    def extract_billing_values(self, text):
+        """
+        Extract the billing values with the local receipt parser and fall back to the LLM
+        when required fields are missing, the totals don't reconcile or the confidence is too low.
+        """
+        if self.receipt_parser is not None:
+            values, confidence, problems = self.receipt_parser.parse(text)
+            if values is not None and confidence >= self.min_parser_confidence:
+                self.logger.info(
+                    f"Extracted values locally (confidence {confidence})")
+                self.metrics.increment("extractions_total", method="local")
+                return values
+            self.logger.info(
+                f"Falling back to the LLM (confidence {confidence:.2f}: {', '.join(problems) or 'too low'})")
+        self.metrics.increment("extractions_total", method="llm")
+        return self.billing_data_json.run(self.get_llm_text(text))
+
+    def get_llm_text(self, text: str, record_metrics: bool = True):
+        """
+        The text as sent to the LLM: compacted if configured; records the tokens saved.
+        The batch prefetch doesn't record them, since every page it prefetches is compacted
+        again when extract_billing_values reads its values from the cache.
+        """
+        if self.text_compactor is None:
+            return text
+        compacted, tokens_before, tokens_after = self.text_compactor.compact(text)
+        if not record_metrics:
+            return compacted
+        self.metrics.increment("llm_tokens_saved_total", tokens_before - tokens_after)
+        self.metrics.observe("llm_prompt_text_tokens", tokens_after, buckets=TOKEN_BUCKETS)
+        self.logger.debug(
+            f"Compacted the LLM text from {tokens_before} to {tokens_after} tokens")
+        return compacted
+
     """Modifier: adds names to the given text."""
 
     def add_tip(self, json_data, new_data=None):
@@ -81,7 +238,7 @@ class Main:
 
     def add_topic(self, json_data, new_data=None):
         new_data = json_data.copy()
-        new_data['topic'] = f"Projectbesprechung {self.user_data_handler.get_topic()}"
+        new_data['topic'] = f"Projectbesprechung {self.user_data_handler.get_topic(rng=self.get_receipt_random(json_data))}"
         return new_data
 
     """Modifier: adds names to the given text."""
@@ -92,92 +249,703 @@ class Main:
         name_count = math.floor(
             total / self.user_data_handler.get_billing_value_per_name(total))
         new_data["names"] = self.user_data_handler.get_names_billing_sub_set(
-            name_count)
+            name_count, rng=self.get_receipt_random(json_data))
         return new_data
 
-    def run(self, overwrite=False):
+    def get_receipt_random(self, json_data):
+        """Random numbers that only depend on the seed and the receipt's extracted values."""
+        values = {key: value for key, value in json_data.items() if key not in ("names", "topic")}
+        return random.Random(Manifest.hash_values(self.assignment_seed, values))
+
+    def assign_user_data(self, json_paths: list):
+        """
+        Assign attendees and topics to all pages in one pass and store them as an additional
+        data set in each page's JSON. Files are only rewritten when their assignment changed.
+        """
+        pages = self.get_assignment_pages(json_paths)
+        with self.metrics.span("assignment"):
+            assignments = self.assignment_engine.assign(
+                [(page_id, values) for page_id, (_, _, values) in pages.items()])
+        self.apply_assignments(pages, assignments)
+
+    def get_assignment_pages(self, json_paths: list):
+        """
+        Returns:
+            dict: (json path, data sets, values to assign to) by page id, for the fully extracted pages.
+        """
+        step_count = len(self.extraction_steps)
+        pages = {}
+        for json_path in json_paths:
+            with open(json_path, "r") as json_file:
+                data_sets = json.load(json_file)["data_sets"]
+            if len(data_sets) >= step_count:
+                pages[self.get_page_id(json_path)] = (json_path, data_sets, data_sets[step_count - 1])
+        return pages
+
+    def apply_assignments(self, pages: dict, assignments: dict):
+        """Write the assigned attendees and topics; returns the JSON paths that changed."""
+        step_count = len(self.extraction_steps)
+        changed = []
+        for page_id, (json_path, data_sets, values) in pages.items():
+            assigned = {**values, **assignments[page_id]}
+            if data_sets[step_count:] == [assigned]:
+                continue
+            output = self.output_handler(None)
+            for data_set in data_sets[:step_count] + [assigned]:
+                output.add(data_set)
+            write_text(json_path, output.encode())
+            changed.append(json_path)
+        self.logger.info(f"Updated the attendees and topics of {len(changed)} pages")
+        return changed
+
+    def get_extraction_config_hash(self):
+        """Everything besides the text that decides the extracted values."""
+        return Manifest.hash_values(
+            self.billing_data_json.prompt_template, self.billing_data_json.schema, self.chains.model,
+            self.receipt_parser is not None, self.min_parser_confidence,
+            self.text_compactor.get_config() if self.text_compactor is not None else None,
+            [step.__name__ for step in self.extraction_steps])
+
+    def get_user_data_hash(self):
+        """The user data and the assignment seed; changing either only re-runs the user data steps."""
+        return Manifest.hash_values(self.manifest.hash_file(os.path.join(
+            self.user_data_handler.directory, self.user_data_handler.user_data_file)), self.assignment_seed)
+
+    def get_extract_inputs(self, text_data: str):
+        return {"text": Manifest.hash_values(text_data, self.get_extraction_config_hash()),
+                "user_data": self.get_user_data_hash()}
+
+    def prefetch_llm_values(self, text_paths: list, overwrite=False):
+        """
+        Batch mode: extract the pages that will need the LLM with as few requests as possible.
+        The values land in the response cache, where extract_billing_values picks them up.
+        """
+        items = []
+        for text_path in text_paths:
+            key = os.path.splitext(os.path.basename(text_path))[0]
+            with open(text_path, "r") as text_file:
+                text_data = text_file.read()
+            entry = self.manifest.get("extract", key)
+            json_path = os.path.splitext(text_path)[0] + ".json"
+            if not overwrite and entry is not None and os.path.exists(json_path) and \
+                    entry["inputs"].get("text") == self.get_extract_inputs(text_data)["text"]:
+                continue
+            if self.receipt_parser is not None:
+                values, confidence, _ = self.receipt_parser.parse(text_data)
+                if values is not None and confidence >= self.min_parser_confidence:
+                    continue
+            if self.duplicate_index is not None and self.find_duplicate_values(text_path, text_data)[0] is not None:
+                continue
+            items.append((key, self.get_llm_text(text_data, record_metrics=False)))
+        if items:
+            with self.metrics.span("llm_batch_prefetch"):
+                self.batch_billing_data_json.run_many(items, self.extraction_handler.map)
+            self.logger.info(f"Prefetched LLM values of {len(items)} pages")
+
+    def extract_values_to_json(self, text_path, overwrite=False):
+        """
+        Extract values from the text and save it to a json file.
+        Only the user data steps run again when just user_data.txt changed.
+        """
+        json_values_text_path = os.path.splitext(text_path)[0] + ".json"
+        page = self.get_page_id(text_path)
+        key = os.path.splitext(os.path.basename(text_path))[0]
+
+        with open(text_path, "r") as text_file:
+            text_data = text_file.read()
+        inputs = self.get_extract_inputs(text_data)
+        entry = self.manifest.get("extract", key)
+
+        steps = self.extraction_steps
+        output = self.output_handler(text_data)
+        if not overwrite and os.path.exists(json_values_text_path):
+            if self.manifest.is_fresh("extract", key, inputs) or \
+                    self.manifest.adopt("extract", key, inputs, [json_values_text_path]):
+                self.metrics.increment("pages_skipped_total",
+                                       stage="extract", reason="fresh")
+                if self.duplicate_index is not None:
+                    self.index_text(text_path, text_data, json_values_text_path)
+                return json_values_text_path
+            if entry is not None and entry["inputs"].get("text") == inputs["text"]:
+                first_user_step = min(steps.index(step)
+                                      for step in self.user_data_steps)
+                with open(json_values_text_path, "r") as json_file:
+                    data_sets = json.load(json_file)["data_sets"]
+                if len(data_sets) >= first_user_step:
+                    for data_set in data_sets[:first_user_step]:
+                        output.add(data_set)
+                    steps = steps[first_user_step:]
+                    self.metrics.increment("pages_skipped_total",
+                                           stage="extract", reason="user_data_only")
+
+        if steps[0] == self.extract_billing_values and self.duplicate_index is not None:
+            self.pop_duplicate(key, "text")
+            values, match = self.find_duplicate_values(text_path, text_data)
+            if values is not None:
+                self.record_duplicate(key, "text", match)
+                self.metrics.increment("pages_skipped_total",
+                                       stage="extract", reason="duplicate")
+                output.add(values)
+                steps = steps[1:]
+
+        for step in steps:
+            with self.metrics.span(step.__name__, page=page):
+                step_response = step(output.get_cur())
+            output.add(step_response)
+
+        self.logger.info(
+            f"Writing extracted values text file: {json_values_text_path}")
+        write_text(json_values_text_path, output.encode())
+        self.manifest.record("extract", key, inputs, [json_values_text_path])
+        if self.duplicate_index is not None:
+            self.index_text(text_path, text_data, json_values_text_path)
+
+        return json_values_text_path
+
+    def find_duplicate_values(self, text_path: str, text_data: str):
+        """
+        Text check before extraction: the extracted values of an earlier page with nearly the
+        same text, with duplicate_of set to that page.
+
+        Returns:
+            tuple: The values and the (page key, distance) match, or None and None.
+        """
+        value = text_hash(text_data)
+        if value is None:
+            return None, None
+        match = self.duplicate_index.find("text", value, self.text_duplicate_distance,
+                                          exclude=self.duplicate_index.get_key(text_path))
+        if match is None:
+            return None, None
+        try:
+            with open(self.duplicate_index.get_path(match[0], ".txt"), "r") as text_file:
+                original_text = text_file.read()
+            with open(self.duplicate_index.get_path(match[0], ".json"), "r") as json_file:
+                data_sets = json.load(json_file)["data_sets"]
+        except (OSError, ValueError, KeyError):
+            return None, None
+        if not data_sets or not self.is_same_receipt(text_data, original_text):
+            return None, None
+        return {**data_sets[0], "duplicate_of": match[0]}, match
+
+    def is_same_receipt(self, text_data: str, original_text: str):
+        """
+        Receipts of the same restaurant share most of their text; a near-identical text is only
+        taken for a copy if both totals and both dates can be read and are equal, and so are
+        the addresses where both can be read.
+        """
+        receipts = []
+        for text in (text_data, original_text):
+            lines = [line.strip() for line in text.splitlines() if line.strip()]
+            receipts.append((self.total_parser.get_total(lines), self.total_parser.get_date(text),
+                             self.total_parser.get_location(lines)[1]))
+        (total, date, address), (original_total, original_date, original_address) = receipts
+        if total is None or date is None or (total, date) != (original_total, original_date):
+            return False
+        return address is None or original_address is None or address == original_address
+
+    def index_text(self, text_path: str, text_data: str, json_path: str):
+        """Index the text of an extracted page that isn't a duplicate itself, so later copies can reuse it."""
+        key = self.duplicate_index.get_key(text_path)
+        source = Manifest.hash_values(text_data)
+        if self.duplicate_index.get_source("text", key) == source:
+            return
+        with open(json_path, "r") as json_file:
+            data_sets = json.load(json_file)["data_sets"]
+        value = text_hash(text_data)
+        if value is None or not data_sets or "duplicate_of" in data_sets[0]:
+            self.duplicate_index.remove("text", key)
+            return
+        self.duplicate_index.add("text", key, value, source)
+
+    def record_duplicate(self, page_key: str, check: str, match: tuple):
+        self.logger.info(f"{page_key} duplicates {match[0]} ({check}, distance {match[1]}), reusing its result")
+        self.duplicates.setdefault(page_key, {})[check] = {"duplicate_of": match[0], "distance": match[1]}
+
+    def pop_duplicate(self, page_key: str, check: str):
+        """Forget a page's earlier match before it is checked again."""
+        if self.duplicates.get(page_key, {}).pop(check, None) is not None and not self.duplicates[page_key]:
+            del self.duplicates[page_key]
+
+    def load_duplicates(self):
+        try:
+            with open(os.path.join(self.data_directory_path, "duplicates.json"), "r") as duplicates_file:
+                return json.load(duplicates_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_duplicates(self):
+        if self.duplicate_index is not None:
+            write_text(os.path.join(self.data_directory_path, "duplicates.json"),
+                       json.dumps(self.duplicates, indent=2, sort_keys=True))
+
+    def reextract_page(self, text_path: str):
+        """
+        Extract a page again with the LLM only, without the local parser and the response cache,
+        and replace its cached values, JSON and YAML.
+        """
+        json_values_text_path = os.path.splitext(text_path)[0] + ".json"
+        key = os.path.splitext(os.path.basename(text_path))[0]
+        with open(text_path, "r") as text_file:
+            text_data = text_file.read()
+        llm_text = self.get_llm_text(text_data)
+        with self.metrics.span("reextract", page=self.get_page_id(text_path)):
+            values = self.billing_data_json.invoke(llm_text)
+        if self.chains.cache is not None:
+            self.chains.cache.set(self.billing_data_json.get_cache_key(llm_text), values)
+
+        output = self.output_handler(text_data)
+        output.add(values)
+        for step in self.extraction_steps:
+            if step != self.extract_billing_values:
+                output.add(step(output.get_cur()))
+        self.logger.info(
+            f"Writing re-extracted values text file: {json_values_text_path}")
+        write_text(json_values_text_path, output.encode())
+        inputs = self.get_extract_inputs(text_data)
+        self.manifest.record("extract", key, inputs, [json_values_text_path])
+        # One attempt per text and extraction settings; a page that stays invalid isn't sent again.
+        self.manifest.record("reextract", key, inputs["text"])
+        self.create_billing_yml(json_values_text_path, overwrite=True)
+        return json_values_text_path
+
+    def was_reextracted(self, text_path: str):
+        """True if the page was re-extracted before with the same text and extraction settings."""
+        key = os.path.splitext(os.path.basename(text_path))[0]
+        with open(text_path, "r") as text_file:
+            inputs = self.get_extract_inputs(text_file.read())
+        return self.manifest.is_fresh("reextract", key, inputs["text"])
+
+    def validate_extractions(self, json_paths: list):
+        """
+        Check all extracted pages at once, re-extract the failing ones if configured and
+        write the remaining anomalies to validation.json.
+        """
+        self.reextracted_pages = set()
+        if self.validator is None:
+            return {}
+        directory = self.data_directory_path
+        with self.metrics.span("validate"):
+            anomalies = self.validator.validate(self.validator.load_files(json_paths, directory))
+        self.metrics.increment("pages_invalid_total", len(anomalies))
+        if anomalies and self.reextract_invalid:
+            text_paths = [os.path.join(directory, f"{page_id}.txt") for page_id in sorted(anomalies)]
+            pending = [text_path for text_path in text_paths if not self.was_reextracted(text_path)]
+            self.metrics.increment("pages_skipped_total", len(text_paths) - len(pending),
+                                   stage="reextract", reason="attempted")
+            if pending:
+                self.logger.info(f"Re-extracting {len(pending)} pages that failed validation")
+                reextracted = self.extraction_handler.map(self.reextract_page, pending)
+                self.reextracted_pages = {os.path.splitext(os.path.basename(text_path))[0]
+                                          for text_path in pending}
+                remaining = self.validator.validate(self.validator.load_files(reextracted, directory))
+                self.metrics.increment("pages_reextracted_total", len(pending) - len(remaining))
+                anomalies = {page_id: reasons for page_id, reasons in anomalies.items()
+                             if page_id not in self.reextracted_pages}
+                anomalies.update(remaining)
+        for page_id, reasons in sorted(anomalies.items()):
+            self.logger.warning(f"{page_id}: {'; '.join(reasons)}")
+        write_text(os.path.join(directory, "validation.json"),
+                   json.dumps(anomalies, indent=2, sort_keys=True))
+        self.anomalies = anomalies
+        return anomalies
+
+    def create_billing_yml(self, json_file_path: str, overwrite=False):
+        """
+        Create the billing text file.
+        """
+        billing_text_path = os.path.splitext(json_file_path)[0] + ".yml"
+        key = os.path.splitext(os.path.basename(json_file_path))[0]
+        inputs = self.manifest.hash_file(json_file_path)
+
+        if overwrite or not (self.manifest.is_fresh("yaml", key, inputs) or
+                             self.manifest.adopt("yaml", key, inputs, [billing_text_path])):
+            with self.metrics.span("yaml", page=self.get_page_id(json_file_path)), \
+                    open(json_file_path, "r") as json_file:
+                json_data = json.load(json_file)
+                data_sets = json_data["data_sets"] or None
+                if data_sets is not None and len(data_sets) > 0:
+                    data_set = data_sets[-1]
+                    pretty_printed_json = yaml.dump(
+                        data_set, allow_unicode=True, sort_keys=False, Dumper=IndentDumper)
+
+                    self.logger.info(
+                        f"Writing billing text file: {billing_text_path}")
+                    write_text(billing_text_path, pretty_printed_json)
+                    document = self.document_id or os.path.basename(
+                        os.path.normpath(self.data_directory_path))
+                    # A copy of an earlier receipt would count twice in the totals.
+                    if "duplicate_of" in data_set:
+                        self.results_store.remove(document, key)
+                    else:
+                        self.results_store.add(document, key, data_set, json_file_path)
+                    self.manifest.record(
+                        "yaml", key, inputs, [billing_text_path])
+
+        return billing_text_path
+
+    def get_text_inputs(self, pdf_hash: str, page_index: int):
+        return Manifest.hash_values(pdf_hash, page_index, self.use_text_layer, self.min_text_layer_chars)
+
+    def invalidate_stale_pages(self, overwrite=False):
+        """
+        Delete page images and texts whose source PDF or text settings changed, and truncated
+        ones left by an interrupted run, so the render and OCR stages recreate exactly those.
+        Returns the page count.
+        """
+        pdf_hash = self.manifest.hash_file(self.pdf_file_path)
+        with self.pdf_handler.lock:
+            with self.pdf_handler.fitz.open(self.pdf_file_path) as doc:
+                page_count = doc.page_count
+        needs_image = self.save_images or not self.in_memory
+        self.pending_text_entries = {}
+        for i in range(page_count):
+            job = PageJob(i, self.pdf_file_path, self.data_directory_path)
+            key = f"page_{i}"
+            inputs = self.get_text_inputs(pdf_hash, i)
+            outputs = [job.text_path] + ([job.image_path] if needs_image else [])
+            if not overwrite and (self.manifest.is_fresh("text", key, inputs) or
+                                  self.manifest.adopt("text", key, inputs, outputs)):
+                continue
+            # Recorded by record_text_entry once the page's outputs are written again.
+            self.pending_text_entries[i] = (inputs, outputs)
+            if overwrite:
+                continue
+            if self.manifest.get("text", key) is not None:
+                self.logger.info(f"Source of {key} changed, recomputing it")
+                for path in (job.text_path, job.image_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.artifact_catalog.remove(job.text_path, job.image_path)
+            elif os.path.exists(job.image_path) and not is_complete(job.image_path):
+                self.logger.info(f"Image of {key} is incomplete, recomputing it")
+                os.remove(job.image_path)
+                self.artifact_catalog.remove(job.image_path)
+        return page_count
+
+    def record_text_entry(self, i: int):
+        """
+        Record the text entry of a page that invalidate_stale_pages found stale, once its outputs
+        are written; a run interrupted before that recomputes the page instead of trusting them.
+        """
+        pending = self.pending_text_entries.get(i)
+        if pending is not None and all(is_complete(path) for path in pending[1]):
+            self.manifest.record("text", f"page_{i}", *pending)
+            del self.pending_text_entries[i]
+
+    def get_document_inputs(self):
+        return Manifest.hash_values(
+            self.manifest.hash_file(self.pdf_file_path), self.use_text_layer, self.min_text_layer_chars,
+            self.get_extraction_config_hash(), self.get_user_data_hash())
+
+    def render_page_jobs(self, overwrite=False):
+        """
+        Pipeline source: yield one PageJob per page, writing the page image first where it is needed.
+        Runs on a single thread and is throttled by the first pipeline queue. The document is
+        reopened for every chunk of pages, so its page cache doesn't grow with the scan.
+        """
+        with self.pdf_handler.lock:
+            with self.pdf_handler.fitz.open(self.pdf_file_path) as doc:
+                page_count = doc.page_count
+        for start in range(0, page_count, self.page_chunk_size):
+            with self.pdf_handler.lock:
+                doc = self.pdf_handler.fitz.open(self.pdf_file_path)
+            try:
+                for i in range(start, min(start + self.page_chunk_size, page_count)):
+                    yield self.render_page_job(doc, i, overwrite)
+            finally:
+                with self.pdf_handler.lock:
+                    doc.close()
+
+    def render_page_job(self, doc, i: int, overwrite=False):
+        job = PageJob(i, self.pdf_file_path, self.data_directory_path)
+        job.source = "ocr"
+        if self.use_text_layer:
+            start_time = time.time()
+            with self.pdf_handler.lock:
+                text = self.pdf_handler.get_text_layer(
+                    doc[i], self.min_text_layer_chars)
+            if text is not None:
+                job.source = "text_layer"
+                self.metrics.increment(
+                    "pages_skipped_total", stage="ocr", reason="text_layer")
+                if overwrite or not os.path.exists(job.text_path):
+                    write_text(job.text_path, text)
+            job.durations["text_layer"] = time.time() - start_time
+            self.metrics.record_span(
+                "text_layer", job.durations["text_layer"], page=self.get_page_id(job.image_path))
+        self.page_sources[i] = job.source
+        needs_image = self.save_images or not self.in_memory
+        if needs_image and (overwrite or not os.path.exists(job.image_path)):
+            start_time = time.time()
+            with self.pdf_handler.lock:
+                save_pixmap(doc[i].get_pixmap(), job.image_path)
+            job.durations["render"] = time.time() - start_time
+            self.metrics.record_span(
+                "render", job.durations["render"], page=self.get_page_id(job.image_path))
+            self.logger.info(f'Created image: {job.image_path}')
+        return job
+
+    def create_receipt_pdf(self, job: PageJob, overwrite=False):
+        """
+        Combine the billing text, the page image and the signature into the receipt PDF.
+        """
+        if not os.path.exists(job.billing_path) or not os.path.exists(job.image_path):
+            self.logger.warning(
+                f"Skipping receipt PDF for page {job.index}: billing text or image missing")
+            return job
+        key = f"page_{job.index}"
+        inputs = Manifest.hash_values(*(self.manifest.hash_file(path) for path in (
+            job.billing_path, job.image_path, self.signature_image_path)))
+        if not overwrite and (self.manifest.is_fresh("pdf", key, inputs) or
+                              self.manifest.adopt("pdf", key, inputs, [job.receipt_path])):
+            return job
+        with self.metrics.span("pdf", page=self.get_page_id(job.image_path)), self.pdf_handler.lock:
+            self.pdf_handler.create_pdf_from_files(
+                files=[job.billing_path, job.image_path],
+                target=job.receipt_path,
+                path_to_signature_image=self.signature_image_path)
+        self.manifest.record("pdf", key, inputs, [job.receipt_path])
+        self.logger.info(f"Created receipt PDF: {job.receipt_path}")
+        return job
+
+    def create_receipt_pdfs(self, billing_paths: list, overwrite=False):
+        """
+        Create the receipt PDFs for the pages of the given billing text files, e.g. after a phased
+        run; fresh ones are skipped. Returns the paths of the receipt PDFs that exist.
+        """
+        jobs = [PageJob(int(os.path.splitext(os.path.basename(path))[0].split("_")[-1]),
+                        self.pdf_file_path, os.path.dirname(path)) for path in billing_paths]
+        for job in jobs:
+            self.create_receipt_pdf(job, overwrite)
+        receipt_paths = [job.receipt_path for job in jobs if os.path.exists(job.receipt_path)]
+        self.artifact_catalog.add(*receipt_paths)
+        self.checkpoint()
+        return receipt_paths
+
+    def run_streaming(self, overwrite=False):
+        """
+        Move each page through render -> OCR -> extract -> YAML -> receipt PDF as soon as
+        its previous stage is done. Yields the finished PageJobs in completion order.
+        """
+        def _ocr(job: PageJob):
+            if job.source == "ocr" and (overwrite or not os.path.exists(job.text_path)):
+                if self.in_memory:
+                    # Without worker processes the page is rendered on this thread, next to the render stage.
+                    with self.pdf_handler.lock if self.ocr_handler.workers == 1 else contextlib.nullcontext():
+                        image_text, duration = self.ocr_handler.ocr_page(
+                            pdf_path=job.pdf_file_path, page_index=job.index)
+                else:
+                    image_text, duration = self.ocr_handler.ocr_page(
+                        image_path=job.image_path)
+                self.metrics.record_span(
+                    "ocr", duration, page=self.get_page_id(job.image_path))
+                self.logger.info(
+                    f"Writing text file: {job.text_path} (OCR {duration:.2f} seconds)")
+                write_text(job.text_path, image_text)
+            self.record_text_entry(job.index)
+            return job
+
+        def _extract(job: PageJob):
+            self.extract_values_to_json(job.text_path, overwrite)
+            return job
+
+        def _billing_yml(job: PageJob):
+            self.create_billing_yml(job.json_path, overwrite)
+            return job
+
+        pipeline = Pipeline([
+            Stage("ocr", _ocr, workers=self.ocr_handler.workers),
+            Stage("extract", _extract,
+                  workers=self.extraction_handler.concurrency),
+            Stage("yaml", _billing_yml),
+            Stage("pdf", lambda job: self.create_receipt_pdf(job, overwrite)),
+        ], queue_size=self.queue_size, logger=self.logger)
+
+        start_time = time.time()
+        try:
+            for finished, job in enumerate(pipeline.run(self.render_page_jobs(overwrite)), 1):
+                self.artifact_catalog.add(job.image_path, job.text_path, job.json_path,
+                                          job.billing_path, job.receipt_path)
+                if job.error is None:
+                    self.logger.info(
+                        f"Page {job.index} ({job.source}) finished after {time.time() - start_time:.2f} seconds")
+                if finished % self.page_chunk_size == 0:
+                    self.checkpoint()
+                yield job
+        finally:
+            if self.owns_ocr_handler:
+                self.ocr_handler.close()
+            self.save_page_sources()
+            self.save_duplicates()
+            self.export_metrics()
+
+    def get_page_id(self, file_path: str):
+        page_id = os.path.splitext(os.path.basename(file_path))[0]
+        return f"{self.document_id}/{page_id}" if self.document_id else page_id
+
+    def record_page_durations(self, stage: str, page_durations: dict):
+        """Turn durations measured by the handlers (and their worker processes) into spans."""
+        while page_durations:
+            path, duration = page_durations.popitem()
+            page = self.get_page_id(path) if isinstance(
+                path, str) else self.get_page_id(f"page_{path[1]}")
+            self.metrics.record_span(stage, duration, page=page)
+
+    def export_metrics(self):
+        if self.metrics_path is not None:
+            self.metrics.export(self.metrics_path)
+            self.logger.info(f"Wrote metrics: {self.metrics_path}")
+
+    def checkpoint(self):
+        """Save the progress so far; a run that is killed after this resumes from here."""
+        self.manifest.save()
+        self.artifact_catalog.save()
+
+    def save_page_sources(self):
+        """Record for each page whether its text came from the text layer or from OCR."""
+        page_sources_path = os.path.join(
+            self.data_directory_path, "page_sources.json")
+        write_text(page_sources_path, json.dumps(
+            {f"page_{i}": source for i, source in sorted(self.page_sources.items())}, indent=2))
+        sources = list(self.page_sources.values())
+        self.logger.info(
+            f"{sources.count('text_layer')} of {len(sources)} pages used the text layer, the rest OCR")
+
+    def run(self, overwrite=False, streaming=False):
         if not os.path.exists(self.pdf_file_path) or not os.path.isfile(self.pdf_file_path) or not self.is_pdf(self.pdf_file_path):
             self.logger.error("The PDF file doesn't exist.")
             exit(1)
 
         self.prepare_data_directory()
-        self.user_data_handler.run()
+        partial_files = remove_partial_files(self.data_directory_path)
+        if partial_files:
+            self.logger.info(f"Removed {partial_files} partial files of an interrupted run")
+        if not self.user_data_handler.get_names():
+            self.user_data_handler.run()
         self.logger.info(f"Begin processing PDF: {self.pdf_file_path}")
 
-        """Create images from the PDF and save them to the data directory."""
-        self.processed_images_paths = self.pdf_handler.create_images_for_pdf(
-            self.pdf_file_path, self.data_directory_path)
-
-        def _extract_text_from_image(image_path):
-            """
-            Extract text from from the image and save it to a text file.
-            """
-            text_file_path = os.path.splitext(image_path)[0] + ".txt"
-            self.processed_images_text_paths.append(text_file_path)
-            if not os.path.exists(text_file_path) or overwrite:
-                image = Image.open(image_path)
-                image_text = pytesseract.image_to_string(image)
-                with open(text_file_path, "w") as text_file:
-                    self.logger.info(f"Writing text file: {text_file_path}")
-                    text_file.write(image_text)
-
-        for processed_images_path in self.processed_images_paths:
-            _extract_text_from_image(processed_images_path)
-
-        def _extract_values_to_json(text_path):
-            """
-            Extract values from the text and save it to a json file.
-            """
-            json_values_text_path = os.path.splitext(text_path)[0] + ".json"
-            self.extracted_json_paths.append(json_values_text_path)
-
-            if not os.path.exists(json_values_text_path) or overwrite:
-                with open(processed_image_text_path, "r") as text_file:
-                    text_data = text_file.read()
-
-                    output = self.output_handler(text_data)
-
-                    for step in self.extraction_steps:
-                        start_time = time.time()
-                        step_response = step(output.get_cur())
-                        output.add(step_response)
-                        end_time = time.time()
-                        duration = end_time - start_time
-                        self.logger.info(
-                            f"Step duration: {duration} seconds" or text_data)
-
-                    with open(json_values_text_path, "w") as billing_text_file:
-                        self.logger.info(
-                            f"Writing extracted values text file: {json_values_text_path}")
-                        json_string = output.encode()
-                        billing_text_file.write(json_string)
-
-        for processed_image_text_path in self.processed_images_text_paths:
-            _extract_values_to_json(processed_image_text_path)
-
-        def _create_billing_yml(json_file_path: str):
-            """
-            Create the billing text file.
-            """
-            billing_text_path = os.path.splitext(json_file_path)[0] + ".yml"
-            self.extracted_billing_paths.append(billing_text_path)
-
-            if not os.path.exists(billing_text_path) or overwrite:
-                with open(json_file_path, "r") as json_file:
-                    json_data = json.load(json_file)
-                    data_sets = json_data["data_sets"] or None
-                    if data_sets is not None and len(data_sets) > 0:
-                        data_set = data_sets[-1]
-                        pretty_printed_json = yaml.dump(
-                            data_set, allow_unicode=True, sort_keys=False, Dumper=IndentDumper)
-
-                        with open(billing_text_path, "w") as billing_text_file:
-                            self.logger.info(
-                                f"Writing billing text file: {billing_text_path}")
-                            billing_text_file.write(pretty_printed_json)
-
-        for extracted_json_path in self.extracted_json_paths:
-            _create_billing_yml(extracted_json_path)
+        # Results describe the last run only.
+        self.page_sources = {}
+        self.duplicates = self.load_duplicates()
+        self.processed_images_paths = []
+        self.processed_images_text_paths = []
+        self.extracted_json_paths = []
+        self.extracted_billing_paths = []
+
+        self.manifest.load()
+        document_inputs = self.get_document_inputs()
+        if not overwrite and self.manifest.is_fresh("document", "document", document_inputs):
+            self.logger.info(
+                f"Nothing to do, {self.pdf_file_path} and its settings are unchanged")
+            self.extracted_billing_paths = self.manifest.get(
+                "document", "document")["outputs"]
+            return [] if streaming else self.extracted_billing_paths
+        self.page_count = self.invalidate_stale_pages(overwrite)
+        # The invalidated pages are recomputed even if the run is interrupted again.
+        self.manifest.save()
+
+        try:
+            if streaming:
+                results = list(self.run_streaming(overwrite))
+                if any(job.error is not None for job in results):
+                    return results
+                self.extracted_billing_paths = [job.billing_path for job in results]
+                self.validate_extractions([job.json_path for job in results])
+                # Receipt PDFs of re-extracted pages are stale.
+                for job in results:
+                    if f"page_{job.index}" in self.reextracted_pages:
+                        self.create_receipt_pdf(job, overwrite)
+            else:
+                self.run_phases(overwrite)
+            self.manifest.record("document", "document", document_inputs,
+                                 sorted(self.extracted_billing_paths))
+        finally:
+            if self.owns_ocr_handler:
+                self.ocr_handler.close()
+            self.manifest.save()
+            self.artifact_catalog.save()
+        return results if streaming else self.extracted_billing_paths
+
+    def run_phases(self, overwrite=False):
+        """
+        Process the document phase by phase, page_chunk_size pages at a time: every page of a chunk
+        goes through a stage before the next one starts. Validation and the assignment of attendees
+        need all pages and run after the last chunk, followed by the billing text files.
+        """
+        for start in range(0, self.page_count, self.page_chunk_size):
+            pages = range(start, min(start + self.page_chunk_size, self.page_count))
+            self.run_chunk(pages, overwrite)
+            self.checkpoint()
+            self.logger.info(f"Processed pages {pages.start} to {pages.stop - 1} of {self.page_count}")
+        self.save_page_sources()
+        self.save_duplicates()
+
+        """Check totals, VAT and tips across the document and re-extract failing pages."""
+        self.validate_extractions(self.extracted_json_paths)
+
+        """Assign attendees and topics across all pages at once."""
+        if self.assignment_engine is not None:
+            self.assign_user_data(self.extracted_json_paths)
+
+        """Create the billing text files."""
+        for start in range(0, len(self.extracted_json_paths), self.page_chunk_size):
+            self.extracted_billing_paths += [
+                self.create_billing_yml(extracted_json_path, overwrite)
+                for extracted_json_path in self.extracted_json_paths[start:start + self.page_chunk_size]]
+            self.checkpoint()
+        self.artifact_catalog.add(*self.extracted_billing_paths)
+        self.export_metrics()
+
+    def run_chunk(self, pages: range, overwrite=False):
+        """Text layer, render, OCR and extraction of one chunk of pages."""
+        """Take the text of native PDF pages from their text layer; only the rest goes through OCR."""
+        page_sources = {}
+        if self.use_text_layer:
+            with self.pdf_handler.lock:
+                page_sources = self.pdf_handler.extract_text_layers(
+                    self.pdf_file_path, self.data_directory_path, overwrite=overwrite,
+                    min_chars=self.min_text_layer_chars, pages=pages)
+        text_layer_pages = {i for i, source in page_sources.items()
+                            if source == "text_layer"}
+        self.metrics.increment("pages_skipped_total", len(text_layer_pages),
+                               stage="ocr", reason="text_layer")
+
+        if self.in_memory:
+            """Render and OCR the pages in memory, one process per worker, and save the text files."""
+            # Without worker processes the pages are rendered on this thread.
+            with self.pdf_handler.lock if self.ocr_handler.workers == 1 else contextlib.nullcontext():
+                images_paths, text_paths = self.ocr_handler.extract_texts_from_pdf(
+                    self.pdf_file_path, self.data_directory_path, overwrite=overwrite,
+                    save_images=self.save_images, skip_pages=text_layer_pages, pages=pages)
+        else:
+            """Create images from the PDF and save them to the data directory."""
+            with self.pdf_handler.lock:
+                images_paths = self.pdf_handler.create_images_for_pdf(
+                    self.pdf_file_path, self.data_directory_path, pages=pages)
+
+            """Extract text from the images, one process per worker, and save it to text files."""
+            ocr_images_paths = [path for i, path in zip(pages, images_paths)
+                                if i not in text_layer_pages]
+            self.ocr_handler.extract_texts(ocr_images_paths, overwrite=overwrite)
+            text_paths = [self.ocr_handler.get_text_path(path)
+                          for path in images_paths]
+        self.record_page_durations("render", self.pdf_handler.page_durations)
+        self.record_page_durations("ocr", self.ocr_handler.page_durations)
+        for i in pages:
+            self.page_sources[i] = page_sources.get(i, "ocr")
+            self.record_text_entry(i)
+
+        """Extract values from the text files, extraction_concurrency pages at a time."""
+        if self.batch_billing_data_json is not None:
+            self.prefetch_llm_values(text_paths, overwrite)
+        json_paths = self.extraction_handler.map(
+            lambda text_path: self.extract_values_to_json(text_path, overwrite), text_paths)
+
+        self.processed_images_paths += images_paths
+        self.processed_images_text_paths += text_paths
+        self.extracted_json_paths += json_paths
+        self.artifact_catalog.add(*images_paths, *text_paths, *json_paths)
 
 
 class Secondary(Main):
@@ -186,20 +954,16 @@ class Secondary(Main):
                          data_directory_path=data_directory_path)
         self.logger = logger
 
-    def get_file_groups(self, directory: str, label_key: str) -> []:
-        pattern = re.compile(r"page_(\d+)")
-
-        files_by_index = defaultdict(list)
-
-        for file_name in os.listdir(directory):
-            match = pattern.search(file_name)
-            if match:
-                index = int(match.group(1))
-                files_by_index[index].append(
-                    os.path.join(directory, file_name))
-
-        return [files_by_index[index]
-                for index in sorted(files_by_index)]
+    def get_file_groups(self, directory: str, label_key: str, stages: [] = None) -> []:
+        """
+        The page artifacts in directory grouped by page, looked up in the artifact catalog.
+        The directory is only scanned if the catalog doesn't know it yet.
+        """
+        document = self.artifact_catalog.get_document(directory)
+        if not self.artifact_catalog.has_document(document):
+            self.artifact_catalog.scan(directory)
+            self.artifact_catalog.save()
+        return self.artifact_catalog.get_groups(document, stages)
 
     def get_file_sub_group(self, group: [], extensions: []) -> []:
         sub_group = []
@@ -231,26 +995,19 @@ if __name__ == "__main__":
         pdf_file_path=f"{run_folder}/IAS-e-q.pdf",
         data_directory_path=dest_folder,
     )
-    groups = secondary.get_file_groups(dest_folder, "page_")
-    subgroups = []
-    for i in range(len(groups)):
-        group = groups[i]
-        file_extensions = ['.yml', '.png']
-        subgroup = next(secondary.get_file_sub_group(group, file_extensions))
-        # Reorder the subgroup according to the file extensions in extensions
-        subgroup.sort(key=lambda x: file_extensions.index(
-            os.path.splitext(x)[1]))
-        subgroups.append(subgroup)
-
-    for i in range(len(subgroups)):
-        group = subgroups[i]
-        secondary.pdf_handler.create_pdf_from_files(
-            files=group,
-            target=f"{dest_folder}/page_{i}.pdf",
-            path_to_signature_image=f"{dest_folder}/signature.png"
-        )
-
-        f = 1
+    # Billing text first, then the page image; the catalog returns them in this order.
+    subgroups = secondary.get_file_groups(
+        dest_folder, "page_", stages=["billing", "image"])
+
+    targets = [f"{dest_folder}/page_{i}.pdf" for i in range(len(subgroups))]
+    secondary.pdf_handler.create_pdfs_from_groups(
+        list(zip(subgroups, targets)),
+        path_to_signature_image=f"{dest_folder}/signature.png",
+        combined_target=f"{run_folder}/{dest_id}_receipts.pdf",
+        workers=os.cpu_count() or 1,
+    )
+    secondary.artifact_catalog.add(*targets)
+    secondary.artifact_catalog.save()
 
 
 # @TODO:
@@ -0,0 +1,130 @@
+import os
+import re
+import json
+import logging
+import threading
+
+from atomic_files import write_text
+
+
+ARTIFACT_PATTERN = re.compile(r"^page_(\d+)\.(\w+)$")
+STAGES = {
+    ".png": "image",
+    ".txt": "text",
+    ".json": "json",
+    ".yml": "billing",
+    ".pdf": "receipt",
+}
+
+
+class ArtifactCatalog:
+    """
+    Persistent index document -> page -> stage -> file of the page artifacts below a data
+    directory. Documents are keyed by their directory relative to the catalog root and paths
+    are stored relative to it, so lookups never have to list or match directory contents.
+    """
+
+    def __init__(self, directory: str, file_name: str = "catalog.json", logger=None):
+        self.directory = directory
+        self.path = os.path.join(directory, file_name)
+        self.logger = logger or logging
+        self.lock = threading.Lock()
+        # Held for a whole save, so documents saving at the same time don't share the temporary file.
+        self.save_lock = threading.Lock()
+        self.documents = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as catalog_file:
+                    self.documents = json.load(catalog_file).get("documents", {})
+            except (OSError, ValueError) as e:
+                self.logger.warning(
+                    f"Ignoring unreadable catalog {self.path}: {str(e)}")
+                self.documents = {}
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                if not self.changed:
+                    return
+                content = json.dumps(
+                    {"version": 1, "documents": self.documents}, indent=1, sort_keys=True)
+                self.changed = False
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            write_text(self.path, content)
+
+    def get_document(self, directory: str):
+        document = os.path.relpath(directory, self.directory)
+        return document.replace(os.sep, "/")
+
+    @staticmethod
+    def parse(path: str):
+        """(page index, stage) of a page artifact, or None for any other file."""
+        match = ARTIFACT_PATTERN.match(os.path.basename(path))
+        if match is None:
+            return None
+        stage = STAGES.get(f".{match.group(2)}")
+        return (int(match.group(1)), stage) if stage else None
+
+    def add(self, *paths: str):
+        """Record existing page artifacts; other files are ignored."""
+        for path in paths:
+            if path is None:
+                continue
+            parsed = self.parse(path)
+            if parsed is None or not os.path.exists(path):
+                continue
+            page, stage = parsed
+            document = self.get_document(os.path.dirname(path))
+            relative_path = os.path.relpath(path, self.directory).replace(os.sep, "/")
+            with self.lock:
+                pages = self.documents.setdefault(document, {})
+                stages = pages.setdefault(str(page), {})
+                if stages.get(stage) != relative_path:
+                    stages[stage] = relative_path
+                    self.changed = True
+
+    def remove(self, *paths: str):
+        for path in paths:
+            parsed = self.parse(path)
+            if parsed is None:
+                continue
+            page, stage = parsed
+            document = self.get_document(os.path.dirname(path))
+            with self.lock:
+                stages = self.documents.get(document, {}).get(str(page), {})
+                if stages.pop(stage, None) is not None:
+                    self.changed = True
+
+    def get(self, document: str, page: int, stage: str):
+        with self.lock:
+            relative_path = self.documents.get(document, {}).get(str(page), {}).get(stage)
+        return os.path.join(self.directory, relative_path) if relative_path else None
+
+    def has_document(self, document: str):
+        with self.lock:
+            return bool(self.documents.get(document))
+
+    def get_groups(self, document: str, stages: list = None):
+        """
+        The artifacts of a document grouped by page, in page order. With stages, each group
+        holds only these stages in the given order.
+        """
+        with self.lock:
+            pages = self.documents.get(document, {})
+            groups = []
+            for page in sorted(pages, key=int):
+                artifacts = pages[page]
+                names = stages if stages is not None else sorted(artifacts)
+                groups.append([os.path.join(self.directory, artifacts[name])
+                               for name in names if name in artifacts])
+        return groups
+
+    def scan(self, directory: str):
+        """Index an existing directory once, e.g. one processed before the catalog existed."""
+        self.add(*(os.path.join(directory, file_name) for file_name in os.listdir(directory)))
+        return self.get_document(directory)
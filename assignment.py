@@ -0,0 +1,94 @@
+import math
+import heapq
+import random
+import logging
+
+from results_store import normalize_date
+
+
+class AssignmentEngine:
+    """
+    Assigns attendees and topics to a whole set of receipts in one pass, in date order.
+    The host (first name) attends every receipt. Guests are picked by fewest attendances
+    so far, then longest absence, then a seeded order, and are not repeated within
+    `window` consecutive receipts while others are available. Topics rotate the same way.
+    The same receipts, user data and seed always give the same assignment.
+    """
+
+    def __init__(self, user_data_handler, seed: int = 0, window: int = 3, topic_window: int = 1,
+                 topic_prefix: str = "Projectbesprechung ", logger=None):
+        """
+        Args:
+            user_data_handler (UserDataHandler): Names, projects and the spend rate per name.
+            seed (int): Seed of the tie-breaking order.
+            window (int): Number of following receipts a guest is skipped for after attending.
+            topic_window (int): Number of following receipts a topic is skipped for.
+        """
+        self.user_data_handler = user_data_handler
+        self.seed = seed
+        self.window = window
+        self.topic_window = topic_window
+        self.topic_prefix = topic_prefix
+        self.logger = logger or logging
+
+    def get_name_count(self, total_with_tip):
+        """Attendees including the host, as add_names computes it."""
+        total = math.floor(float(total_with_tip or 0))
+        if total <= 0:
+            return 1
+        return max(1, math.floor(total / self.user_data_handler.get_billing_value_per_name(total)))
+
+    def get_heap(self, size: int, salt: str):
+        order = list(range(size))
+        random.Random(f"{self.seed}:{salt}").shuffle(order)
+        # (uses, last receipt, tie-breaker, item); never used items sort before recently used ones.
+        heap = [(0, -size - 1, rank, item) for rank, item in enumerate(order)]
+        heapq.heapify(heap)
+        return heap
+
+    @staticmethod
+    def pick(heap: list, count: int, position: int, window: int):
+        """Pop count items, skipping those used within the window unless nothing else is left."""
+        chosen, deferred = [], []
+        while heap and len(chosen) < count:
+            entry = heapq.heappop(heap)
+            (chosen if position - entry[1] > window else deferred).append(entry)
+        deferred.sort()
+        while deferred and len(chosen) < count:
+            chosen.append(deferred.pop(0))
+        for entry in deferred:
+            heapq.heappush(heap, entry)
+        for uses, _, rank, item in chosen:
+            heapq.heappush(heap, (uses + 1, position, rank, item))
+        return [item for _, _, _, item in chosen]
+
+    def assign(self, receipts: list):
+        """
+        Args:
+            receipts (list): (page_id, values) tuples; values need total_with_tip and may have a date.
+
+        Returns:
+            dict: {"names": [...], "topic": "..."} by page id.
+        """
+        names = list(self.user_data_handler.get_names() or [])
+        projects = list(self.user_data_handler.get_projects() or [])
+        if not names:
+            raise ValueError("No names in the user data")
+        host, guests = names[0], names[1:]
+        guest_heap = self.get_heap(len(guests), "names")
+        topic_heap = self.get_heap(len(projects), "topics")
+
+        ordered = sorted(receipts, key=lambda receipt: (
+            normalize_date(receipt[1].get("date")) or "", str(receipt[0])))
+        assignments = {}
+        for position, (page_id, values) in enumerate(ordered):
+            guest_count = min(len(guests), self.get_name_count(values.get("total_with_tip")) - 1)
+            chosen = self.pick(guest_heap, guest_count, position, self.window)
+            assignment = {"names": [host] + [guests[i] for i in chosen]}
+            if projects:
+                topic = projects[self.pick(topic_heap, 1, position, self.topic_window)[0]]
+                assignment["topic"] = f"{self.topic_prefix}{topic}"
+            assignments[page_id] = assignment
+        self.logger.info(
+            f"Assigned {len(names)} names and {len(projects)} topics to {len(assignments)} receipts")
+        return assignments
@@ -0,0 +1,77 @@
+import os
+import json
+import contextlib
+
+TEMP_SUFFIX = ".tmp"
+
+
+def get_temp_path(path: str):
+    return f"{path}{TEMP_SUFFIX}"
+
+
+@contextlib.contextmanager
+def replacing(path: str):
+    """
+    Yield a temporary path next to path and move it over path once the block succeeds,
+    so readers and resumed runs only ever see complete files.
+    """
+    temp_path = get_temp_path(path)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_text(path: str, content: str):
+    with replacing(path) as temp_path:
+        with open(temp_path, "w") as file:
+            file.write(content)
+
+
+def save_pixmap(pix, path: str):
+    """Save a pixmap as PNG; the temporary file's extension doesn't tell fitz the format."""
+    with replacing(path) as temp_path:
+        pix.save(temp_path, output="png")
+
+
+def save_document(doc, path: str, **options):
+    with replacing(path) as temp_path:
+        doc.save(temp_path, **options)
+
+
+def is_complete(path: str):
+    """
+    False for missing files and for artifacts cut short by a crash before writes were atomic:
+    JSON that doesn't parse, PNGs without their end chunk and PDFs without their trailer.
+    """
+    if not os.path.isfile(path):
+        return False
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        try:
+            with open(path, "r") as file:
+                json.load(file)
+            return True
+        except (OSError, ValueError):
+            return False
+    if extension in (".png", ".pdf"):
+        size = os.path.getsize(path)
+        with open(path, "rb") as file:
+            file.seek(max(0, size - 1024))
+            tail = file.read()
+        return (b"IEND" if extension == ".png" else b"%%EOF") in tail
+    return True
+
+
+def remove_partial_files(directory: str):
+    """Delete temporary files an interrupted run left behind. Returns their count."""
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for file_name in os.listdir(directory):
+        if file_name.endswith(TEMP_SUFFIX):
+            os.remove(os.path.join(directory, file_name))
+            removed += 1
+    return removed
@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from app import Main
+from chains import Chains
+from metrics import Metrics
+from atomic_files import write_text
+from ocr_handler import OcrHandler
+from pdf_handler import PdfHandler
+from response_cache import ResponseCache
+from results_store import ResultsStore
+from artifact_catalog import ArtifactCatalog
+from dedup import DuplicateIndex
+from assignment import AssignmentEngine
+from validation import ReceiptValidator
+from extraction_handler import ExtractionHandler
+from user_data_handler import UserDataHandler
+
+
+class BatchRunner:
+    """
+    Processes every PDF below input_directory. Each document gets its own Main and its own
+    data directory, mirroring the input tree, while the OCR pool, the LLM client, the response
+    cache, the user data and the metrics are shared. Attendees and topics are assigned across
+    the pages of all documents at once, after the last document.
+    """
+
+    def __init__(self, input_directory: str, data_directory: str, logger=logger, document_workers: int = 1,
+                 ocr_workers: int = None, ocr_chunk_size: int = 1, extraction_concurrency: int = 4,
+                 requests_per_second: float = None, max_retries: int = 5, llm_base_url: str = None,
+                 cache_max_bytes: int = 64 * 1024 * 1024, signature_image_path: str = None,
+                 llm_debug: bool = False, ocr_preprocessor=None, ocr_backend: str = "auto",
+                 interactive: bool = True, **main_options):
+        """
+        Args:
+            input_directory (str): Directory tree with the source PDFs.
+            data_directory (str): Root for the per-document data directories; holds the shared
+                user_data.txt, llm_cache.sqlite, results.sqlite, catalog.json, duplicates.sqlite, signature.png and the batch summary.
+            document_workers (int): Number of documents processed at the same time.
+            ocr_preprocessor (ImagePreprocessor): Optional image preprocessing for the shared OCR pool.
+            interactive (bool): Prompt for missing user data; otherwise it is an error and the user
+                data messages are logged instead of printed.
+            main_options: Further keyword arguments for Main, e.g. in_memory or streaming options.
+        """
+        self.input_directory = input_directory
+        self.data_directory = data_directory
+        self.logger = logger
+        self.document_workers = max(1, document_workers)
+        self.signature_image_path = signature_image_path or os.path.join(
+            data_directory, "signature.png")
+        self.main_options = main_options
+        # One seed for the whole batch; the per-page fallback in each Main uses the same one.
+        self.assignment_seed = main_options.setdefault("assignment_seed", 0)
+        self.metrics = Metrics()
+        self.response_cache = ResponseCache(os.path.join(data_directory, "llm_cache.sqlite"),
+                                            max_bytes=cache_max_bytes, logger=logger)
+        self.resources = {
+            "metrics": self.metrics,
+            "user_data_handler": UserDataHandler(logger, data_directory, interactive=interactive,
+                                                 seed=self.assignment_seed),
+            "pdf_handler": PdfHandler(logger),
+            "ocr_handler": OcrHandler(logger, workers=ocr_workers, chunk_size=ocr_chunk_size,
+                                      preprocessor=ocr_preprocessor, backend=ocr_backend),
+            "extraction_handler": ExtractionHandler(
+                logger, concurrency=extraction_concurrency,
+                requests_per_second=requests_per_second, max_retries=max_retries),
+            "response_cache": self.response_cache,
+            "results_store": ResultsStore(os.path.join(data_directory, "results.sqlite"), logger=logger),
+            "artifact_catalog": ArtifactCatalog(data_directory, logger=logger),
+            "chains": Chains(logger, base_url=llm_base_url, max_retries=0, cache=self.response_cache,
+                             debug=llm_debug, metrics=self.metrics),
+        }
+        # Duplicates are found across all documents of the batch, not only within one.
+        if main_options.get("deduplicate", True):
+            self.resources["duplicate_index"] = DuplicateIndex(
+                os.path.join(data_directory, "duplicates.sqlite"), logger=logger)
+
+    def find_pdfs(self):
+        pdf_paths = []
+        data_directory = os.path.abspath(self.data_directory)
+        for directory, directory_names, file_names in os.walk(self.input_directory):
+            # Never descend into our own output.
+            directory_names[:] = sorted(name for name in directory_names
+                                        if os.path.abspath(os.path.join(directory, name)) != data_directory)
+            pdf_paths += [os.path.join(directory, file_name) for file_name in sorted(file_names)
+                          if file_name.lower().endswith(".pdf")]
+        return pdf_paths
+
+    def get_document_id(self, pdf_path: str):
+        """Namespace for a document's artifacts: its path below the input directory, without extension."""
+        relative_path = os.path.splitext(os.path.relpath(
+            pdf_path, self.input_directory))[0]
+        return "/".join(re.sub(r"[^\w.\-]+", "_", part) for part in relative_path.split(os.sep))
+
+    def get_main(self, pdf_path: str, **options):
+        """A Main for one document that uses the shared resources; options override the Main options."""
+        document_id = self.get_document_id(pdf_path)
+        return Main(pdf_file_path=pdf_path,
+                    data_directory_path=os.path.join(
+                        self.data_directory, *document_id.split("/")),
+                    signature_image_path=self.signature_image_path,
+                    resources=self.resources, document_id=document_id, **{**self.main_options, **options})
+
+    def process(self, pdf_path: str, overwrite: bool = False, streaming: bool = False, mains: dict = None,
+                **options):
+        """
+        Args:
+            mains (dict): Receives the document's Main by document id if the run succeeded.
+            options: Main options for this run, e.g. global_assignment=False.
+        """
+        document_id = self.get_document_id(pdf_path)
+        start_time = time.time()
+        try:
+            main = self.get_main(pdf_path, **options)
+            results = main.run(overwrite=overwrite, streaming=streaming)
+            failed_pages = [f"page_{job.index}: {job.error}" for job in results
+                            if job.error is not None] if streaming else []
+            if mains is not None and not failed_pages:
+                mains[document_id] = main
+            return {"document": document_id,
+                    "pages": len(main.page_sources) or len(main.extracted_billing_paths),
+                    "seconds": round(time.time() - start_time, 3),
+                    "error": "; ".join(failed_pages) or None}
+        except Exception as e:
+            self.logger.error(f"Failed to process {pdf_path}: {str(e)}")
+            self.metrics.increment("documents_failed_total")
+            return {"document": document_id, "pages": 0,
+                    "seconds": round(time.time() - start_time, 3), "error": str(e)}
+
+    def assign_user_data(self, mains: list, overwrite: bool = False):
+        """
+        Assign attendees and topics across the pages of all documents in one pass with the batch seed,
+        so guests and topics are balanced over the whole batch rather than within each document,
+        then rewrite the billing text files whose assignment changed.
+
+        Args:
+            mains (list): The Main of each processed document.
+        """
+        engine = AssignmentEngine(self.resources["user_data_handler"], seed=self.assignment_seed,
+                                  logger=self.logger)
+        pages = [(main, main.get_assignment_pages(
+            [os.path.splitext(path)[0] + ".json" for path in main.extracted_billing_paths]))
+            for main in mains]
+        with self.metrics.span("assignment"):
+            assignments = engine.assign([(page_id, values) for _, main_pages in pages
+                                         for page_id, (_, _, values) in main_pages.items()])
+        for main, main_pages in pages:
+            main.apply_assignments(main_pages, assignments)
+            for json_path, _, _ in main_pages.values():
+                main.create_billing_yml(json_path, overwrite)
+            main.manifest.save()
+
+    def run(self, overwrite: bool = False, streaming: bool = False):
+        """Process all documents and return the batch summary."""
+        if not os.path.exists(self.data_directory):
+            os.makedirs(self.data_directory)
+        self.resources["user_data_handler"].run()
+        pdf_paths = self.find_pdfs()
+        self.logger.info(
+            f"Processing {len(pdf_paths)} PDFs from {self.input_directory}")
+
+        # Streaming runs write the receipt PDFs page by page and keep the per-page assignment.
+        global_assignment = not streaming and self.main_options.get("global_assignment", True)
+        mains = {}
+        start_time = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.document_workers) as executor:
+                documents = list(executor.map(
+                    lambda pdf_path: self.process(pdf_path, overwrite, streaming, mains,
+                                                  global_assignment=False), pdf_paths))
+            if global_assignment and mains:
+                self.assign_user_data([mains[document_id] for document_id in sorted(mains)], overwrite)
+        finally:
+            self.resources["ocr_handler"].close()
+        duration = time.time() - start_time
+
+        # Each document re-extracts its own failing pages; this reports what is left across the batch.
+        anomalies = ReceiptValidator(logger=self.logger).validate_directory(
+            self.data_directory, os.path.join(self.data_directory, "batch_validation.json"))
+
+        pages = sum(document["pages"] for document in documents)
+        failures = [document for document in documents if document["error"]]
+        summary = {
+            "documents": len(documents),
+            "failed_documents": len(failures),
+            "pages": pages,
+            "seconds": round(duration, 3),
+            "pages_per_second": round(pages / duration, 3) if duration else None,
+            "documents_per_second": round(len(documents) / duration, 3) if duration else None,
+            "llm_cache_hits": self.response_cache.hits,
+            "llm_cache_misses": self.response_cache.misses,
+            "pages_with_anomalies": len(anomalies),
+            "failures": [{"document": document["document"], "error": document["error"]} for document in failures],
+            "details": documents,
+        }
+        write_text(os.path.join(self.data_directory, "batch_summary.json"), json.dumps(summary, indent=2))
+        self.metrics.export(os.path.join(
+            self.data_directory, "batch_metrics.json"))
+        self.logger.info(
+            f"Processed {len(documents)} documents ({pages} pages) in {duration:.2f} seconds, "
+            f"{summary['pages_per_second']} pages/s, {len(failures)} failed")
+        return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Process a directory tree of receipt PDFs.")
+    parser.add_argument("input_directory")
+    parser.add_argument("data_directory")
+    parser.add_argument("--document-workers", type=int, default=1)
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--ocr-backend", default="auto", choices=["auto", "tesserocr", "pytesseract"])
+    parser.add_argument("--extraction-concurrency", type=int, default=4)
+    parser.add_argument("--assignment-seed", type=int, default=0)
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--streaming", action="store_true")
+    args = parser.parse_args()
+
+    batch = BatchRunner(args.input_directory, args.data_directory, document_workers=args.document_workers,
+                        ocr_workers=args.ocr_workers, ocr_backend=args.ocr_backend,
+                        extraction_concurrency=args.extraction_concurrency, assignment_seed=args.assignment_seed)
+    summary = batch.run(overwrite=args.overwrite, streaming=args.streaming)
+    print(json.dumps({key: value for key, value in summary.items() if key != "details"}, indent=2))
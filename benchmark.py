@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import fitz
+
+from fake_llm_server import FakeLlmServer
+
+
+def percentile(values: list, percent: float):
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(percent / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(durations: list, wall_time: float):
+    return {
+        "count": len(durations),
+        "wall_seconds": round(wall_time, 4),
+        "throughput_per_second": round(len(durations) / wall_time, 3) if wall_time else None,
+        "mean_seconds": round(sum(durations) / len(durations), 4) if durations else None,
+        "p50_seconds": percentile(durations, 50),
+        "p95_seconds": percentile(durations, 95),
+    }
+
+
+def character_accuracy(expected: str, actual: str):
+    """1 - Levenshtein distance / expected length, ignoring whitespace differences."""
+    expected, actual = " ".join(expected.split()), " ".join((actual or "").split())
+    if not expected:
+        return 1.0 if not actual else 0.0
+    previous = list(range(len(actual) + 1))
+    for i, expected_char in enumerate(expected, 1):
+        current = [i]
+        for j, actual_char in enumerate(actual, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (expected_char != actual_char)))
+        previous = current
+    return round(max(0.0, 1 - previous[-1] / len(expected)), 4)
+
+
+class SyntheticReceipts:
+    """Generates German restaurant receipts with consistent totals and VAT."""
+
+    items = [("Schnitzel Wiener Art", 18.90), ("Currywurst", 8.50), ("Spätzle", 11.20),
+             ("Salat", 7.80), ("Bier 0,5l", 4.60), ("Apfelschorle", 3.90), ("Wasser", 2.80),
+             ("Espresso", 2.60), ("Flammkuchen", 12.40), ("Apfelstrudel", 6.90)]
+    locations = [("Gasthaus Zur Post", "Hauptstraße 12", "10115 Berlin"),
+                 ("Restaurant Lindenhof", "Lindenallee 3", "80331 München"),
+                 ("Café Central", "Marktplatz 7", "50667 Köln")]
+
+    def __init__(self, seed: int = 0):
+        self.random = random.Random(seed)
+
+    def get_receipt(self):
+        """Return the receipt lines and the expected values."""
+        location_name, street, city = self.random.choice(self.locations)
+        positions = [self.random.choice(self.items)
+                     for _ in range(self.random.randint(2, 8))]
+        total = round(sum(price for _, price in positions), 2)
+        net = round(total / 1.19, 2)
+        vat = round(total - net, 2)
+        day, month = self.random.randint(1, 28), self.random.randint(1, 12)
+        lines = [location_name, street, city, f"{day:02d}.{month:02d}.2024 19:{self.random.randint(10, 59)}", ""]
+        lines += [f"{name:<24}{price:>8.2f}".replace(".", ",") for name, price in positions]
+        lines += ["", f"{'Summe EUR':<24}{total:>8.2f}".replace(".", ","),
+                  f"MwSt 19%  Netto {net:.2f}  MwSt {vat:.2f}".replace(".", ","),
+                  "Vielen Dank für Ihren Besuch!"]
+        return lines, {"total_without_tip": total, "value_added": vat, "amount_taxed": net,
+                       "date": lines[3].split()[0], "location_name": location_name}
+
+    def create_pdf(self, path: str, pages: int, scanned: bool = True, dpi: int = 150):
+        """
+        Write a PDF with one receipt per page. Scanned pages carry only an image,
+        so they go through OCR; otherwise the receipt is a text layer.
+        """
+        doc = fitz.open()
+        text_doc = fitz.open()
+        expected = []
+        for _ in range(pages):
+            lines, values = self.get_receipt()
+            expected.append({"text": "\n".join(lines), **values})
+            text_page = text_doc.new_page(width=300, height=420)
+            text_page.insert_text(fitz.Point(20, 30), lines,
+                                  fontname="cour", fontsize=9)
+            if scanned:
+                page = doc.new_page(width=300, height=420)
+                page.insert_image(page.rect, pixmap=text_page.get_pixmap(dpi=dpi))
+        if not scanned:
+            doc.insert_pdf(text_doc)
+        doc.save(path)
+        doc.close()
+        text_doc.close()
+        return expected
+
+
+class Benchmark:
+    def __init__(self, logger=None, pages: int = 20, llm_latency: float = 0.2, scanned: bool = True,
+                 ocr_workers: int = None, extraction_concurrency: int = 4, seed: int = 0,
+                 work_directory: str = None, preprocessor=None, ocr_backend: str = "auto"):
+        self.logger = logger or logging
+        self.pages = pages
+        self.llm_latency = llm_latency
+        self.scanned = scanned
+        self.ocr_workers = ocr_workers
+        self.extraction_concurrency = extraction_concurrency
+        self.seed = seed
+        self.work_directory = work_directory
+        # ImagePreprocessor to benchmark against raw OCR, for time per page and character accuracy.
+        self.preprocessor = preprocessor
+        self.ocr_backend = ocr_backend
+        self.results = {}
+
+    def get_version(self):
+        try:
+            return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except OSError:
+            return None
+
+    def measure(self, func, items: list, concurrency: int = 1):
+        """Call func for every item and record each call's duration."""
+        from extraction_handler import ExtractionHandler
+
+        def _timed(item):
+            start_time = time.time()
+            func(item)
+            return time.time() - start_time
+
+        start_time = time.time()
+        durations = ExtractionHandler(
+            self.logger, concurrency=concurrency).map(_timed, items)
+        return summarize(durations, time.time() - start_time)
+
+    def prepare(self, directory: str):
+        pdf_file_path = os.path.join(directory, "receipts.pdf")
+        expected = SyntheticReceipts(self.seed).create_pdf(
+            pdf_file_path, self.pages, scanned=self.scanned)
+        data_directory_path = os.path.join(directory, "data")
+        os.makedirs(data_directory_path)
+        with open(os.path.join(data_directory_path, "user_data.txt"), "w") as user_data_file:
+            user_data_file.write("Host\nAnna\nBernd\nCarla\nDaniel\n######\nProjekt A\nProjekt B")
+        signature = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 145, 357), False)
+        signature.clear_with(255)
+        signature.save(os.path.join(data_directory_path, "signature.png"))
+        return pdf_file_path, data_directory_path, expected
+
+    def measure_preprocessing(self, pdf_file_path: str, expected: list, ocr: bool = True):
+        """
+        Time the preprocessing of every page and, with tesseract available, the OCR and
+        character accuracy of the preprocessed pages.
+        """
+        durations = []
+        images = []
+        start_time = time.time()
+        with fitz.open(pdf_file_path) as doc:
+            for page in doc:
+                page_start_time = time.time()
+                images.append(self.preprocessor.process_page(page))
+                durations.append(time.time() - page_start_time)
+        stage = summarize(durations, time.time() - start_time)
+        stage["config"] = {key: value for key, value in vars(self.preprocessor).items()}
+        if not ocr:
+            return stage
+        try:
+            from ocr_handler import _image_to_text
+
+            ocr_durations = []
+            accuracies = []
+            for image, receipt in zip(images, expected):
+                page_start_time = time.time()
+                text = _image_to_text(image, self.ocr_backend, self.preprocessor)
+                ocr_durations.append(time.time() - page_start_time)
+                accuracies.append(character_accuracy(receipt["text"], text))
+            stage["ocr"] = summarize(ocr_durations, sum(ocr_durations))
+            stage["character_accuracy"] = round(sum(accuracies) / len(accuracies), 4) if accuracies else None
+        except Exception as e:
+            self.logger.warning(f"Skipping OCR of preprocessed pages: {str(e)}")
+            stage["ocr"] = {"skipped": str(e)}
+        return stage
+
+    @staticmethod
+    def measure_compaction(expected: list, max_tokens: int = 600):
+        """
+        Tokens saved by the LLM text compaction on the synthetic receipts, and how many of the
+        fields the extraction needs (total, VAT, net amount, date, place) survive it.
+        """
+        from text_compactor import TextCompactor
+
+        compactor = TextCompactor(max_tokens=max_tokens)
+        durations, before, after, kept, fields = [], 0, 0, 0, 0
+        for receipt in expected:
+            start_time = time.time()
+            compacted, tokens_before, tokens_after = compactor.compact(receipt["text"])
+            durations.append(time.time() - start_time)
+            before += tokens_before
+            after += tokens_after
+            needles = [f"{receipt[key]:.2f}".replace(".", ",")
+                       for key in ("total_without_tip", "value_added", "amount_taxed")]
+            needles += [receipt["date"], receipt["location_name"]]
+            kept += sum(needle in compacted for needle in needles)
+            fields += len(needles)
+        stage = summarize(durations, sum(durations))
+        stage.update({"tokens_before": before, "tokens_after": after,
+                      "tokens_saved_per_page": round((before - after) / len(expected), 1) if expected else None,
+                      "saved_ratio": round(1 - after / before, 3) if before else None,
+                      "field_retention": round(kept / fields, 4) if fields else None})
+        return stage
+
+    def run(self):
+        from app import Main
+
+        directory = self.work_directory or tempfile.mkdtemp(
+            prefix="receipts-benchmark-")
+        pdf_file_path, data_directory_path, expected = self.prepare(directory)
+        stages = {}
+        # The OpenAI client refuses to start without a key; the fake server ignores it.
+        os.environ.setdefault("OPENAIKEY", "fake")
+        with FakeLlmServer(latency=self.llm_latency) as llm_server:
+            main = Main(pdf_file_path=pdf_file_path, data_directory_path=data_directory_path,
+                        ocr_workers=self.ocr_workers, ocr_backend=self.ocr_backend,
+                        extraction_concurrency=self.extraction_concurrency,
+                        llm_base_url=llm_server.url, use_local_parser=False,
+                        cache_path=os.path.join(directory, "llm_cache.sqlite"))
+            main.user_data_handler.run()
+
+            start_time = time.time()
+            image_paths = main.pdf_handler.create_images_for_pdf(
+                pdf_file_path, data_directory_path, overwrite=True)
+            stages["render"] = summarize(list(main.pdf_handler.page_durations.values()),
+                                         time.time() - start_time)
+
+            text_paths = [main.ocr_handler.get_text_path(path) for path in image_paths]
+            try:
+                start_time = time.time()
+                main.ocr_handler.extract_texts(image_paths, overwrite=True)
+                stages["ocr"] = summarize(list(main.ocr_handler.page_durations.values()),
+                                          time.time() - start_time)
+                accuracies = []
+                for text_path, receipt in zip(text_paths, expected):
+                    with open(text_path, "r") as text_file:
+                        accuracies.append(character_accuracy(receipt["text"], text_file.read()))
+                stages["ocr"]["character_accuracy"] = round(sum(accuracies) / len(accuracies), 4)
+            except Exception as e:
+                # Without a tesseract binary, continue with the ground truth text.
+                self.logger.warning(f"Skipping OCR stage: {str(e)}")
+                stages["ocr"] = {"skipped": str(e)}
+                for text_path, receipt in zip(text_paths, expected):
+                    with open(text_path, "w") as text_file:
+                        text_file.write(receipt["text"])
+
+            if self.preprocessor is not None:
+                stages["preprocess"] = self.measure_preprocessing(
+                    pdf_file_path, expected, ocr="skipped" not in stages["ocr"])
+
+            stages["compaction"] = self.measure_compaction(expected)
+
+            stages["extraction"] = self.measure(
+                lambda text_path: main.extract_values_to_json(
+                    text_path, overwrite=True),
+                text_paths, concurrency=self.extraction_concurrency)
+            stages["extraction"]["llm_requests"] = llm_server.request_count
+
+            json_paths = [os.path.splitext(path)[0] + ".json" for path in text_paths]
+            stages["yaml"] = self.measure(
+                lambda json_path: main.create_billing_yml(json_path, overwrite=True), json_paths)
+
+            billing_paths = [os.path.splitext(path)[0] + ".yml" for path in json_paths]
+            stages["pdf"] = self.measure(
+                lambda i: main.pdf_handler.create_pdf_from_files(
+                    files=[billing_paths[i], image_paths[i]],
+                    target=os.path.join(data_directory_path, f"receipt_{i}.pdf"),
+                    path_to_signature_image=main.signature_image_path),
+                list(range(len(image_paths))))
+
+        self.results = {
+            "version": self.get_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "config": {"pages": self.pages, "llm_latency": self.llm_latency, "scanned": self.scanned,
+                       "ocr_workers": main.ocr_handler.workers, "ocr_backend": self.ocr_backend,
+                       "extraction_concurrency": self.extraction_concurrency, "seed": self.seed},
+            "stages": stages,
+        }
+        if self.work_directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+        return self.results
+
+    def save(self, path: str):
+        with open(path, "w") as results_file:
+            json.dump(self.results, results_file, indent=2)
+        self.logger.info(f"Saved benchmark results: {path}")
+
+    @staticmethod
+    def compare(baseline: dict, current: dict):
+        """Return the relative change of each stage's p50, p95 and throughput against a baseline run."""
+        changes = {}
+        for stage, values in current.get("stages", {}).items():
+            previous = baseline.get("stages", {}).get(stage, {})
+            changes[stage] = {
+                key: round(values[key] / previous[key] - 1, 3)
+                for key in ("p50_seconds", "p95_seconds", "throughput_per_second")
+                if values.get(key) and previous.get(key)
+            }
+        return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the receipt pipeline on synthetic receipts with a fake LLM.")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--native", action="store_true",
+                        help="Generate text-layer PDFs instead of scans.")
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--extraction-concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ocr-backend", default="auto", choices=["auto", "tesserocr", "pytesseract"])
+    parser.add_argument("--preprocess", action="store_true",
+                        help="Also benchmark image preprocessing before OCR.")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--psm", type=int, default=6)
+    parser.add_argument("--whitelist", default=None)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None,
+                        help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    preprocessor = None
+    if args.preprocess:
+        from image_preprocessor import ImagePreprocessor
+
+        preprocessor = ImagePreprocessor(dpi=args.dpi, psm=args.psm, whitelist=args.whitelist)
+
+    benchmark = Benchmark(pages=args.pages, llm_latency=args.llm_latency, scanned=not args.native,
+                          ocr_workers=args.ocr_workers, extraction_concurrency=args.extraction_concurrency,
+                          seed=args.seed, preprocessor=preprocessor, ocr_backend=args.ocr_backend)
+    results = benchmark.run()
+    benchmark.save(args.output)
+    print(json.dumps(results["stages"], indent=2))
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            print(json.dumps(Benchmark.compare(
+                json.load(baseline_file), results), indent=2))
@@ -1,6 +1,7 @@
 import os
 import logging
 import json
+import threading
 
 from dotenv import load_dotenv
 
@@ -14,34 +15,195 @@ from langchain.chains.openai_functions import (
 from langchain.globals import set_debug, set_verbose
 
 import data_models
+from response_cache import ResponseCache
+from text_compactor import estimate_tokens
 
 
 class Chains:
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, base_url=None, max_retries=2, model="gpt-3.5-turbo", cache=None,
+                 debug=False, metrics=None):
         load_dotenv()
-        set_debug(True)
-        set_verbose(True)
+        # Global LangChain debug output dumps every prompt and response; opt in with debug=True.
+        set_debug(debug)
+        set_verbose(debug)
         self.logger = logger or logging
+        self.metrics = metrics
+        self.model = model
+        # OPENAIBASEURL points the client at any OpenAI-compatible server, e.g. fake_llm_server.
         self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo", temperature=0, openai_api_key=os.getenv("OPENAIKEY"))
+            model=model, temperature=0, openai_api_key=os.getenv("OPENAIKEY"),
+            openai_api_base=base_url or os.getenv("OPENAIBASEURL"), max_retries=max_retries)
         self.encode = data_models.Encoder().encode
+        self.cache = cache
 
     class BillingDataJson:
-        def __init__(self):
-            pass
+        prompt_template = """Extract information from the following text: {raw_text}"""
+
+        def __init__(self, chains=None, guard=None):
+            """
+            Args:
+                chains (Chains): Shared client. A new one is created if none is given.
+                guard (callable): Optional wrapper for the network call, e.g. ExtractionHandler.guard.
+            """
+            self.chains = chains or Chains()
+            self.chain = None
+            self.lock = threading.Lock()
+            self.schema = data_models.BillingValues.schema()
+            self.invoke = guard(self._invoke) if guard else self._invoke
         """Chain: Gets structured data from the given text."""
 
         def structured_data(self):
-            prompt = PromptTemplate.from_template(
-                """Extract information from the following text: {raw_text}"""
-            )
-            return create_structured_output_runnable(data_models.BillingValues, Chains().llm, prompt)
+            with self.lock:
+                if self.chain is None:
+                    prompt = PromptTemplate.from_template(self.prompt_template)
+                    self.chain = create_structured_output_runnable(
+                        data_models.BillingValues, self.chains.llm, prompt)
+            return self.chain
+
+        def get_cache_key(self, text: str):
+            return ResponseCache.get_key(text, self.chains.model, self.schema, self.prompt_template)
+
+        def _invoke(self, text: str):
+            if self.chains.metrics is not None:
+                self.chains.metrics.increment("llm_requests_total")
+            structured_data = self.structured_data().invoke({"raw_text": text})
+            return json.loads(self.chains.encode(structured_data))
 
         def run(self, text: str):
-            chain = self.structured_data()
-            structured_data = chain.invoke({"raw_text": text})
-            string = Chains().encode(structured_data)
-            return json.loads(string)
+            cache = self.chains.cache
+            if cache is None:
+                return self.invoke(text)
+
+            key = self.get_cache_key(text)
+            cached = cache.get(key)
+            if self.chains.metrics is not None:
+                self.chains.metrics.increment(
+                    "llm_cache_hits_total" if cached is not None else "llm_cache_misses_total")
+            if cached is not None:
+                self.chains.logger.debug(f"Cache hit for extraction {key[:12]}")
+                return cached
+
+            response = self.invoke(text)
+            cache.set(key, response)
+            return response
+
+    class BatchBillingDataJson:
+        prompt_template = """Extract information from each of the following receipts. """ \
+            """Every receipt starts with a line "### page <page_id>"; return one entry per receipt """ \
+            """with its page_id.\n\n{raw_texts}"""
+
+        def __init__(self, single, guard=None, token_budget: int = 3000, max_batch_size: int = 8,
+                     output_tokens: int = 250):
+            """
+            Args:
+                single (Chains.BillingDataJson): Single-page chain; its cache keys are shared and it
+                    handles every receipt the batch doesn't return valid values for.
+                guard (callable): Optional wrapper for the network call, e.g. ExtractionHandler.guard.
+                token_budget (int): Estimated prompt and completion tokens per request.
+                max_batch_size (int): Upper limit of receipts per request.
+                output_tokens (int): Estimated completion tokens per receipt.
+            """
+            self.single = single
+            self.chains = single.chains
+            self.chain = None
+            self.lock = threading.Lock()
+            self.schema = data_models.BatchBillingValues.schema()
+            self.token_budget = token_budget
+            self.max_batch_size = max_batch_size
+            self.output_tokens = output_tokens
+            self.invoke = guard(self._invoke) if guard else self._invoke
+        """Chain: Gets structured data for several receipts from one request."""
+
+        def structured_data(self):
+            with self.lock:
+                if self.chain is None:
+                    prompt = PromptTemplate.from_template(self.prompt_template)
+                    # A plain JSON schema, so each receipt is validated on its own below.
+                    self.chain = create_structured_output_runnable(
+                        self.schema, self.chains.llm, prompt)
+            return self.chain
+
+        def get_batches(self, items: list):
+            """Pack (page_id, text) items in order into batches that fit the token budget."""
+            overhead = estimate_tokens(self.prompt_template) + \
+                estimate_tokens(json.dumps(self.schema))
+            batches = [[]]
+            used = overhead
+            for page_id, text in items:
+                cost = estimate_tokens(text) + self.output_tokens + 5
+                if batches[-1] and (used + cost > self.token_budget or len(batches[-1]) >= self.max_batch_size):
+                    batches.append([])
+                    used = overhead
+                batches[-1].append((page_id, text))
+                used += cost
+            return [batch for batch in batches if batch]
+
+        def _invoke(self, batch: list):
+            if self.chains.metrics is not None:
+                self.chains.metrics.increment("llm_requests_total", mode="batch")
+            raw_texts = "\n\n".join(f"### page {page_id}\n{text}" for page_id, text in batch)
+            return self.structured_data().invoke({"raw_texts": raw_texts})
+
+        def validate(self, receipt: dict):
+            """The receipt's values in the single-page format, or None if they don't validate."""
+            values = {key: value for key, value in receipt.items() if key != "page_id"}
+            try:
+                return json.loads(self.chains.encode(data_models.BillingValues.parse_obj(values)))
+            except Exception:
+                return None
+
+        def run_batch(self, batch: list):
+            """Extract one batch; receipts without valid values in the response are extracted one by one."""
+            cache = self.chains.cache
+            texts = dict(batch)
+            received = {}
+            if len(batch) > 1:
+                try:
+                    response = self.invoke(batch)
+                    for receipt in response.get("receipts") or []:
+                        page_id = str(receipt.get("page_id"))
+                        values = self.validate(receipt) if page_id in texts else None
+                        if values is not None:
+                            received[page_id] = values
+                except Exception as e:
+                    self.chains.logger.warning(
+                        f"Batch of {len(batch)} receipts failed, extracting them one by one: {str(e)}")
+            results = {}
+            for page_id, text in batch:
+                if page_id in received:
+                    results[page_id] = received[page_id]
+                    if cache is not None:
+                        cache.set(self.single.get_cache_key(text), received[page_id])
+                    continue
+                if len(batch) > 1 and self.chains.metrics is not None:
+                    self.chains.metrics.increment("llm_batch_fallbacks_total")
+                results[page_id] = self.single.run(text)
+            return results
+
+        def run_many(self, items: list, map_func=map):
+            """
+            Extract the values of (page_id, text) items with as few requests as the token budget allows.
+            Results are stored under the single-page cache keys, so BillingDataJson.run finds them.
+
+            Args:
+                items (list): (page_id, text) tuples.
+                map_func (callable): Runs run_batch over the batches, e.g. ExtractionHandler.map.
+
+            Returns:
+                dict: Values by page id.
+            """
+            cache = self.chains.cache
+            results = {}
+            pending = []
+            for page_id, text in items:
+                cached = cache.get(self.single.get_cache_key(text)) if cache is not None else None
+                if cached is not None:
+                    results[page_id] = cached
+                else:
+                    pending.append((page_id, text))
+            for batch_results in map_func(self.run_batch, self.get_batches(pending)):
+                results.update(batch_results)
+            return results
 
 
 if __name__ == "__main__":
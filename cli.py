@@ -0,0 +1,348 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Seconds from interpreter start until the render command is ready to work.
+RENDER_STARTUP_BUDGET = 1.0
+
+# Results go to stdout as JSON; PyMuPDF's own messages (e.g. deprecation warnings) go to stderr.
+os.environ.setdefault("PYMUPDF_MESSAGE", "fd:2")
+
+
+def load_config(path: str):
+    """Read option defaults from a JSON or YAML file; keys are the long flag names with underscores."""
+    if path is None:
+        return {}
+    with open(path, "r") as config_file:
+        if os.path.splitext(path)[1].lower() in (".yml", ".yaml"):
+            import yaml
+
+            return yaml.safe_load(config_file) or {}
+        return json.load(config_file)
+
+
+def get_logger(args):
+    """loguru, for the commands that run Main, BatchRunner or the service, which log through it anyway."""
+    from loguru import logger
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+    return logger
+
+
+def get_standard_logger(args):
+    """
+    A standard library logger for ocr and render: their handlers accept any logger, and
+    loguru alone takes longer to import than the rest of the render startup.
+    """
+    import logging
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="{levelname}: {message}", style="{", stream=sys.stderr)
+    return logging.getLogger("receipts")
+
+
+def get_preprocessor(args):
+    if not args.preprocess:
+        return None
+    from image_preprocessor import ImagePreprocessor
+
+    return ImagePreprocessor(dpi=args.dpi, psm=args.psm, whitelist=args.whitelist, language=args.language)
+
+
+def get_user_data_handler(args, logger):
+    """User data from --user-data or the data directory's user_data.txt; never prompts."""
+    from user_data_handler import UserDataHandler
+
+    user_data_handler = UserDataHandler(logger, args.data_directory, interactive=False,
+                                        seed=args.assignment_seed)
+    if args.user_data is not None:
+        if not os.path.exists(args.user_data):
+            raise FileNotFoundError(f"No user data in {args.user_data}")
+        user_data_handler.data.setDataFromFile(args.user_data)
+    else:
+        user_data_handler.run()
+    return user_data_handler
+
+
+def get_main(args, logger, pdf_file_path: str = None):
+    from app import Main
+
+    # The CLI logs to stderr only.
+    Main.log_sink_added = True
+    return Main(pdf_file_path=pdf_file_path or "", data_directory_path=args.data_directory,
+                ocr_workers=args.workers, ocr_backend=args.backend, ocr_preprocessor=get_preprocessor(args),
+                extraction_concurrency=args.concurrency, requests_per_second=args.requests_per_second,
+                llm_base_url=args.llm_base_url, use_local_parser=not args.no_local_parser,
+                deduplicate=not args.no_dedup, assignment_seed=args.assignment_seed,
+                metrics_path=args.metrics, llm_debug=args.llm_debug, llm_batch_token_budget=args.llm_batch_tokens,
+                resources={"user_data_handler": get_user_data_handler(args, logger)})
+
+
+def command_ocr(args):
+    """PDF pages -> page_{i}.txt, from the text layer where possible, otherwise OCR."""
+    from ocr_handler import OcrHandler
+    from pdf_handler import PdfHandler
+    from artifact_catalog import ArtifactCatalog
+
+    logger = get_standard_logger(args)
+    if not os.path.exists(args.data_directory):
+        os.makedirs(args.data_directory)
+    pdf_handler = PdfHandler(logger)
+    ocr_handler = OcrHandler(logger, workers=args.workers, backend=args.backend,
+                             preprocessor=get_preprocessor(args))
+    page_sources = {} if args.no_text_layer else pdf_handler.extract_text_layers(
+        args.pdf, args.data_directory, overwrite=args.overwrite)
+    text_layer_pages = {i for i, source in page_sources.items() if source == "text_layer"}
+    try:
+        if args.in_memory:
+            image_paths, text_paths = ocr_handler.extract_texts_from_pdf(
+                args.pdf, args.data_directory, overwrite=args.overwrite, save_images=not args.no_images,
+                skip_pages=text_layer_pages)
+        else:
+            image_paths = pdf_handler.create_images_for_pdf(
+                args.pdf, args.data_directory, overwrite=args.overwrite)
+            ocr_handler.extract_texts([path for i, path in enumerate(image_paths) if i not in text_layer_pages],
+                                      overwrite=args.overwrite)
+            text_paths = [ocr_handler.get_text_path(path) for path in image_paths]
+    finally:
+        ocr_handler.close()
+    catalog = ArtifactCatalog(args.data_directory, logger=logger)
+    catalog.add(*image_paths, *text_paths)
+    catalog.save()
+    return {"pages": len(text_paths), "text_layer_pages": len(text_layer_pages)}
+
+
+def command_extract(args):
+    """page_{i}.txt -> page_{i}.json and page_{i}.yml, with the local parser or the LLM."""
+    logger = get_logger(args)
+    main = get_main(args, logger)
+    catalog = main.artifact_catalog
+    document = catalog.get_document(args.data_directory)
+    if not catalog.has_document(document):
+        catalog.scan(args.data_directory)
+    text_paths = [group[0] for group in catalog.get_groups(document, ["text"]) if group]
+    main.duplicates = main.load_duplicates()
+    json_paths = main.extraction_handler.map(
+        lambda text_path: main.extract_values_to_json(text_path, args.overwrite), text_paths)
+    billing_paths = [main.create_billing_yml(json_path, args.overwrite) for json_path in json_paths]
+    catalog.add(*json_paths, *billing_paths)
+    catalog.save()
+    main.manifest.save()
+    main.save_duplicates()
+    main.export_metrics()
+    return {"pages": len(billing_paths)}
+
+
+def command_render(args):
+    """page_{i}.yml + page_{i}.png -> page_{i}.pdf, optionally combined into one PDF."""
+    from artifact_catalog import ArtifactCatalog
+
+    logger = get_standard_logger(args)
+    catalog = ArtifactCatalog(args.data_directory, logger=logger)
+    document = catalog.get_document(args.data_directory)
+    if not catalog.has_document(document):
+        catalog.scan(args.data_directory)
+    groups = [group for group in catalog.get_groups(document, ["billing", "image"])
+              if group and group[0].endswith(".yml")]
+    if not groups:
+        return {"receipts": 0, "combined": None}
+    # PyMuPDF is only imported once there is something to render.
+    from pdf_handler import PdfHandler
+
+    targets = [os.path.splitext(group[0])[0] + ".pdf" for group in groups]
+    results = PdfHandler(logger).create_pdfs_from_groups(
+        list(zip(groups, targets)),
+        path_to_signature_image=args.signature or os.path.join(args.data_directory, "signature.png"),
+        combined_target=args.combined, workers=args.workers or os.cpu_count() or 1)
+    catalog.add(*targets)
+    catalog.save()
+    return {"receipts": len(results), "combined": args.combined}
+
+
+def command_batch(args):
+    """Run the whole pipeline for every PDF below a directory."""
+    from batch import BatchRunner
+
+    logger = get_logger(args)
+    if args.user_data is not None:
+        import shutil
+
+        os.makedirs(args.data_directory, exist_ok=True)
+        shutil.copyfile(args.user_data, os.path.join(args.data_directory, "user_data.txt"))
+    elif not os.path.exists(os.path.join(args.data_directory, "user_data.txt")):
+        raise FileNotFoundError(
+            f"No user data in {os.path.join(args.data_directory, 'user_data.txt')}")
+    batch = BatchRunner(args.input_directory, args.data_directory, logger=logger, interactive=False,
+                        document_workers=args.document_workers, ocr_workers=args.workers,
+                        ocr_backend=args.backend, ocr_preprocessor=get_preprocessor(args),
+                        extraction_concurrency=args.concurrency, requests_per_second=args.requests_per_second,
+                        llm_base_url=args.llm_base_url, signature_image_path=args.signature,
+                        llm_debug=args.llm_debug, use_local_parser=not args.no_local_parser,
+                        deduplicate=not args.no_dedup,
+                        assignment_seed=args.assignment_seed, llm_batch_token_budget=args.llm_batch_tokens,
+                        page_chunk_size=args.page_chunk_size)
+    summary = batch.run(overwrite=args.overwrite, streaming=args.streaming)
+    return {key: value for key, value in summary.items() if key != "details"}
+
+
+def command_serve(args):
+    """Watch an inbox and accept uploads, with the shared resources kept warm between jobs."""
+    from service import ReceiptService
+
+    logger = get_logger(args)
+    service = ReceiptService(args.inbox_directory, args.data_directory, logger=logger, host=args.host,
+                             port=args.port, workers=args.document_workers, queue_size=args.queue_size,
+                             watcher=args.watcher, poll_interval=args.poll_interval, streaming=args.streaming,
+                             ocr_workers=args.workers, ocr_backend=args.backend,
+                             ocr_preprocessor=get_preprocessor(args), extraction_concurrency=args.concurrency,
+                             requests_per_second=args.requests_per_second, llm_base_url=args.llm_base_url,
+                             signature_image_path=args.signature, llm_debug=args.llm_debug,
+                             use_local_parser=not args.no_local_parser, deduplicate=not args.no_dedup,
+                             assignment_seed=args.assignment_seed,
+                             llm_batch_token_budget=args.llm_batch_tokens, page_chunk_size=args.page_chunk_size)
+    service.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+    return {key: value for key, value in service.get_status().items() if key != "status"}
+
+
+def command_check_startup(args):
+    """
+    Time `render` on an empty data directory in a fresh interpreter and compare it to the budget.
+    This is the cost of every invocation; PyMuPDF is only imported once there are receipts to render.
+    """
+    import tempfile
+
+    durations = []
+    with tempfile.TemporaryDirectory(prefix="receipts-startup-") as directory:
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            subprocess.run([sys.executable, os.path.abspath(__file__), "render", directory],
+                           check=True, stdout=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start_time)
+    startup = min(durations)
+    return {"command": "render", "seconds": round(startup, 3), "budget_seconds": args.budget,
+            "within_budget": startup <= args.budget}
+
+
+def add_ocr_options(parser):
+    parser.add_argument("--workers", type=int, default=None, help="OCR processes; defaults to the CPU count.")
+    parser.add_argument("--backend", default="auto", choices=["auto", "tesserocr", "pytesseract"])
+    parser.add_argument("--preprocess", action="store_true", help="Binarize, deskew and crop pages before OCR.")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--psm", type=int, default=6)
+    parser.add_argument("--whitelist", default=None)
+    parser.add_argument("--language", default=None)
+
+
+def add_extraction_options(parser):
+    parser.add_argument("--user-data", default=None,
+                        help="user_data.txt to use instead of the one in the data directory.")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--llm-base-url", default=None)
+    parser.add_argument("--llm-debug", action="store_true")
+    parser.add_argument("--no-local-parser", action="store_true")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Extract duplicate pages again instead of reusing the earlier result.")
+    parser.add_argument("--llm-batch-tokens", type=int, default=None,
+                        help="Send several receipts per LLM request within this token budget.")
+    parser.add_argument("--assignment-seed", type=int, default=0,
+                        help="Seed for the attendees and topics; the same seed gives the same ones.")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Turn restaurant receipts into Bewirtungsbelege.")
+    parser.add_argument("--config", default=None, help="JSON or YAML file with option defaults.")
+    parser.add_argument("--verbose", action="store_true")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ocr_parser = subparsers.add_parser("ocr", help=command_ocr.__doc__)
+    ocr_parser.add_argument("pdf")
+    ocr_parser.add_argument("data_directory")
+    add_ocr_options(ocr_parser)
+    ocr_parser.add_argument("--in-memory", action="store_true")
+    ocr_parser.add_argument("--no-images", action="store_true", help="With --in-memory, don't write PNGs.")
+    ocr_parser.add_argument("--no-text-layer", action="store_true")
+    ocr_parser.add_argument("--overwrite", action="store_true")
+    ocr_parser.set_defaults(func=command_ocr)
+
+    extract_parser = subparsers.add_parser("extract", help=command_extract.__doc__)
+    extract_parser.add_argument("data_directory")
+    add_extraction_options(extract_parser)
+    extract_parser.add_argument("--metrics", default=None)
+    extract_parser.add_argument("--overwrite", action="store_true")
+    extract_parser.set_defaults(func=command_extract, workers=1, backend="auto", preprocess=False)
+
+    render_parser = subparsers.add_parser("render", help=command_render.__doc__)
+    render_parser.add_argument("data_directory")
+    render_parser.add_argument("--signature", default=None)
+    render_parser.add_argument("--combined", default=None, help="Also write all receipts into this PDF.")
+    render_parser.add_argument("--workers", type=int, default=None)
+    render_parser.set_defaults(func=command_render)
+
+    batch_parser = subparsers.add_parser("batch", help=command_batch.__doc__)
+    batch_parser.add_argument("input_directory")
+    batch_parser.add_argument("data_directory")
+    add_ocr_options(batch_parser)
+    add_extraction_options(batch_parser)
+    batch_parser.add_argument("--document-workers", type=int, default=1)
+    batch_parser.add_argument("--signature", default=None)
+    batch_parser.add_argument("--streaming", action="store_true")
+    batch_parser.add_argument("--page-chunk-size", type=int, default=50,
+                              help="Pages per chunk; progress is saved after each one.")
+    batch_parser.add_argument("--overwrite", action="store_true")
+    batch_parser.set_defaults(func=command_batch)
+
+    serve_parser = subparsers.add_parser("serve", help=command_serve.__doc__)
+    serve_parser.add_argument("inbox_directory")
+    serve_parser.add_argument("data_directory")
+    add_ocr_options(serve_parser)
+    add_extraction_options(serve_parser)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--document-workers", type=int, default=1)
+    serve_parser.add_argument("--queue-size", type=int, default=16)
+    serve_parser.add_argument("--watcher", default="auto", choices=["auto", "inotify", "polling"])
+    serve_parser.add_argument("--poll-interval", type=float, default=2.0)
+    serve_parser.add_argument("--signature", default=None)
+    serve_parser.add_argument("--streaming", action="store_true")
+    serve_parser.add_argument("--page-chunk-size", type=int, default=50)
+    serve_parser.set_defaults(func=command_serve)
+
+    startup_parser = subparsers.add_parser("check-startup", help=command_check_startup.__doc__)
+    startup_parser.add_argument("--budget", type=float, default=RENDER_STARTUP_BUDGET)
+    startup_parser.add_argument("--repeat", type=int, default=3)
+    startup_parser.set_defaults(func=command_check_startup)
+    return parser, subparsers
+
+
+def main(argv: list = None):
+    parser, subparsers = get_parser()
+    # Config values become the defaults, so flags still override them.
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config", default=None)
+    config = load_config(config_parser.parse_known_args(argv)[0].config)
+    for subparser in subparsers.choices.values():
+        subparser.set_defaults(**{key.replace("-", "_"): value for key, value in config.items()})
+    args = parser.parse_args(argv)
+
+    result = args.func(args)
+    print(json.dumps(result, indent=2))
+    if args.command == "check-startup" and not result["within_budget"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
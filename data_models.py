@@ -21,6 +21,14 @@ class BillingValues(BaseModel):
     tip_amount: float = Field(..., description="The tip amount. Convert commas to periods.")
     tip_percentage: float = Field(..., description="The tip percentage. Convert commas to periods.")
 
+class PageBillingValues(BillingValues):
+    """Identifying Billing Values of one receipt in a batch."""
+    page_id: str = Field(..., description="The page id given in the header line of the receipt")
+
+class BatchBillingValues(BaseModel):
+    """Identifying Billing Values of several receipts."""
+    receipts: Sequence[PageBillingValues] = Field(..., description="One entry per receipt, in the given order")
+
 class Encoder(JSONEncoder):
         def default(self, o):
             return o.__dict__
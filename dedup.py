@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+
+import numpy as np
+
+
+WORD_PATTERN = re.compile(r"\w+")
+# Hash length in bits and number of bands per kind. A match within d bits shares at least one
+# band exactly as long as d < bands, so only pages sharing a band have to be compared.
+KINDS = {"text": (64, 8)}
+
+
+def hamming_distance(a: int, b: int):
+    return bin(a ^ b).count("1")
+
+
+def text_hash(text: str, shingle_size: int = 3, min_words: int = 8):
+    """
+    64 bit simhash over word shingles of the lower-cased text: OCR noise only flips a few bits.
+    None for texts shorter than min_words, which match too easily.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < min_words:
+        return None
+    shingles = Counter(" ".join(words[i:i + shingle_size])
+                       for i in range(len(words) - shingle_size + 1))
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+                       for shingle in shingles], dtype=np.uint64)
+    weights = np.array(list(shingles.values()), dtype=np.int64)
+    bits = (hashes[:, None] >> np.arange(63, -1, -1, dtype=np.uint64)) & np.uint64(1)
+    votes = (weights[:, None] * (bits.astype(np.int64) * 2 - 1)).sum(axis=0)
+    return int("".join("1" if vote > 0 else "0" for vote in votes), 2)
+
+
+class DuplicateIndex:
+    """
+    Text hashes of the pages processed so far, in SQLite. Each hash is also stored as bands
+    with an index (8 bands of 8 bits for the 64 bit text hash), so finding near duplicates looks
+    up a few exact band values instead of comparing against every page of the archive.
+    """
+
+    def __init__(self, path: str, logger=None):
+        """
+        Args:
+            path (str): SQLite file. Keys are page paths relative to its directory,
+                so one index can serve all documents below it.
+        """
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.logger = logger or logging
+        self.lock = threading.Lock()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                source TEXT,
+                PRIMARY KEY (kind, key)
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                kind TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                key TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_value ON bands (kind, band, value);
+            CREATE INDEX IF NOT EXISTS bands_key ON bands (kind, key);
+        """)
+
+    def get_key(self, path: str):
+        """The key of a page artifact: its path without extension, relative to the index."""
+        return os.path.relpath(os.path.splitext(os.path.abspath(path))[0], self.directory).replace(os.sep, "/")
+
+    def get_path(self, key: str, extension: str):
+        return os.path.join(self.directory, *key.split("/")) + extension
+
+    @staticmethod
+    def get_bands(kind: str, value: int):
+        bits, bands = KINDS[kind]
+        width = bits // bands
+        return [(band, (value >> (bits - (band + 1) * width)) & ((1 << width) - 1)) for band in range(bands)]
+
+    def get_source(self, kind: str, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT source FROM hashes WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, kind: str, key: str, value: int, source: str = None):
+        """Store a page's hash, replacing its previous one."""
+        with self.lock:
+            self.connection.execute("DELETE FROM bands WHERE kind = ? AND key = ?", (kind, key))
+            self.connection.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                                    (kind, key, format(value, "x"), source))
+            self.connection.executemany("INSERT INTO bands VALUES (?, ?, ?, ?)",
+                                        [(kind, band, band_value, key)
+                                         for band, band_value in self.get_bands(kind, value)])
+            self.connection.commit()
+
+    def remove(self, kind: str, key: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM bands WHERE kind = ? AND key = ?", (kind, key))
+            self.connection.execute("DELETE FROM hashes WHERE kind = ? AND key = ?", (kind, key))
+            self.connection.commit()
+
+    def find(self, kind: str, value: int, max_distance: int, exclude: str = None):
+        """
+        Only pages that share at least one band with value are candidates. A page within
+        max_distance bits is therefore only certain to be found if max_distance is smaller
+        than the number of bands of the kind (8 for text).
+
+        Returns:
+            tuple: Key and distance of the closest page within max_distance bits, or None.
+        """
+        bands = self.get_bands(kind, value)
+        # One indexed lookup per band; an OR over the bands makes SQLite scan all of them.
+        query = " UNION ".join(["SELECT hashes.key, hashes.value FROM bands JOIN hashes "
+                                "ON hashes.kind = bands.kind AND hashes.key = bands.key "
+                                "WHERE bands.kind = ? AND bands.band = ? AND bands.value = ?"] * len(bands))
+        with self.lock:
+            rows = self.connection.execute(
+                query, [number for band in bands for number in (kind, *band)]).fetchall()
+        matches = sorted((hamming_distance(value, int(candidate, 16)), key)
+                         for key, candidate in rows if key != exclude)
+        if matches and matches[0][0] <= max_distance:
+            return matches[0][1], matches[0][0]
+        return None
+
+    def count(self, kind: str):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM hashes WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate page texts below a data directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--max-distance", type=int, default=6)
+    args = parser.parse_args()
+
+    index = DuplicateIndex(os.path.join(args.directory, "duplicates.sqlite"))
+    duplicates = {}
+    for current, _, file_names in sorted(os.walk(args.directory)):
+        for file_name in sorted(file_names):
+            if not re.match(r"^page_\d+\.txt$", file_name):
+                continue
+            path = os.path.join(current, file_name)
+            with open(path, "r") as text_file:
+                value = text_hash(text_file.read())
+            if value is None:
+                continue
+            key = index.get_key(path)
+            match = index.find("text", value, args.max_distance, exclude=key)
+            if match is not None:
+                duplicates[key] = {"duplicate_of": match[0], "distance": match[1]}
+            else:
+                index.add("text", key, value)
+    print(json.dumps(duplicates, indent=2, sort_keys=True))
@@ -0,0 +1,123 @@
+import time
+import random
+import logging
+import threading
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "Timeout", "ConnectionError"}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: allows `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_status_code(error: Exception):
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None),
+                              "status_code", None)
+    return status_code
+
+
+def get_retry_after(error: Exception):
+    """Seconds the server asked to wait in its Retry-After (or retry-after-ms) header, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # An HTTP date instead of seconds; the backoff applies.
+        pass
+    return None
+
+
+def is_retryable(error: Exception):
+    """Retry on rate limits, server errors and connection problems."""
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+class ExtractionHandler:
+    def __init__(self, logger=None, concurrency: int = 4, requests_per_second: float = None,
+                 burst: int = None, max_retries: int = 5, backoff_base: float = 1.0,
+                 backoff_max: float = 30.0):
+        """
+        Args:
+            logger: Logger instance.
+            concurrency (int): Number of pages extracted at the same time.
+            requests_per_second (float): Token bucket rate for LLM calls. None disables rate limiting.
+            burst (int): Token bucket capacity. Defaults to the rate.
+            max_retries (int): Retries per call on 429/5xx and connection errors.
+            backoff_base (float): Base delay in seconds for the exponential backoff.
+            backoff_max (float): Upper bound for a single backoff delay in seconds.
+        """
+        self.logger = logger or logging
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = TokenBucket(
+            requests_per_second, burst) if requests_per_second else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def get_backoff(self, attempt: int, retry_after: float = None):
+        """
+        Full jitter: a random delay between 0 and the capped exponential backoff,
+        but never less than the server's Retry-After.
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        return max(delay, retry_after or 0.0)
+
+    def guard(self, func):
+        """Wrap an LLM call with the rate limiter and retries with jittered backoff."""
+        @wraps(func)
+        def _guarded(*args, **kwargs):
+            attempt = 0
+            while True:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    delay = self.get_backoff(attempt, get_retry_after(e))
+                    attempt += 1
+                    self.logger.warning(
+                        f"LLM call failed ({get_status_code(e) or type(e).__name__}), "
+                        f"retry {attempt}/{self.max_retries} in {delay:.2f} seconds")
+                    time.sleep(delay)
+        return _guarded
+
+    def map(self, func, items: list):
+        """Run func over items with bounded concurrency and return the results in input order."""
+        if self.concurrency == 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as executor:
+            return list(executor.map(func, items))
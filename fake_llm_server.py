@@ -0,0 +1,139 @@
+import re
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SAMPLE_BILLING_VALUES = {
+    "date": "2024.Jan.15",
+    "location_name": "Gasthaus Zur Post",
+    "address": "Hauptstraße 1, 10115 Berlin, Deutschland",
+    "currency_symbol": "€",
+    "currency_code": "EUR",
+    "taxes": [{"percentage": 19.0, "amount_taxed": 84.03, "value_added": 15.97}],
+    "total_without_tip": 100.0,
+    "total_with_tip": 100.0,
+    "tip_amount": 0.0,
+    "tip_percentage": 0.0,
+}
+
+
+class FakeLlmServer:
+    """
+    Local OpenAI-compatible chat completions endpoint for tests and benchmarks.
+    Answers every function call with `response_values`, after `latency` seconds,
+    and fails with `error_status` for the first `error_count` requests and for a fraction
+    `error_rate` of the others. Failures carry a Retry-After header if `retry_after` is set.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 429, response_values: dict = None,
+                 error_count: int = 0, retry_after: float = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_count = error_count
+        self.retry_after = retry_after
+        self.response_values = response_values or SAMPLE_BILLING_VALUES
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._get_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def get_arguments(self, function: dict, request: dict = None):
+        properties = function.get("parameters", {}).get("properties", {})
+        # create_structured_output_runnable wraps pydantic schemas in an `output` attribute.
+        if "output" in properties:
+            return {"output": self.response_values}
+        # Batched extraction: one entry per "### page <page_id>" header in the prompt.
+        if "receipts" in properties:
+            prompt = "\n".join(str(message.get("content") or "")
+                               for message in (request or {}).get("messages", []))
+            page_ids = re.findall(r"^### page (\S+)", prompt, re.MULTILINE)
+            return {"receipts": [{"page_id": page_id, **self.response_values} for page_id in page_ids]}
+        return self.response_values
+
+    def get_completion(self, request: dict):
+        functions = request.get("functions") or [tool["function"]
+                                                 for tool in request.get("tools", [])]
+        message = {"role": "assistant", "content": None}
+        if functions:
+            message["function_call"] = {
+                "name": functions[0]["name"],
+                "arguments": json.dumps(self.get_arguments(functions[0], request)),
+            }
+        else:
+            message["content"] = json.dumps(self.response_values)
+        return {
+            "id": f"chatcmpl-fake-{self.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def _get_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: dict, headers: dict = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with fake.lock:
+                    fake.request_count += 1
+                    fail = fake.request_count <= fake.error_count or random.random() < fake.error_rate
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "Not found"}})
+                elif fail:
+                    self._send(fake.error_status, {"error": {"message": "Fake error"}},
+                               {"Retry-After": str(fake.retry_after)} if fake.retry_after is not None else None)
+                else:
+                    self._send(200, fake.get_completion(request))
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    server = FakeLlmServer(port=8089, latency=0.5)
+    print(f"Fake LLM listening on {server.url}")
+    server.server.serve_forever()
@@ -0,0 +1,176 @@
+import numpy as np
+
+
+class ImagePreprocessor:
+    """
+    Prepares rendered pages for tesseract with NumPy array operations: render at a chosen DPI,
+    convert to grayscale, binarize with a local mean threshold, deskew and crop to the receipt.
+    Instances are plain settings and are pickled to the OCR worker processes.
+    """
+
+    def __init__(self, dpi: int = 300, grayscale: bool = True, binarize: bool = True, block_size: int = 31,
+                 offset: float = 10, deskew: bool = True, max_skew: float = 5.0, skew_step: float = 0.5,
+                 crop: bool = True, margin: int = 10, psm: int = 6, oem: int = None, whitelist: str = None,
+                 language: str = None):
+        """
+        Args:
+            dpi (int): Render resolution for PDF pages; None keeps PyMuPDF's default of 72.
+            block_size (int): Side of the neighbourhood for the adaptive threshold, in pixels.
+            offset (float): A pixel is dark if it is this much darker than its neighbourhood mean.
+            max_skew (float): Largest rotation in degrees that deskew corrects.
+            margin (int): White border in pixels kept around the cropped content.
+            psm (int): Tesseract page segmentation mode, e.g. 4 (single column) or 6 (single block).
+            oem (int): Tesseract OCR engine mode.
+            whitelist (str): Characters tesseract may recognize.
+            language (str): Tesseract language(s), e.g. "deu" or "deu+eng".
+        """
+        self.dpi = dpi
+        self.grayscale = grayscale
+        self.binarize = binarize
+        self.block_size = block_size
+        self.offset = offset
+        self.deskew = deskew
+        self.max_skew = max_skew
+        self.skew_step = skew_step
+        self.crop = crop
+        self.margin = margin
+        self.psm = psm
+        self.oem = oem
+        self.whitelist = whitelist
+        self.language = language
+
+    def render(self, page):
+        """Render a page at the configured DPI, in grayscale if configured."""
+        import fitz
+
+        colorspace = fitz.csGRAY if self.grayscale else fitz.csRGB
+        if self.dpi is None:
+            return page.get_pixmap(colorspace=colorspace, alpha=False)
+        return page.get_pixmap(colorspace=colorspace, alpha=False, dpi=self.dpi)
+
+    @staticmethod
+    def pixmap_to_array(pix):
+        """View of the pixmap samples as a (height, width, n) array, without copying."""
+        samples = pix.samples_mv if hasattr(pix, "samples_mv") else pix.samples
+        array = np.frombuffer(samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+        return array[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+
+    @staticmethod
+    def to_grayscale(array):
+        """ITU-R 601 luma of an RGB(A) array; grayscale arrays are returned as 2D views."""
+        if array.ndim == 2:
+            return array
+        if array.shape[2] < 3:
+            return array[:, :, 0]
+        luma = array[:, :, 0] * 0.299 + array[:, :, 1] * 0.587 + array[:, :, 2] * 0.114
+        return luma.astype(np.uint8)
+
+    @staticmethod
+    def adaptive_threshold(gray, block_size: int = 31, offset: float = 10):
+        """
+        Binarize against the mean of each pixel's block_size neighbourhood, computed from an
+        integral image, so uneven thermal paper and shadows don't black out whole regions.
+        Returns a uint8 array with 0 for ink and 255 for paper.
+        """
+        height, width = gray.shape
+        radius = max(1, block_size // 2)
+        # Integral image padded by radius on every side: edges repeat, so each neighbourhood sum is
+        # a difference of four shifted slices, without index arrays. uint32 wraps on large pages,
+        # but the neighbourhood sums are far below 2 ** 32 and come out exact.
+        integral = np.zeros((height + 2 * radius + 1, width + 2 * radius + 1), dtype=np.uint32)
+        inner = integral[radius + 1:radius + 1 + height, radius + 1:radius + 1 + width]
+        np.cumsum(gray, axis=0, dtype=np.uint32, out=inner)
+        np.cumsum(inner, axis=1, dtype=np.uint32, out=inner)
+        integral[:, radius + 1 + width:] = integral[:, radius + width:radius + 1 + width]
+        integral[radius + 1 + height:] = integral[radius + height]
+
+        size = 2 * radius + 1
+        sums = integral[size:size + height, size:size + width] - integral[:height, size:size + width]
+        sums -= integral[size:size + height, :width]
+        sums += integral[:height, :width]
+        del integral, inner
+        means = sums.astype(np.float32)
+        del sums
+        rows, columns = np.arange(height), np.arange(width)
+        means /= (np.minimum(rows + radius + 1, height) - np.maximum(rows - radius, 0)).astype(np.float32)[:, None]
+        means /= (np.minimum(columns + radius + 1, width) - np.maximum(columns - radius, 0)).astype(np.float32)
+        means -= offset
+        binary = np.full((height, width), 255, dtype=np.uint8)
+        binary[gray < means] = 0
+        return binary
+
+    @staticmethod
+    def estimate_skew(binary, max_skew: float = 5.0, step: float = 0.5, max_points: int = 200000):
+        """
+        Angle in degrees that makes the text lines horizontal: the one whose projection of the
+        ink pixels onto the vertical axis has the sharpest profile (highest variance).
+        """
+        ys, xs = np.nonzero(binary == 0)
+        if len(ys) < 100:
+            return 0.0
+        if len(ys) > max_points:
+            keep = np.linspace(0, len(ys) - 1, max_points).astype(np.int64)
+            ys, xs = ys[keep], xs[keep]
+        angles = np.arange(-max_skew, max_skew + step / 2, step)
+        radians = np.deg2rad(angles)
+        # Row of every ink pixel after rotating by each candidate angle, one row per angle.
+        rows = np.rint(ys[None, :] * np.cos(radians)[:, None] - xs[None, :] * np.sin(radians)[:, None])
+        rows = (rows - rows.min()).astype(np.int64)
+        size = int(rows.max()) + 1
+        offsets = np.arange(len(angles))[:, None] * size
+        profiles = np.bincount((rows + offsets).ravel(), minlength=len(angles) * size)
+        scores = profiles.reshape(len(angles), size).astype(np.float64).var(axis=1)
+        return float(angles[int(np.argmax(scores))])
+
+    @staticmethod
+    def crop_to_content(binary, margin: int = 10, min_ink: float = 0.002):
+        """Crop to the rows and columns that hold more than min_ink of ink, plus a margin."""
+        ink = binary == 0
+        rows = np.nonzero(ink.mean(axis=1) > min_ink)[0]
+        columns = np.nonzero(ink.mean(axis=0) > min_ink)[0]
+        if len(rows) == 0 or len(columns) == 0:
+            return binary
+        top, bottom = max(0, rows[0] - margin), min(binary.shape[0], rows[-1] + margin + 1)
+        left, right = max(0, columns[0] - margin), min(binary.shape[1], columns[-1] + margin + 1)
+        return binary[top:bottom, left:right]
+
+    def process_array(self, array):
+        """Run the configured steps on an image array and return a PIL image for tesseract."""
+        from PIL import Image
+
+        image = self.to_grayscale(array) if self.grayscale or self.binarize else array
+        if self.binarize:
+            image = self.adaptive_threshold(image, self.block_size, self.offset)
+        if self.deskew and image.ndim == 2:
+            angle = self.estimate_skew(image if self.binarize else self.adaptive_threshold(image),
+                                       self.max_skew, self.skew_step)
+            if angle:
+                image = np.asarray(Image.fromarray(image).rotate(
+                    angle, resample=Image.NEAREST if self.binarize else Image.BILINEAR,
+                    expand=True, fillcolor=255))
+        if self.crop and self.binarize:
+            image = self.crop_to_content(image, self.margin)
+        # The result must not share the pixmap's buffer, which is freed after this call.
+        if np.may_share_memory(image, array):
+            image = image.copy()
+        return Image.fromarray(np.ascontiguousarray(image))
+
+    def process_pixmap(self, pix):
+        return self.process_array(self.pixmap_to_array(pix))
+
+    def process_image(self, image):
+        """Preprocess a PIL image, e.g. a page image loaded from disk."""
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGB")
+        return self.process_array(np.asarray(image))
+
+    def process_page(self, page):
+        """Render a PDF page at the configured DPI and preprocess it."""
+        pix = self.render(page)
+        try:
+            return self.process_pixmap(pix)
+        finally:
+            del pix
+
+    def __repr__(self):
+        return f"ImagePreprocessor({', '.join(f'{key}={value!r}' for key, value in vars(self).items())})"
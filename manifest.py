@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from atomic_files import is_complete
+
+
+class Manifest:
+    """
+    Per-directory record of the input hashes each stage used to produce its outputs.
+    A stage only needs to run again for an artifact when its input hash changed
+    or one of its outputs is gone.
+    """
+
+    def __init__(self, directory: str, file_name: str = "manifest.json", logger=None):
+        self.path = os.path.join(directory, file_name)
+        self.logger = logger or logging
+        self.lock = threading.Lock()
+        self.file_hashes = {}
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as manifest_file:
+                    self.entries = json.load(manifest_file).get("stages", {})
+            except (OSError, ValueError) as e:
+                self.logger.warning(
+                    f"Ignoring unreadable manifest {self.path}: {str(e)}")
+                self.entries = {}
+
+    def save(self):
+        with self.lock:
+            content = json.dumps(
+                {"version": 1, "stages": self.entries}, indent=1, sort_keys=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as manifest_file:
+            manifest_file.write(content)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def hash_values(*values):
+        digest = hashlib.sha256()
+        for value in values:
+            if not isinstance(value, (str, bytes)):
+                value = json.dumps(value, sort_keys=True, default=str)
+            digest.update(value if isinstance(
+                value, bytes) else value.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def hash_file(self, path: str):
+        """Hash a file's content; cached by size and modification time."""
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self.file_hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        self.file_hashes[path] = (signature, digest.hexdigest())
+        return self.file_hashes[path][1]
+
+    def get(self, stage: str, key: str):
+        with self.lock:
+            return self.entries.get(stage, {}).get(key)
+
+    def record(self, stage: str, key: str, inputs, outputs: list = None, **extra):
+        with self.lock:
+            self.entries.setdefault(stage, {})[key] = {
+                "inputs": inputs, "outputs": list(outputs or []), **extra}
+
+    def is_fresh(self, stage: str, key: str, inputs):
+        """True if the entry was recorded with the same inputs and all its outputs exist."""
+        entry = self.get(stage, key)
+        if entry is None:
+            return False
+        if entry["inputs"] != inputs:
+            return False
+        return all(os.path.exists(path) for path in entry["outputs"])
+
+    def adopt(self, stage: str, key: str, inputs, outputs: list):
+        """
+        Record outputs that exist but predate the manifest, so they are not recomputed.
+        Outputs an interrupted run left truncated are not adopted.
+        """
+        if self.get(stage, key) is None and outputs and all(is_complete(path) for path in outputs):
+            self.record(stage, key, inputs, outputs)
+            return True
+        return False
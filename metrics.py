@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# For token counts, e.g. of prompts; the default buckets are seconds.
+TOKEN_BUCKETS = (25, 50, 100, 200, 300, 400, 600, 800, 1200, 1600, 2400, 3200)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "buckets": dict(zip((str(bound) for bound in self.buckets), self.counts))}
+
+
+class Metrics:
+    """
+    Collects spans per page and stage, counters and latency histograms,
+    and exports them to a JSON file or a Prometheus textfile.
+    """
+
+    def __init__(self, prefix: str = "receipts"):
+        self.prefix = prefix
+        self.spans = []
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+    def increment(self, name: str, value: float = 1, **labels):
+        with self.lock:
+            self.counters[self._key(name, labels)] += value
+
+    def observe(self, name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels):
+        """Add a value to a histogram; buckets only apply when the histogram is created."""
+        with self.lock:
+            key = self._key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def record_span(self, stage: str, duration: float, page=None, error: str = None, **attributes):
+        """Record a span that was timed elsewhere, e.g. inside an OCR worker process."""
+        span = {"stage": stage, "page": page, "duration": round(duration, 6),
+                "end": time.time(), "error": error, **attributes}
+        with self.lock:
+            self.spans.append(span)
+        self.observe("stage_duration_seconds", duration, stage=stage)
+        if error is not None:
+            self.increment("stage_errors_total", stage=stage)
+
+    @contextmanager
+    def span(self, stage: str, page=None, **attributes):
+        start_time = time.time()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.record_span(stage, time.time() - start_time,
+                             page=page, error=error, **attributes)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "spans": list(self.spans),
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels), **histogram.to_dict()}
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    @staticmethod
+    def _escape(value):
+        """Escape a label value for the Prometheus text format."""
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _format_labels(labels, extra: dict = None):
+        pairs = list(labels) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{Metrics._escape(value)}"' for key, value in pairs) + "}"
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(
+                            f"{self.prefix}_{name}{self._format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(
+                            f"{self.prefix}_{name}_bucket{self._format_labels(labels, {'le': bound})} {count}")
+                    lines.append(
+                        f"{self.prefix}_{name}_bucket{self._format_labels(labels, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(
+                        f"{self.prefix}_{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                    lines.append(
+                        f"{self.prefix}_{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """Write the metrics as a Prometheus textfile (.prom) or as JSON (any other extension)."""
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        # Write and rename, so node_exporter never reads a partial textfile.
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(content)
+        os.replace(temp_path, path)
+        return path
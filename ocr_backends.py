@@ -0,0 +1,112 @@
+import atexit
+import logging
+import threading
+
+
+class PytesseractBackend:
+    """Runs the tesseract binary through pytesseract; starts a new process for every image."""
+
+    name = "pytesseract"
+
+    def __init__(self, language: str = None, oem: int = None):
+        import pytesseract
+
+        self.pytesseract = pytesseract
+        self.language = language
+        self.oem = oem
+
+    def image_to_text(self, image, psm: int = None, whitelist: str = None):
+        config = []
+        if psm is not None:
+            config.append(f"--psm {psm}")
+        if self.oem is not None:
+            config.append(f"--oem {self.oem}")
+        if whitelist:
+            config.append(f"-c tessedit_char_whitelist={whitelist}")
+        return self.pytesseract.image_to_string(image, lang=self.language, config=" ".join(config))
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend:
+    """
+    Calls the tesseract C API through tesserocr. The language data is loaded once when
+    the engine is created and reused for every image the engine reads.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, language: str = None, oem: int = None):
+        import tesserocr
+
+        self.tesserocr = tesserocr
+        options = {"lang": language or "eng"}
+        # tesserocr's OEM and PSM are plain int constants; the classes can't be instantiated.
+        if oem is not None:
+            options["oem"] = oem
+        self.api = tesserocr.PyTessBaseAPI(**options)
+        self.default_psm = self.api.GetPageSegMode()
+
+    def image_to_text(self, image, psm: int = None, whitelist: str = None):
+        self.api.SetPageSegMode(psm if psm is not None else self.default_psm)
+        self.api.SetVariable("tessedit_char_whitelist", whitelist or "")
+        self.api.SetImage(image)
+        try:
+            return self.api.GetUTF8Text()
+        finally:
+            self.api.Clear()
+
+    def close(self):
+        self.api.End()
+
+
+BACKENDS = {
+    PytesseractBackend.name: PytesseractBackend,
+    TesserocrBackend.name: TesserocrBackend,
+}
+
+# Engines live as long as their process (OCR worker or main process), one set per thread,
+# since a tesseract API handle must not be shared between threads.
+_engines = threading.local()
+_all_engines = []
+_lock = threading.Lock()
+
+
+def get_engine(backend: str = "auto", language: str = None, oem: int = None):
+    """
+    Return this thread's engine for the backend, creating it on first use.
+    "auto" prefers tesserocr and falls back to pytesseract if it isn't installed or fails to start.
+    """
+    engines = getattr(_engines, "engines", None)
+    if engines is None:
+        engines = _engines.engines = {}
+    key = (backend, language, oem)
+    if key not in engines:
+        engines[key] = create_engine(backend, language, oem)
+        with _lock:
+            _all_engines.append(engines[key])
+    return engines[key]
+
+
+def create_engine(backend: str = "auto", language: str = None, oem: int = None):
+    if backend == "auto":
+        try:
+            return TesserocrBackend(language, oem)
+        except ImportError:
+            logging.debug("tesserocr is not installed, using pytesseract")
+        except RuntimeError as e:
+            # tesserocr is installed but can't load the language data, e.g. "Failed to init API".
+            logging.warning(f"Failed to start tesserocr ({str(e)}), using pytesseract")
+        return PytesseractBackend(language, oem)
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown OCR backend {backend!r}, expected one of: auto, {', '.join(BACKENDS)}")
+    return BACKENDS[backend](language, oem)
+
+
+@atexit.register
+def close_engines():
+    with _lock:
+        while _all_engines:
+            _all_engines.pop().close()
@@ -0,0 +1,263 @@
+import os
+import time
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from atomic_files import save_pixmap, write_text
+
+
+def _image_to_text(image, backend: str = "pytesseract", preprocessor=None):
+    """OCR an image with this process's long-lived engine for the backend."""
+    from ocr_backends import get_engine
+
+    if preprocessor is None:
+        return get_engine(backend).image_to_text(image)
+    return get_engine(backend, preprocessor.language, preprocessor.oem).image_to_text(
+        image, psm=preprocessor.psm, whitelist=preprocessor.whitelist)
+
+
+def _ocr_image_file(image_path: str, backend: str = "pytesseract", preprocessor=None):
+    """
+    Worker: run tesseract on a single image file, preprocessed if a preprocessor is given.
+    Returns the image path, the extracted text and the OCR duration in seconds.
+    """
+    from PIL import Image
+
+    start_time = time.time()
+    with Image.open(image_path) as image:
+        if preprocessor is not None:
+            image = preprocessor.process_image(image)
+        image_text = _image_to_text(image, backend, preprocessor)
+    return image_path, image_text, time.time() - start_time
+
+
+def _warm_up(_, backend: str = "pytesseract", preprocessor=None):
+    """Worker: create this process's OCR engine before the first page arrives."""
+    from ocr_backends import get_engine
+
+    if preprocessor is None:
+        get_engine(backend)
+    else:
+        get_engine(backend, preprocessor.language, preprocessor.oem)
+
+
+# (path, document) by thread. Without a pool several threads OCR in this process, and a thread
+# must not close the document another thread is still rendering from.
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def _get_document(pdf_path: str):
+    """Keep the current document open in each worker process, or in each thread without a pool."""
+    import fitz
+
+    thread = threading.get_ident()
+    with _documents_lock:
+        current = _documents.get(thread)
+    if current is not None and current[0] == pdf_path:
+        return current[1]
+    if current is not None:
+        current[1].close()
+    document = fitz.open(pdf_path)
+    with _documents_lock:
+        _documents[thread] = (pdf_path, document)
+    return document
+
+
+def _close_documents():
+    with _documents_lock:
+        for _, document in _documents.values():
+            document.close()
+        _documents.clear()
+
+
+def _ocr_pdf_page(job: tuple, backend: str = "pytesseract", preprocessor=None):
+    """
+    Worker: render a PDF page and run tesseract on the pixmap buffer directly, or on
+    the preprocessed page if a preprocessor is given.
+    The page image is only written to disk when image_path is set.
+    Returns the page index, the extracted text (None if do_ocr is False) and the OCR duration.
+    """
+    from pdf_handler import PdfHandler
+
+    pdf_path, page_index, image_path, do_ocr = job
+    page = _get_document(pdf_path)[page_index]
+    image_text = None
+    duration = 0.0
+    pix = None
+    if do_ocr and preprocessor is not None:
+        start_time = time.time()
+        image_text = _image_to_text(
+            preprocessor.process_page(page), backend, preprocessor)
+        duration = time.time() - start_time
+    elif do_ocr:
+        # A page that is also saved is rendered once, in colour, for both.
+        pix = page.get_pixmap() if image_path is not None else PdfHandler.render_page(page)
+        start_time = time.time()
+        image = PdfHandler.pixmap_to_image(pix)
+        image_text = _image_to_text(image, backend)
+        duration = time.time() - start_time
+        # Release the shared buffer before the pixmap is freed.
+        del image
+    if image_path is not None:
+        save_pixmap(pix if pix is not None else page.get_pixmap(), image_path)
+    return page_index, image_text, duration
+
+
+class OcrHandler:
+    def __init__(self, logger=None, workers: int = None, chunk_size: int = 1, preprocessor=None,
+                 backend: str = "auto"):
+        """
+        Args:
+            logger: Logger instance.
+            workers (int): Number of OCR processes. Defaults to the CPU count; 1 disables the pool.
+            chunk_size (int): Number of pages sent to a worker at once.
+            preprocessor (ImagePreprocessor): Optional DPI, binarization, deskew, crop and
+                tesseract settings applied before OCR.
+            backend (str): OCR engine, see ocr_backends: "tesserocr" keeps the language data loaded
+                in each worker, "pytesseract" starts tesseract per page, "auto" prefers tesserocr.
+        """
+        self.logger = logger or logging
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self.preprocessor = preprocessor
+        self.backend = backend
+        self.page_durations = {}
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_text_path(self, image_path: str):
+        return os.path.splitext(image_path)[0] + ".txt"
+
+    def get_executor(self):
+        """The worker pool is created on first use and kept until close(), so batches can share it."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def get_worker(self, func):
+        return partial(func, backend=self.backend, preprocessor=self.preprocessor)
+
+    def _map(self, func, jobs: list):
+        func = self.get_worker(func)
+        if self.workers == 1 or len(jobs) <= 1:
+            yield from map(func, jobs)
+            return
+        # Executor.map yields results in input order.
+        yield from self.get_executor().map(func, jobs, chunksize=self.chunk_size)
+
+    def warm_up(self):
+        """Start the worker processes and load their OCR engines, e.g. when a service starts."""
+        list(self._map(_warm_up, list(range(self.workers))))
+
+    def ocr_page(self, image_path: str = None, pdf_path: str = None, page_index: int = None):
+        """
+        OCR a single page on the shared worker pool: either an image file or,
+        without image_path, the page of the PDF rendered in memory.
+
+        Returns:
+            tuple: Extracted text and OCR duration in seconds.
+        """
+        if image_path is not None:
+            func, job = _ocr_image_file, image_path
+        else:
+            func, job = _ocr_pdf_page, (pdf_path, page_index, None, True)
+        func = self.get_worker(func)
+        if self.workers == 1:
+            result = func(job)
+        else:
+            result = self.get_executor().submit(func, job).result()
+        image_text, duration = result[1], result[2]
+        self.page_durations[image_path or (pdf_path, page_index)] = duration
+        return image_text, duration
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        # Without a pool the documents were opened in this process.
+        _close_documents()
+
+    def extract_texts(self, image_paths: list, overwrite: bool = False):
+        """
+        Extract text from the images and save it next to each image as a .txt file.
+        Pages with an existing text file are skipped unless overwrite is set.
+
+        Args:
+            image_paths (list): Image paths, in page order.
+            overwrite (bool): Flag indicating whether to overwrite existing text files.
+
+        Returns:
+            list: Text file paths in the same order as image_paths.
+        """
+        text_paths = [self.get_text_path(path) for path in image_paths]
+        pending = [image_path for image_path, text_path in zip(image_paths, text_paths)
+                   if overwrite or not os.path.exists(text_path)]
+
+        start_time = time.time()
+        for image_path, image_text, duration in self._map(_ocr_image_file, pending):
+            text_file_path = self.get_text_path(image_path)
+            self.page_durations[image_path] = duration
+            self.logger.info(
+                f"Writing text file: {text_file_path} (OCR {duration:.2f} seconds)")
+            write_text(text_file_path, image_text)
+
+        if pending:
+            self.logger.info(
+                f"OCR of {len(pending)} pages took {time.time() - start_time:.2f} seconds "
+                f"with {self.workers} workers")
+        return text_paths
+
+    def extract_texts_from_pdf(self, pdf_path: str, target: str, overwrite: bool = False,
+                               save_images: bool = True, skip_pages: set = None, pages=None):
+        """
+        Render the PDF pages in memory and OCR the pixmaps without a PNG round trip.
+
+        Args:
+            pdf_path (str): Path to the input PDF file.
+            target (str): Directory where the text files (and images) will be saved.
+            overwrite (bool): Flag indicating whether to overwrite existing files.
+            save_images (bool): Also write page_{i}.png, e.g. for archiving or create_pdf_from_files.
+            skip_pages (set): Page indexes that already have a text file from another source.
+            pages (range): Page indexes to process, e.g. one chunk of a large scan. Defaults to all.
+
+        Returns:
+            tuple: Image paths (empty if save_images is False) and text paths of the pages, in page order.
+        """
+        if pages is None:
+            import fitz
+
+            with fitz.open(pdf_path) as doc:
+                pages = range(doc.page_count)
+
+        image_paths = {i: os.path.join(target, f"page_{i}.png") for i in pages}
+        text_paths = {i: self.get_text_path(path) for i, path in image_paths.items()}
+        jobs = []
+        for i in pages:
+            do_ocr = i not in (skip_pages or ()) and (
+                overwrite or not os.path.exists(text_paths[i]))
+            save_image = save_images and (
+                overwrite or not os.path.exists(image_paths[i]))
+            if do_ocr or save_image:
+                jobs.append((pdf_path, i, image_paths[i]
+                            if save_image else None, do_ocr))
+
+        start_time = time.time()
+        for page_index, image_text, duration in self._map(_ocr_pdf_page, jobs):
+            if image_text is None:
+                continue
+            text_file_path = text_paths[page_index]
+            self.page_durations[image_paths[page_index]] = duration
+            self.logger.info(
+                f"Writing text file: {text_file_path} (OCR {duration:.2f} seconds)")
+            write_text(text_file_path, image_text)
+
+        if jobs:
+            self.logger.info(
+                f"In-memory OCR of {len(jobs)} pages took {time.time() - start_time:.2f} seconds "
+                f"with {self.workers} workers")
+        return (list(image_paths.values()) if save_images else []), list(text_paths.values())
@@ -1,13 +1,36 @@
 import os
+import time
 import logging
+import threading
 import fitz
 import yaml
 
+import receipt_template
+from atomic_files import save_document, save_pixmap, write_text
+
+
+def _build_pdfs(groups: list, signature_stream: bytes, pdf_handler=None):
+    """Worker: build and save the receipt PDFs of one chunk of groups."""
+    pdf_handler = pdf_handler or PdfHandler()
+    results = []
+    for files, target in groups:
+        new_doc, title = pdf_handler.build_pdf(files, signature_stream)
+        save_document(new_doc, target)
+        new_doc.close()
+        results.append((target, title))
+    return results
+
 
 class PdfHandler:
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, use_template=True):
         self.fitz = fitz
         self.logger = logger or logging
+        # Compiled Bewirtungsbeleg templates, one per signature image.
+        self.use_template = use_template
+        self.templates = {}
+        # PyMuPDF is not thread-safe; threads share this lock for all fitz calls.
+        self.lock = threading.Lock()
+        self.page_durations = {}
 
     def has_key(self, dict, key):
         try:
@@ -17,150 +40,257 @@ class PdfHandler:
             return False
 
     def get_billing_text(self, data: dict):
-        lines = []
-        dblnb = '\n\n'
-        brktab = '\n\t\t'
-        search_keys = ['location_name', 'address', 'currency_code', 'names',
-                       'topic', 'total_without_tip', 'tip_amount', 'total_with_tip', 'date',]
-        validated_keys = [
-            key for key in search_keys if self.has_key(data, key)]
-        validated_keys.sort(key=search_keys.index)
-        for key in validated_keys:
-            try:
-                match key:
-                    case 'location_name':
-                        lines.append(f"Name und Ort der Bewirtung:")
-                        lines.append(f"{data['location_name']}")
-                        lines.append(f"{data['address']}")
-                        lines.append(dblnb)
-                    case 'names':
-                        lines.append(f"Bewirtende Person:")
-                        lines.append(f"{data['names'][0]}")
-                        lines.append(dblnb)
-                        lines.append(f"Bewirtete Personen:")
-                        for name in data['names'][1:]:
-                            lines.append(f" - {name}")
-                        lines.append(dblnb)
-                    case 'topic':
-                        lines.append(f"Anlass der Bewirtung:")
-                        lines.append(f"{data['topic']}")
-                        lines.append(dblnb)
-                    case 'total_without_tip':
-                        lines.append(
-                            f"Höhe der Aufwendungen gemäß beigefügter Rechnung:")
-                        total_with_tip = str(data['total_with_tip']).replace(
-                            '.', ',')
-                        lines.append(
-                            f"{total_with_tip} {data['currency_code']} (inkl. MwSt.)")
-                        lines.append(dblnb)
-                    case 'tip_amount':
-                        tip = str(data['tip_amount']).replace('.', ',')
-                        lines.append(
-                            f"Trinkgeld: {brktab} {tip} {data['currency_code']}")
-                        lines.append(dblnb)
-                    case 'total_with_tip':
-                        total_with_tip = str(data['total_with_tip']).replace(
-                            '.', ',')
-                        lines.append(
-                            f"Gesamtbetrag: {brktab} {total_with_tip} {data['currency_code']}")
-                        lines.append(dblnb)
-                    case 'date':
-                        lines.append(f"Ort, Datum: Berlin, {data['date']}")
-                        lines.append(dblnb)
-                        lines.append(f"Unterschrift des Bewirtenden:")
-            except:
-                pass
-
-        return lines
+        return receipt_template.get_billing_text(data)
 
     def replace_text(self, text, search, new_text):
         return text.replace(search, new_text)
 
-    def create_pdf_from_files(self, files: list, target: str, path_to_signature_image: str):
-        """
-        Combine files to a PDF and save it in the target directory.
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+    BILLING_EXTENSIONS = ('.yml', '.yaml')
 
-        Args:
-            files (list): List of image paths.
-            target (str): Directory where the PDF will be saved.
-            overwrite (bool): Flag indicating whether to overwrite existing PDF. Default is False.
+    def add_billing_page(self, doc, data: dict, signature_stream: bytes, state: dict):
+        """
+        Add a Bewirtungsbeleg page for the billing data. The signature image is embedded
+        on first use and referenced by its xref on every further page of the document.
         """
-
         def _update_pdf_coord(fitz, x, y):
             return fitz.Point(x, y)
 
+        text_lines = self.get_billing_text(data)
+
+        page = doc.new_page()
+        coord = self.fitz.Point(50, 50)
+
+        page.insert_text(coord,
+                         "Bewirtungsbeleg\n",
+                         fontname="helv",
+                         fontsize=18,
+                         rotate=0,
+                         )
+        page.insert_text(_update_pdf_coord(self.fitz, coord.x, coord.y + 20),
+                         "(nach § 4 Abs. 5 Nr. 2 EStG)",
+                         fontname="helv",
+                         fontsize=10,
+                         rotate=0,
+                         )
+        page.insert_text(_update_pdf_coord(self.fitz, coord.x, coord.y + 30),
+                         f"Datum: {data['date']}",
+                         fontname="helv",
+                         fontsize=10,
+                         rotate=0,
+                         )
+        page.insert_text(_update_pdf_coord(self.fitz, coord.x, coord.y + 50),
+                         text_lines,
+                         fontname="helv",
+                         fontsize=12,
+                         rotate=0,
+                         )
+        signature_rect = self.fitz.Rect(50, 400, 195, 757)
+        if state.get("signature_xref"):
+            page.insert_image(signature_rect, xref=state["signature_xref"])
+        else:
+            state["signature_xref"] = page.insert_image(
+                signature_rect, stream=signature_stream)
+        return page
+
+    def get_template(self, signature_stream: bytes):
+        key = hash(signature_stream)
+        if key not in self.templates:
+            self.templates[key] = receipt_template.ReceiptTemplate(
+                signature_stream)
+        return self.templates[key]
+
+    def build_pdf(self, files: list, signature_stream: bytes):
+        """
+        Combine files into a new document, dispatching on the file extension:
+        billing YAML becomes a Bewirtungsbeleg page, PDFs are appended, images are converted.
+
+        Returns:
+            tuple: The document and a bookmark title taken from the billing data.
+        """
+        new_doc = self.fitz.open()
+        state = {}
+        title = None
+        for file in files:
+            extension = os.path.splitext(file)[1].lower()
+            if extension in self.BILLING_EXTENSIONS:
+                with open(file, 'r') as billing_file:
+                    data = yaml.safe_load(billing_file)
+                if self.use_template:
+                    self.get_template(signature_stream).add_page(new_doc, data)
+                else:
+                    self.add_billing_page(
+                        new_doc, data, signature_stream, state)
+                title = title or " ".join(str(data[key]) for key in ('date', 'location_name')
+                                          if self.has_key(data, key))
+            elif extension == '.pdf':
+                with self.fitz.open(file) as n_pdf:
+                    new_doc.insert_pdf(n_pdf)
+            elif extension in self.IMAGE_EXTENSIONS:
+                with self.fitz.open(file) as n_pdf:
+                    new_doc.insert_file(n_pdf)
+            else:
+                self.logger.warning(f"Skipping unsupported file: {file}")
+        return new_doc, title or os.path.basename(files[0] if files else "")
+
+    def read_signature(self, path_to_signature_image: str):
+        with open(path_to_signature_image, 'rb') as signature_file:
+            return signature_file.read()
+
+    def create_pdf_from_files(self, files: list, target: str, path_to_signature_image: str,
+                              signature_stream: bytes = None):
+        """
+        Combine files to a PDF and save it in the target directory.
+
+        Args:
+            files (list): Billing YAML, PDF and image paths, in page order.
+            target (str): Path of the PDF to write.
+            path_to_signature_image (str): Signature image for the billing pages.
+            signature_stream (bytes): The signature image, if it has been read already.
+        """
         target_dir = os.path.dirname(target)
         if os.path.isdir(target_dir):
-            new_doc = self.fitz.open()
-            for file in files:
-                # if self.fitz can open file, then do so and insert it into doc,
-                # otherwise try to read the text in the file
-                try:
-                    n_pdf = self.fitz.open(file)
-                    new_doc.insert_file(n_pdf)
-                    n_pdf.close()
-                except:
-                    with open(file, 'r') as file:
-                        data = yaml.safe_load(file)
-                        text_lines = self.get_billing_text(data)
-
-                        page = new_doc.new_page()
-                        coord = self.fitz.Point(50, 50)
-
-                        page.insert_text(coord,
-                                         "Bewirtungsbeleg\n",
-                                         fontname="helv",
-                                         fontsize=18,
-                                         rotate=0,
-                                         )
-                        page.insert_text(_update_pdf_coord(self.fitz, coord.x, coord.y + 20),
-                                         "(nach § 4 Abs. 5 Nr. 2 EStG)",
-                                         fontname="helv",
-                                         fontsize=10,
-                                         rotate=0,
-                                         ),
-                        page.insert_text(_update_pdf_coord(self.fitz, coord.x, coord.y + 30),
-                                         f"Datum: {data['date']}",
-                                         fontname="helv",
-                                         fontsize=10,
-                                         rotate=0,
-                                         ),
-                        page.insert_text(_update_pdf_coord(self.fitz, coord.x, coord.y + 50),
-                                         text_lines,
-                                         fontname="helv",
-                                         fontsize=12,
-                                         rotate=0,
-                                         ),
-                        page.insert_image(
-                            self.fitz.Rect(50, 400, 195, 757),
-                            filename=path_to_signature_image,
-                        )
-
-            # output_path = os.path.join(target, "output.pdf")
-            success = new_doc.save(target)
+            if signature_stream is None:
+                signature_stream = self.read_signature(path_to_signature_image)
+            new_doc, _ = self.build_pdf(files, signature_stream)
+            success = save_document(new_doc, target)
             new_doc.close()
             return success
 
-    def create_images_for_pdf(self, file_path: str, target: str, overwrite: bool = False):
+    def create_pdfs_from_groups(self, groups: list, path_to_signature_image: str, combined_target: str = None,
+                                workers: int = 1, min_parallel_groups: int = 50):
+        """
+        Build the receipt PDFs for all groups in one pass, optionally in several processes,
+        and optionally combine them into one bookmarked PDF.
+
+        Args:
+            groups (list): (files, target) tuples, one per receipt PDF.
+            path_to_signature_image (str): Signature image, read once for all receipts.
+            combined_target (str): Path of the combined PDF, e.g. for the year-end report.
+            workers (int): Number of processes for large batches.
+            min_parallel_groups (int): Smaller batches are built in this process.
+
+        Returns:
+            list: (target, bookmark title) tuples of the written receipt PDFs.
+        """
+        signature_stream = self.read_signature(path_to_signature_image)
+        groups = [(list(files), target) for files, target in groups]
+        if workers > 1 and len(groups) >= min_parallel_groups:
+            from concurrent.futures import ProcessPoolExecutor
+
+            chunk_size = -(-len(groups) // workers)
+            chunks = [groups[i:i + chunk_size]
+                      for i in range(0, len(groups), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = [result for chunk_results in executor.map(
+                    _build_pdfs, chunks, [signature_stream] * len(chunks)) for result in chunk_results]
+        else:
+            results = _build_pdfs(groups, signature_stream, self)
+        self.logger.info(f"Created {len(results)} receipt PDFs")
+
+        if combined_target is not None:
+            self.combine_pdfs(results, combined_target)
+        return results
+
+    def combine_pdfs(self, documents: list, target: str):
+        """
+        Concatenate (path, title) documents into one PDF with a bookmark per document.
+        Saving with garbage=4 merges the duplicate signature image streams into one object.
+        """
+        combined = self.fitz.open()
+        toc = []
+        for path, title in documents:
+            toc.append([1, title, combined.page_count + 1])
+            with self.fitz.open(path) as doc:
+                combined.insert_pdf(doc)
+        combined.set_toc(toc)
+        save_document(combined, target, garbage=4, deflate=True)
+        combined.close()
+        self.logger.info(f"Created combined PDF: {target}")
+        return target
+
+    def create_images_for_pdf(self, file_path: str, target: str, overwrite: bool = False, pages=None):
         """
         Convert pages of a PDF to images and save them in the target pdf_file_path.
+        Only one page and its pixmap are held at a time, and each image is written
+        to a temporary file first, so an interrupted run never leaves a truncated PNG.
 
         Args:
             file_path (str): Path to the input PDF file.
             target (str): Directory where the images will be saved.
             overwrite (bool): Flag indicating whether to overwrite existing images. Default is False.
+            pages (range): Page indexes to convert, e.g. one chunk of a large scan. Defaults to all.
         """
+        extracted_images = []
         if os.path.isdir(target) and file_path.endswith('.pdf'):
-            doc = fitz.open(file_path)
-            for i, page in enumerate(doc):
-                pix = page.get_pixmap()
-                image_path = os.path.join(target, f"page_{i}.png")
-                if overwrite or not os.path.exists(image_path):
-                    pix.save(image_path)
-                    self.logger.info(f'Created image: {image_path}')
-                self.extracted_images.append(image_path)
-
-        return self.extracted_images
+            with fitz.open(file_path) as doc:
+                for i in pages if pages is not None else range(doc.page_count):
+                    image_path = os.path.join(target, f"page_{i}.png")
+                    if overwrite or not os.path.exists(image_path):
+                        start_time = time.time()
+                        pix = doc[i].get_pixmap()
+                        save_pixmap(pix, image_path)
+                        self.page_durations[image_path] = time.time() - start_time
+                        self.logger.info(f'Created image: {image_path}')
+                    extracted_images.append(image_path)
+
+        return extracted_images
+
+    @staticmethod
+    def get_text_layer(page, min_chars: int = 25):
+        """
+        Return the page's embedded text if it has at least min_chars letters or digits, else None.
+        """
+        text = page.get_text("text")
+        usable_chars = sum(1 for char in text if char.isalnum())
+        return text if usable_chars >= min_chars else None
+
+    def extract_text_layers(self, file_path: str, target: str, overwrite: bool = False,
+                            min_chars: int = 25, pages=None):
+        """
+        Save the text layer of native PDF pages to page_{i}.txt, so they can skip OCR.
+
+        Args:
+            file_path (str): Path to the input PDF file.
+            target (str): Directory where the text files will be saved.
+            overwrite (bool): Flag indicating whether to overwrite existing text files.
+            min_chars (int): Minimum number of letters and digits for a usable text layer.
+            pages (range): Page indexes to look at. Defaults to all.
+
+        Returns:
+            dict: Page index to "text_layer" or "ocr".
+        """
+        sources = {}
+        with fitz.open(file_path) as doc:
+            for i in pages if pages is not None else range(doc.page_count):
+                text = self.get_text_layer(doc[i], min_chars)
+                sources[i] = "ocr" if text is None else "text_layer"
+                text_path = os.path.join(target, f"page_{i}.txt")
+                if text is not None and (overwrite or not os.path.exists(text_path)):
+                    self.logger.info(
+                        f"Writing text file from text layer: {text_path}")
+                    write_text(text_path, text)
+        return sources
+
+    @staticmethod
+    def render_page(page, grayscale: bool = True):
+        """
+        Render a page to a pixmap for OCR. Grayscale pixmaps have one byte per pixel,
+        which PIL can wrap without copying.
+        """
+        return page.get_pixmap(colorspace=fitz.csGRAY if grayscale else fitz.csRGB, alpha=False)
+
+    @staticmethod
+    def pixmap_to_image(pix):
+        """
+        Wrap the pixmap's sample buffer in a PIL image. For "L" and "RGBA" pixmaps
+        the image shares the buffer, so the pixmap must outlive the image.
+        """
+        from PIL import Image
+
+        mode = {1: "L", 3: "RGB", 4: "RGBA"}[pix.n]
+        samples = pix.samples_mv if hasattr(pix, "samples_mv") else pix.samples
+        return Image.frombuffer(mode, (pix.width, pix.height), samples, "raw", mode, pix.stride, 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+
+class PageJob:
+    """A single page flowing through the pipeline, with its artifact paths and stage timings."""
+
+    def __init__(self, index: int, pdf_file_path: str, directory: str):
+        self.index = index
+        self.pdf_file_path = pdf_file_path
+        base_path = os.path.join(directory, f"page_{index}")
+        self.image_path = f"{base_path}.png"
+        self.text_path = f"{base_path}.txt"
+        self.json_path = f"{base_path}.json"
+        self.billing_path = f"{base_path}.yml"
+        self.receipt_path = f"{base_path}.pdf"
+        # "text_layer" for native PDF pages, "ocr" for scanned ones.
+        self.source = None
+        self.durations = {}
+        self.error = None
+
+
+class Stage:
+    def __init__(self, name: str, func, workers: int = 1):
+        """
+        Args:
+            name (str): Stage name, used for timings and logging.
+            func (callable): Called with each item; its return value is passed downstream.
+            workers (int): Number of threads running func.
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues.
+    Each item moves to the next stage as soon as it is done, and a full queue
+    blocks the stage in front of it, so only a few items are in flight at once.
+    """
+    _DONE = object()
+
+    def __init__(self, stages: list, queue_size: int = 4, logger=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.logger = logger or logging
+
+    def _feed(self, items, output: queue.Queue, errors: list):
+        try:
+            for item in items:
+                output.put(item)
+        except Exception as e:
+            self.logger.error(f"Pipeline source failed: {str(e)}")
+            errors.append(e)
+        finally:
+            output.put(self._DONE)
+
+    def _work(self, stage: Stage, source: queue.Queue, output: queue.Queue, remaining: list,
+              lock: threading.Lock):
+        while True:
+            item = source.get()
+            if item is self._DONE:
+                # Let the sibling workers see the sentinel too; the last one passes it on.
+                source.put(self._DONE)
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        output.put(self._DONE)
+                return
+            if getattr(item, "error", None) is None:
+                start_time = time.time()
+                try:
+                    item = stage.func(item)
+                except Exception as e:
+                    item.error = f"{stage.name}: {str(e)}"
+                    self.logger.error(f"Stage {stage.name} failed: {str(e)}")
+                durations = getattr(item, "durations", None)
+                if durations is not None:
+                    durations[stage.name] = time.time() - start_time
+            output.put(item)
+
+    def run(self, items):
+        """
+        Yield the items in the order they leave the last stage. If the source fails, the items
+        it produced are still yielded and its exception is raised afterwards.
+        """
+        errors = []
+        queues = [queue.Queue(self.queue_size)
+                  for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(
+            target=self._feed, args=(items, queues[0], errors), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[i], queues[i + 1], remaining, lock),
+                    name=f"{stage.name}-worker", daemon=True))
+
+        for thread in threads:
+            thread.start()
+        while True:
+            item = queues[-1].get()
+            if item is self._DONE:
+                break
+            yield item
+        for thread in threads:
+            thread.join()
+        # The remaining items never entered the pipeline, so the run is incomplete.
+        if errors:
+            raise errors[0]
@@ -0,0 +1,184 @@
+import re
+import json
+import logging
+
+import data_models
+
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+AMOUNT = r"(-?\d{1,3}(?:[.\s]\d{3})*,\d{2}|-?\d+[.,]\d{2})(?!\d)"
+AMOUNT_PATTERN = re.compile(AMOUNT)
+DATE_PATTERN = re.compile(r"\b(\d{1,2})[./-](\d{1,2})[./-](\d{4}|\d{2})\b")
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+PERCENT_PATTERN = re.compile(r"(\d{1,2}(?:[.,]\d{1,2})?)\s*%")
+POSTAL_CODE_PATTERN = re.compile(
+    r"\b(?:D-)?(\d{5})\s+([A-ZÄÖÜ][\wäöüß.\- ]+)")
+STREET_PATTERN = re.compile(
+    r"(stra(ss|ß)e|str\.|weg|platz|allee|ring|damm|ufer|gasse|markt)\s*\d+\s*[a-z]?\b", re.IGNORECASE)
+VAT_PATTERN = re.compile(
+    r"\b(mwst|ust|mehrwertsteuer|umsatzsteuer|vat|steuer)\b", re.IGNORECASE)
+TIP_PATTERN = re.compile(r"\b(trinkgeld|tip|tipp)\b", re.IGNORECASE)
+# Total keywords, strongest first.
+TOTAL_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"\b(zu zahlen|endbetrag|gesamtbetrag|rechnungsbetrag)\b",
+    r"\b(summe|gesamt|total)\b",
+    r"\b(bar|ec[- ]?karte|kartenzahlung|betrag)\b",
+)]
+CURRENCIES = [("€", "EUR"), ("EUR", "EUR"), ("CHF", "CHF"), ("$", "USD"), ("£", "GBP")]
+
+REQUIRED_FIELDS = ["date", "location_name", "address", "taxes", "total_without_tip"]
+
+
+class ReceiptParser:
+    """
+    Deterministic extractor for German/EU receipts. Fills BillingValues from OCR text with
+    regular expressions and reports a confidence between 0 and 1.
+    """
+
+    def __init__(self, logger=None, tolerance: float = 0.02):
+        self.logger = logger or logging
+        self.tolerance = tolerance
+
+    @staticmethod
+    def to_float(amount: str):
+        amount = amount.replace(" ", "")
+        if "," in amount:
+            amount = amount.replace(".", "").replace(",", ".")
+        return float(amount)
+
+    def get_amounts(self, line: str):
+        # Percentages are not amounts.
+        line = PERCENT_PATTERN.sub(" ", line)
+        return [self.to_float(amount) for amount in AMOUNT_PATTERN.findall(line)]
+
+    def get_date(self, text: str):
+        match = ISO_DATE_PATTERN.search(text)
+        if match:
+            year, month, day = (int(part) for part in match.groups())
+        else:
+            match = DATE_PATTERN.search(text)
+            if match is None:
+                return None
+            day, month, year = (int(part) for part in match.groups())
+            year = year + 2000 if year < 100 else year
+        if not 1 <= month <= 12 or not 1 <= day <= 31:
+            return None
+        return f"{year}.{MONTHS[month - 1]}.{day:02d}"
+
+    def get_total(self, lines: list):
+        for pattern in TOTAL_PATTERNS:
+            for line in lines:
+                if pattern.search(line) and not VAT_PATTERN.search(line) and not TIP_PATTERN.search(line):
+                    amounts = self.get_amounts(line)
+                    if amounts:
+                        return amounts[-1]
+        return None
+
+    def get_taxes(self, lines: list):
+        taxes = []
+        for line in lines:
+            percent = PERCENT_PATTERN.search(line)
+            if percent is None or not (VAT_PATTERN.search(line) or re.match(r"^\s*[A-D]\b", line)):
+                continue
+            percentage = self.to_float(percent.group(1))
+            if percentage <= 0:
+                continue
+            amounts = self.get_amounts(line)
+            tax = self.get_tax(percentage, amounts)
+            if tax is not None:
+                taxes.append(tax)
+        return taxes
+
+    def get_tax(self, percentage: float, amounts: list):
+        """Find the net amount and the VAT among the amounts on a VAT line."""
+        rate = percentage / 100
+        for net in amounts:
+            for vat in amounts:
+                if net != vat and abs(net * rate - vat) <= self.tolerance + net * 0.0005:
+                    return {"percentage": percentage, "amount_taxed": net, "value_added": vat}
+        if len(amounts) == 1:
+            # A single amount on a VAT line is the tax itself.
+            vat = amounts[0]
+            return {"percentage": percentage, "amount_taxed": round(vat / rate, 2), "value_added": vat}
+        return None
+
+    def get_tip(self, lines: list):
+        for line in lines:
+            if TIP_PATTERN.search(line):
+                amounts = self.get_amounts(line)
+                if amounts:
+                    return amounts[-1]
+        return 0.0
+
+    def get_location(self, lines: list):
+        """The business name is the first line with letters; the address ends at the postal code line."""
+        location_name = None
+        address = None
+        for i, line in enumerate(lines):
+            if location_name is None and re.search(r"[A-Za-zÄÖÜäöü]{3}", line) \
+                    and not AMOUNT_PATTERN.search(line):
+                location_name = line
+            match = POSTAL_CODE_PATTERN.search(line)
+            if match and address is None:
+                street = next((candidate for candidate in reversed(lines[max(0, i - 2):i])
+                               if STREET_PATTERN.search(candidate)), None)
+                city = f"{match.group(1)} {match.group(2).strip()}"
+                address = f"{street}, {city}, Deutschland" if street else f"{city}, Deutschland"
+        return location_name, address
+
+    def get_currency(self, text: str):
+        for symbol, code in CURRENCIES:
+            if symbol in text:
+                return ("€" if code == "EUR" else symbol), code
+        return None, None
+
+    def reconciles(self, values: dict):
+        """Check that the VAT lines add up to the total and that the tip adds up to the total with tip."""
+        taxes = values.get("taxes") or []
+        gross = sum(tax["amount_taxed"] + tax["value_added"] for tax in taxes)
+        tolerance = self.tolerance * (len(taxes) + 1)
+        if abs(gross - values["total_without_tip"]) > tolerance:
+            return False
+        return abs(values["total_without_tip"] + values["tip_amount"] - values["total_with_tip"]) <= tolerance
+
+    def parse(self, text: str):
+        """
+        Extract billing values from the OCR text.
+
+        Returns:
+            tuple: The values (None if required fields are missing or the totals don't reconcile),
+                the confidence and a list of problems.
+        """
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        location_name, address = self.get_location(lines)
+        currency_symbol, currency_code = self.get_currency(text)
+        total = self.get_total(lines)
+        tip = self.get_tip(lines)
+        values = {
+            "date": self.get_date(text),
+            "location_name": location_name,
+            "address": address,
+            "currency_symbol": currency_symbol or "€",
+            "currency_code": currency_code or "EUR",
+            "taxes": self.get_taxes(lines),
+            "total_without_tip": total,
+            "total_with_tip": round(total + tip, 2) if total is not None else None,
+            "tip_amount": tip,
+            "tip_percentage": round(tip / total, 2) if total and tip else 0.0,
+        }
+
+        problems = [f"missing {field}" for field in REQUIRED_FIELDS if not values[field]]
+        confidence = 1 - len(problems) / (len(REQUIRED_FIELDS) + 2)
+        if currency_code is None:
+            confidence -= 0.5 / (len(REQUIRED_FIELDS) + 2)
+        if not problems and not self.reconciles(values):
+            problems.append("totals don't reconcile")
+        if problems:
+            confidence -= 1 / (len(REQUIRED_FIELDS) + 2)
+            return None, max(0.0, confidence), problems
+
+        # Same validation and encoding as the LLM path in Chains.BillingDataJson.
+        billing_values = data_models.BillingValues.parse_obj(values)
+        return json.loads(data_models.Encoder().encode(billing_values)), round(confidence, 2), problems
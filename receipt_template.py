@@ -0,0 +1,119 @@
+import fitz
+
+
+DOUBLE_BREAK = '\n\n'
+BREAK_TAB = '\n\t\t'
+
+
+def _format_amount(value):
+    return str(value).replace('.', ',')
+
+
+def _location_name(lines, data):
+    lines.append("Name und Ort der Bewirtung:")
+    lines.append(f"{data['location_name']}")
+    lines.append(f"{data['address']}")
+    lines.append(DOUBLE_BREAK)
+
+
+def _names(lines, data):
+    lines.append("Bewirtende Person:")
+    lines.append(f"{data['names'][0]}")
+    lines.append(DOUBLE_BREAK)
+    lines.append("Bewirtete Personen:")
+    lines.extend(f" - {name}" for name in data['names'][1:])
+    lines.append(DOUBLE_BREAK)
+
+
+def _topic(lines, data):
+    lines.append("Anlass der Bewirtung:")
+    lines.append(f"{data['topic']}")
+    lines.append(DOUBLE_BREAK)
+
+
+def _total_without_tip(lines, data):
+    lines.append("Höhe der Aufwendungen gemäß beigefügter Rechnung:")
+    lines.append(
+        f"{_format_amount(data['total_with_tip'])} {data['currency_code']} (inkl. MwSt.)")
+    lines.append(DOUBLE_BREAK)
+
+
+def _tip_amount(lines, data):
+    lines.append(
+        f"Trinkgeld: {BREAK_TAB} {_format_amount(data['tip_amount'])} {data['currency_code']}")
+    lines.append(DOUBLE_BREAK)
+
+
+def _total_with_tip(lines, data):
+    lines.append(
+        f"Gesamtbetrag: {BREAK_TAB} {_format_amount(data['total_with_tip'])} {data['currency_code']}")
+    lines.append(DOUBLE_BREAK)
+
+
+def _date(lines, data):
+    lines.append(f"Ort, Datum: Berlin, {data['date']}")
+    lines.append(DOUBLE_BREAK)
+    lines.append("Unterschrift des Bewirtenden:")
+
+
+# Keys without a builder (address, currency_code) only feed into the other blocks.
+LINE_BUILDERS = [
+    ('location_name', _location_name),
+    ('names', _names),
+    ('topic', _topic),
+    ('total_without_tip', _total_without_tip),
+    ('tip_amount', _tip_amount),
+    ('total_with_tip', _total_with_tip),
+    ('date', _date),
+]
+
+
+def get_billing_text(data: dict):
+    """
+    Build the variable text lines of a Bewirtungsbeleg. As before, a block whose
+    fields are incomplete keeps the lines it produced up to the missing field.
+    """
+    lines = []
+    for key, builder in LINE_BUILDERS:
+        if key in data:
+            try:
+                builder(lines, data)
+            except Exception:
+                pass
+    return lines
+
+
+class ReceiptTemplate:
+    """
+    Bewirtungsbeleg page with the static header, legal reference and signature compiled
+    once into template pages. Each receipt page only adds its variable text and shows
+    the templates, which PyMuPDF embeds once per document as shared form XObjects.
+    """
+
+    def __init__(self, signature_stream: bytes):
+        self.doc = fitz.open()
+        header = self.doc.new_page()
+        coord = fitz.Point(50, 50)
+        header.insert_text(coord, "Bewirtungsbeleg\n",
+                           fontname="helv", fontsize=18, rotate=0)
+        header.insert_text(fitz.Point(coord.x, coord.y + 20), "(nach § 4 Abs. 5 Nr. 2 EStG)",
+                           fontname="helv", fontsize=10, rotate=0)
+        self.rect = header.rect
+        signature = self.doc.new_page()
+        signature.insert_image(fitz.Rect(50, 400, 195, 757),
+                               stream=signature_stream)
+
+    def add_page(self, doc, data: dict):
+        page = doc.new_page(width=self.rect.width, height=self.rect.height)
+        page.insert_text(fitz.Point(50, 80), f"Datum: {data['date']}",
+                         fontname="helv", fontsize=10, rotate=0)
+        page.insert_text(fitz.Point(50, 100), get_billing_text(data),
+                         fontname="helv", fontsize=12, rotate=0)
+        # Put in front of the text, so the text layer reads header first as in the hand-built layout.
+        page.show_pdf_page(page.rect, self.doc, 0, overlay=False)
+        # Shown last, so the signature covers overlapping text as in the hand-built layout.
+        page.show_pdf_page(page.rect, self.doc, 1)
+        return page
+
+    def close(self):
+        self.doc.close()
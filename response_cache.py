@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+
+class ResponseCache:
+    """
+    Persistent key/value cache for LLM responses, backed by SQLite.
+    Entries are evicted least recently used first once the stored values exceed max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, logger=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logger or logging
+        self.connection = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_text(text: str):
+        return " ".join(text.split())
+
+    @classmethod
+    def get_key(cls, *parts):
+        """Hash the normalized text and any further parts (model name, schema, prompt) into a key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, str):
+                part = json.dumps(part, sort_keys=True)
+            digest.update(cls.normalize_text(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(
+                self.path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self.connection.commit()
+        return self.connection
+
+    def get(self, key: str):
+        with self.lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        payload = json.dumps(value)
+        with self.lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time()))
+            self._evict(connection)
+            connection.commit()
+
+    def _evict(self, connection):
+        total = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self.logger.debug(f"Evicted {len(evicted)} cached responses")
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
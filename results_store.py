@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import logging
+import sqlite3
+import argparse
+import threading
+from datetime import date as Date
+
+import yaml
+
+
+MONTHS = {name: i + 1 for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+MONTHS.update({"mär": 3, "mrz": 3, "mai": 5, "okt": 10, "dez": 12})
+
+FILTER_COLUMNS = {
+    "date_from": "date >= ?",
+    "date_to": "date <= ?",
+    "min_total": "total_with_tip >= ?",
+    "max_total": "total_with_tip <= ?",
+    "currency": "currency_code = ?",
+    "location": "location_name LIKE ?",
+    "document": "document = ?",
+}
+GROUPS = {
+    "year": "substr(date, 1, 4)",
+    "quarter": "substr(date, 1, 4) || '-Q' || ((CAST(substr(date, 6, 2) AS INTEGER) + 2) / 3)",
+    "month": "substr(date, 1, 7)",
+    "location": "location_name",
+    "currency": "currency_code",
+    "document": "document",
+}
+
+
+def normalize_date(value):
+    """Turn the extracted date (YYYY.MMM.DD as prompted, or German/ISO dates) into YYYY-MM-DD."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    match = re.match(r"^(\d{4})[.\-/ ]([A-Za-zä]{3,})[a-zä]*\.?[.\-/ ](\d{1,2})", text)
+    if match and match.group(2)[:3].lower() in MONTHS:
+        year, month, day = int(match.group(1)), MONTHS[match.group(2)[:3].lower()], int(match.group(3))
+    else:
+        match = re.match(r"^(\d{4})[.\-/](\d{1,2})[.\-/](\d{1,2})", text)
+        if match:
+            year, month, day = (int(part) for part in match.groups())
+        else:
+            match = re.match(r"^(\d{1,2})[.\-/](\d{1,2})[.\-/](\d{2,4})", text)
+            if match is None:
+                return None
+            day, month, year = (int(part) for part in match.groups())
+            year = year + 2000 if year < 100 else year
+    try:
+        return Date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+class ResultsStore:
+    """
+    All extracted receipts in one SQLite table, indexed on date, location, currency and totals,
+    so year-end questions are answered with SQL instead of re-reading every JSON file.
+    """
+
+    def __init__(self, path: str, logger=None):
+        self.path = path
+        self.logger = logger or logging
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS receipts (
+                document TEXT NOT NULL,
+                page TEXT NOT NULL,
+                source_path TEXT,
+                date TEXT,
+                location_name TEXT,
+                address TEXT,
+                currency_code TEXT,
+                total_without_tip REAL,
+                total_with_tip REAL,
+                tip_amount REAL,
+                value_added REAL,
+                topic TEXT,
+                names TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (document, page)
+            );
+            CREATE INDEX IF NOT EXISTS receipts_date ON receipts (date);
+            CREATE INDEX IF NOT EXISTS receipts_location ON receipts (location_name, date);
+            CREATE INDEX IF NOT EXISTS receipts_currency ON receipts (currency_code, date);
+            CREATE INDEX IF NOT EXISTS receipts_total ON receipts (total_with_tip);
+        """)
+
+    @staticmethod
+    def to_row(document: str, page: str, data: dict, source_path: str = None):
+        def _number(key):
+            try:
+                return float(data[key]) if data.get(key) is not None else None
+            except (TypeError, ValueError):
+                return None
+
+        taxes = data.get("taxes") or []
+        value_added = sum(float(tax.get("value_added") or 0)
+                          for tax in taxes if isinstance(tax, dict)) if taxes else None
+        return (document, page, source_path, normalize_date(data.get("date")), data.get("location_name"),
+                data.get("address"), data.get("currency_code"), _number("total_without_tip"),
+                _number("total_with_tip"), _number("tip_amount"), value_added, data.get("topic"),
+                json.dumps(data.get("names")) if data.get("names") is not None else None,
+                json.dumps(data, ensure_ascii=False, default=str))
+
+    def add_many(self, rows: list):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO receipts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+        return len(rows)
+
+    def add(self, document: str, page: str, data: dict, source_path: str = None):
+        return self.add_many([self.to_row(document, page, data, source_path)])
+
+    def remove(self, document: str, page: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM receipts WHERE document = ? AND page = ?", (document, page))
+            self.connection.commit()
+
+    @staticmethod
+    def read_artifact(path: str):
+        """The final data set of a page: the last entry of a .json file's data_sets or a .yml file."""
+        with open(path, "r") as artifact_file:
+            if path.endswith(".json"):
+                data_sets = json.load(artifact_file).get("data_sets") or []
+                return data_sets[-1] if data_sets else None
+            return yaml.safe_load(artifact_file)
+
+    def import_directory(self, directory: str, batch_size: int = 1000):
+        """
+        Bulk import all page_*.json files below directory, or page_*.yml where no JSON exists.
+        The document is the path of the containing directory relative to directory, or the name
+        of directory for its own pages, as Main and BatchRunner store them; importing what they
+        already stored replaces the same rows. Duplicates of earlier pages (with duplicate_of)
+        and unreadable pages are skipped.
+        """
+        pattern = re.compile(r"^(page_\d+)\.(json|yml|yaml)$")
+        rows = []
+        imported = 0
+        for current, _, file_names in os.walk(directory):
+            pages = {}
+            for file_name in sorted(file_names):
+                match = pattern.match(file_name)
+                if match and (match.group(1) not in pages or match.group(2) == "json"):
+                    pages[match.group(1)] = os.path.join(current, file_name)
+            document = os.path.relpath(current, directory).replace(os.sep, "/")
+            if document == ".":
+                document = os.path.basename(os.path.normpath(os.path.abspath(directory)))
+            for page, path in pages.items():
+                try:
+                    data = self.read_artifact(path)
+                    if isinstance(data, dict) and "duplicate_of" not in data:
+                        rows.append(self.to_row(document, page, data, path))
+                except (OSError, ValueError, TypeError, AttributeError, yaml.YAMLError) as e:
+                    self.logger.warning(f"Skipping {path}: {str(e)}")
+                    continue
+                if len(rows) >= batch_size:
+                    imported += self.add_many(rows)
+                    rows = []
+        imported += self.add_many(rows)
+        self.logger.info(f"Imported {imported} receipts from {directory}")
+        return imported
+
+    @staticmethod
+    def get_filters(filters: dict):
+        clauses = []
+        values = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in FILTER_COLUMNS:
+                raise ValueError(f"Unknown filter: {key}")
+            clauses.append(FILTER_COLUMNS[key])
+            values.append(f"%{value}%" if key == "location" else value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", values
+
+    def query(self, limit: int = None, **filters):
+        """Return the matching receipts ordered by date, e.g. query(date_from="2024-07-01", min_total=200)."""
+        where, values = self.get_filters(filters)
+        sql = ("SELECT document, page, date, location_name, currency_code, total_without_tip, "
+               f"total_with_tip, tip_amount, topic FROM receipts{where} ORDER BY date, document, page")
+        if limit is not None:
+            sql += " LIMIT ?"
+            values.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, values)]
+
+    def aggregate(self, group_by: str = None, **filters):
+        """Count and sum the matching receipts, optionally grouped by year, quarter, month, location, currency or document."""
+        where, values = self.get_filters(filters)
+        group = GROUPS[group_by] if group_by else "'all'"
+        sql = (f"SELECT {group} AS grp, COUNT(*) AS receipts, ROUND(SUM(total_without_tip), 2) AS total_without_tip, "
+               "ROUND(SUM(total_with_tip), 2) AS total_with_tip, ROUND(SUM(tip_amount), 2) AS tip_amount, "
+               "ROUND(SUM(value_added), 2) AS value_added, ROUND(AVG(total_with_tip), 2) AS average_total "
+               f"FROM receipts{where} GROUP BY grp ORDER BY grp")
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, values)]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the receipts results store.")
+    parser.add_argument("--store", default="results.sqlite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import JSON/YAML artifacts from a data directory.")
+    import_parser.add_argument("directory")
+    for name in ("query", "aggregate"):
+        command_parser = subparsers.add_parser(name)
+        command_parser.add_argument("--date-from")
+        command_parser.add_argument("--date-to")
+        command_parser.add_argument("--min-total", type=float)
+        command_parser.add_argument("--max-total", type=float)
+        command_parser.add_argument("--currency")
+        command_parser.add_argument("--location")
+        command_parser.add_argument("--document")
+        if name == "query":
+            command_parser.add_argument("--limit", type=int)
+        else:
+            command_parser.add_argument("--group-by", choices=sorted(GROUPS))
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "import":
+        print(store.import_directory(args.directory))
+    else:
+        filters = {key: getattr(args, key) for key in ("date_from", "date_to", "min_total", "max_total",
+                                                       "currency", "location", "document")}
+        if args.command == "query":
+            result = store.query(limit=args.limit, **filters)
+        else:
+            result = store.aggregate(group_by=args.group_by, **filters)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    store.close()
@@ -0,0 +1,420 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from batch import BatchRunner
+from atomic_files import replacing
+
+
+def get_signature(path: str):
+    """Size and modification time; a file that keeps its signature between two looks is complete."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def list_pdfs(directory: str):
+    return [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory))
+            if file_name.lower().endswith(".pdf") and os.path.isfile(os.path.join(directory, file_name))]
+
+
+class PollingWatcher:
+    """Lists the inbox every interval seconds and reports PDFs whose signature stopped changing."""
+
+    name = "polling"
+
+    def __init__(self, directory: str, interval: float = 2.0):
+        self.directory = directory
+        self.interval = interval
+
+    def watch(self, callback, stop_event: threading.Event):
+        previous = {}
+        while not stop_event.is_set():
+            current = {path: get_signature(path) for path in list_pdfs(self.directory)}
+            for path, signature in current.items():
+                if signature is not None and previous.get(path) == signature:
+                    callback(path)
+            previous = current
+            stop_event.wait(self.interval)
+
+
+class InotifyWatcher:
+    """
+    Waits for inotify events on the inbox, so new PDFs are picked up as soon as they are
+    closed after writing or moved in. PDFs already in the inbox are reported once at the start.
+    Needs the optional inotify_simple package (requirements-optional.txt) and Linux.
+    """
+
+    name = "inotify"
+
+    def __init__(self, directory: str, interval: float = 2.0):
+        from inotify_simple import INotify, flags
+
+        self.directory = directory
+        self.interval = interval
+        self.inotify = INotify()
+        self.inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def watch(self, callback, stop_event: threading.Event):
+        for path in list_pdfs(self.directory):
+            callback(path)
+        try:
+            while not stop_event.is_set():
+                for event in self.inotify.read(timeout=int(self.interval * 1000)):
+                    if event.name.lower().endswith(".pdf"):
+                        callback(os.path.join(self.directory, event.name))
+        finally:
+            self.inotify.close()
+
+
+WATCHERS = {"inotify": InotifyWatcher, "polling": PollingWatcher}
+
+
+def create_watcher(directory: str, watcher: str = "auto", interval: float = 2.0, logger=logger):
+    """The inotify watcher if inotify_simple and the platform support it, else polling."""
+    if watcher != "auto":
+        return WATCHERS[watcher](directory, interval)
+    try:
+        return InotifyWatcher(directory, interval)
+    except (ImportError, OSError) as e:
+        logger.info(f"Watching {directory} by polling every {interval} seconds ({str(e)})")
+        return PollingWatcher(directory, interval)
+
+
+class Job:
+    """One submitted PDF and its status: queued, running, done or failed."""
+
+    def __init__(self, path: str, source: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.source = source
+        self.status = "queued"
+        self.document = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.pages = 0
+        self.receipts = []
+        self.anomalies = {}
+        self.error = None
+
+    def to_dict(self):
+        return {"id": self.id, "path": self.path, "source": self.source, "status": self.status,
+                "document": self.document, "submitted": self.submitted, "started": self.started,
+                "finished": self.finished, "pages": self.pages, "receipts": self.receipts,
+                "anomalies": self.anomalies, "error": self.error}
+
+
+class ReceiptService:
+    """
+    Long-running mode: processes PDFs dropped into an inbox or uploaded to a local HTTP endpoint.
+    The OCR pool, the LLM client, the caches, the indexes and the user data are created once,
+    as in BatchRunner, and stay warm between jobs. Jobs go through a bounded queue; a full
+    queue rejects uploads and leaves dropped files for the next look at the inbox.
+    """
+
+    def __init__(self, inbox_directory: str, data_directory: str, logger=logger, host: str = "127.0.0.1",
+                 port: int = 8765, workers: int = 1, queue_size: int = 16, watcher: str = "auto",
+                 poll_interval: float = 2.0, max_upload_bytes: int = 64 * 1024 * 1024,
+                 max_finished_jobs: int = 1000, streaming: bool = False, **runner_options):
+        """
+        Args:
+            inbox_directory (str): Directory watched for new PDFs; uploads are stored here as well.
+                Only its top level is watched.
+            data_directory (str): Root for the per-document data directories, as for BatchRunner.
+            host (str): Address of the HTTP endpoint; keep it local, there is no authentication.
+            port (int): Port of the HTTP endpoint; 0 picks a free one, None disables the endpoint.
+            workers (int): Number of jobs processed at the same time.
+            queue_size (int): Upper limit of queued jobs.
+            watcher (str): "inotify", "polling" or "auto".
+            max_finished_jobs (int): Finished jobs kept for status requests.
+            runner_options: Further keyword arguments for BatchRunner and Main.
+        """
+        self.inbox_directory = inbox_directory
+        self.data_directory = data_directory
+        self.logger = logger
+        self.workers = max(1, workers)
+        self.max_upload_bytes = max_upload_bytes
+        self.max_finished_jobs = max_finished_jobs
+        self.streaming = streaming
+        for directory in (inbox_directory, data_directory):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        start_time = time.time()
+        # A daemon can't prompt; a missing user_data.txt fails the start instead.
+        self.runner = BatchRunner(inbox_directory, data_directory, logger=logger, interactive=False,
+                                  document_workers=self.workers, **runner_options)
+        self.runner.resources["user_data_handler"].run()
+        try:
+            self.runner.resources["ocr_handler"].warm_up()
+        except Exception as e:
+            self.logger.warning(f"Couldn't start the OCR engines ahead of the first job: {str(e)}")
+        self.metrics = self.runner.metrics
+        self.logger.info(f"Loaded the shared resources in {time.time() - start_time:.2f} seconds")
+
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.jobs = OrderedDict()
+        # Jobs by path while they are queued or running, and the signature each path was submitted with.
+        self.active = {}
+        self.submitted = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.watcher = create_watcher(inbox_directory, watcher, poll_interval, logger)
+        self.server = ThreadingHTTPServer((host, port), self._get_handler()) if port is not None else None
+        if self.server is not None:
+            self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        if self.server is None:
+            return None
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, path: str, source: str = "inbox"):
+        """
+        Queue a PDF unless it is queued or running already, or unchanged since it was submitted.
+
+        Returns:
+            Job: The new or the active job for the path, or None for an unchanged file.
+
+        Raises:
+            queue.Full: If the queue is full.
+        """
+        path = os.path.abspath(path)
+        signature = get_signature(path)
+        with self.lock:
+            if path in self.active:
+                return self.jobs[self.active[path]]
+            if source == "inbox" and self.submitted.get(path) == signature:
+                return None
+            job = Job(path, source)
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+            self.active[path] = job.id
+            self.submitted[path] = signature
+            self.prune_jobs()
+        self.metrics.increment("service_jobs_submitted_total", source=source)
+        self.logger.info(f"Queued job {job.id} for {path} ({source})")
+        return job
+
+    def prune_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def upload(self, content: bytes, file_name: str = None):
+        """Store an uploaded PDF in the inbox and queue it."""
+        stem = re.sub(r"[^\w.\-]+", "_", os.path.splitext(os.path.basename(file_name or ""))[0]) or "upload"
+        path = os.path.join(self.inbox_directory, f"{stem}.pdf")
+        if os.path.exists(path):
+            path = os.path.join(self.inbox_directory, f"{stem}_{uuid.uuid4().hex[:8]}.pdf")
+        with replacing(path) as temp_path:
+            with open(temp_path, "wb") as pdf_file:
+                pdf_file.write(content)
+        try:
+            return self.submit(path, source="upload")
+        except queue.Full:
+            os.remove(path)
+            raise
+
+    def on_file(self, path: str):
+        """Watcher callback; a full queue leaves the file for the next look at the inbox."""
+        try:
+            self.submit(path)
+        except queue.Full:
+            self.logger.warning(f"Job queue is full, {path} will be retried")
+
+    def process(self, job: Job):
+        job.status = "running"
+        job.started = time.time()
+        try:
+            # Main.run exits the process for a missing PDF.
+            if not os.path.isfile(job.path):
+                raise FileNotFoundError(f"{job.path} is gone")
+            main = self.runner.get_main(job.path)
+            job.document = main.document_id
+            results = main.run(streaming=self.streaming)
+            failed_pages = [f"page_{page_job.index}: {page_job.error}" for page_job in results
+                            if page_job.error is not None] if self.streaming else []
+            if failed_pages:
+                raise RuntimeError("; ".join(failed_pages))
+            job.receipts = main.create_receipt_pdfs(main.extracted_billing_paths)
+            job.pages = len(main.extracted_billing_paths)
+            job.anomalies = main.anomalies
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            self.logger.error(f"Job {job.id} for {job.path} failed: {str(e)}")
+        finally:
+            job.finished = time.time()
+            with self.lock:
+                self.active.pop(job.path, None)
+                # A file that changed while it was processed is picked up again.
+                if job.status == "failed" or get_signature(job.path) != self.submitted.get(job.path):
+                    self.submitted.pop(job.path, None)
+            self.metrics.increment("service_jobs_total", status=job.status)
+            self.metrics.observe("service_job_seconds", job.finished - job.submitted, status=job.status)
+            self.logger.info(
+                f"Job {job.id} {job.status} after {job.finished - job.submitted:.2f} seconds, "
+                f"{len(job.receipts)} receipt PDFs")
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self.process(job)
+
+    def _watch(self):
+        try:
+            self.watcher.watch(self.on_file, self.stop_event)
+        except Exception as e:
+            self.logger.error(f"Watching {self.inbox_directory} failed: {str(e)}")
+
+    def get_status(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {"status": "stopping" if self.stop_event.is_set() else "ok", "watcher": self.watcher.name,
+                "queued": statuses.count("queued"), "running": statuses.count("running"),
+                "done": statuses.count("done"), "failed": statuses.count("failed")}
+
+    def _get_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip("/")
+                if path == "/health":
+                    self._send(200, service.get_status())
+                elif path == "/jobs":
+                    with service.lock:
+                        jobs = [job.to_dict() for job in service.jobs.values()]
+                    self._send(200, jobs)
+                elif path.startswith("/jobs/"):
+                    with service.lock:
+                        job = service.jobs.get(path[len("/jobs/"):])
+                        status = job.to_dict() if job is not None else None
+                    if status is None:
+                        self._send(404, {"error": "Unknown job"})
+                    else:
+                        self._send(200, status)
+                else:
+                    self._send(404, {"error": "Not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path.rstrip("/") != "/jobs":
+                    self._send(404, {"error": "Not found"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self._send(400, {"error": "Invalid Content-Length"})
+                    return
+                if length > service.max_upload_bytes:
+                    self._send(413, {"error": f"Uploads are limited to {service.max_upload_bytes} bytes"})
+                    return
+                content = self.rfile.read(length)
+                if not content.startswith(b"%PDF"):
+                    self._send(400, {"error": "Expected a PDF as the request body"})
+                    return
+                try:
+                    job = service.upload(content, parse_qs(url.query).get("name", [None])[0])
+                except queue.Full:
+                    self._send(503, {"error": "Job queue is full"})
+                    return
+                self._send(202, job.to_dict())
+
+        return Handler
+
+    def start(self):
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        self.threads.append(threading.Thread(target=self._watch, daemon=True))
+        if self.server is not None:
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        self.logger.info(
+            f"Watching {self.inbox_directory} ({self.watcher.name})" +
+            (f", accepting uploads at {self.url}/jobs" if self.server is not None else ""))
+        return self
+
+    def stop(self):
+        """Stop accepting jobs, finish the queued ones and release the shared resources."""
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for _ in range(self.workers):
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.runner.resources["ocr_handler"].close()
+        self.metrics.export(os.path.join(self.data_directory, "service_metrics.json"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Turn PDFs dropped into an inbox or uploaded over HTTP into receipts.")
+    parser.add_argument("inbox_directory")
+    parser.add_argument("data_directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--watcher", default="auto", choices=["auto", "inotify", "polling"])
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--ocr-backend", default="auto", choices=["auto", "tesserocr", "pytesseract"])
+    parser.add_argument("--extraction-concurrency", type=int, default=4)
+    parser.add_argument("--assignment-seed", type=int, default=0)
+    parser.add_argument("--streaming", action="store_true")
+    args = parser.parse_args()
+
+    service = ReceiptService(args.inbox_directory, args.data_directory, host=args.host, port=args.port,
+                             workers=args.workers, queue_size=args.queue_size, watcher=args.watcher,
+                             poll_interval=args.poll_interval, streaming=args.streaming,
+                             ocr_workers=args.ocr_workers, ocr_backend=args.ocr_backend,
+                             extraction_concurrency=args.extraction_concurrency,
+                             assignment_seed=args.assignment_seed)
+    service.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def receipts(tmp_path, monkeypatch):
+    """
+    A native PDF of synthetic receipts and its data directory with user data and signature,
+    as the benchmark prepares them. Returns (pdf path, data directory, expected values).
+    """
+    from benchmark import Benchmark
+
+    # Main logs to output.log in the working directory.
+    monkeypatch.chdir(tmp_path)
+    return Benchmark(pages=4, scanned=False).prepare(str(tmp_path))
+
+
+@pytest.fixture
+def llm_server(monkeypatch):
+    from fake_llm_server import FakeLlmServer
+
+    monkeypatch.setenv("OPENAIKEY", "test")
+    with FakeLlmServer() as server:
+        yield server
+
+
+@pytest.fixture
+def make_main(receipts, llm_server):
+    """Factory for a Main on the receipts that talks to the fake LLM."""
+    pytest.importorskip("langchain")
+    from app import Main
+
+    pdf_file_path, data_directory_path, _ = receipts
+
+    def _make_main(**options):
+        options = {"ocr_workers": 1, "llm_base_url": llm_server.url, **options}
+        return Main(pdf_file_path=pdf_file_path, data_directory_path=data_directory_path, **options)
+
+    return _make_main
+
+
+@pytest.fixture
+def tesserocr():
+    """tesserocr with English language data, e.g. from TESSDATA_PREFIX."""
+    tesserocr = pytest.importorskip("tesserocr")
+    if "eng" not in tesserocr.get_languages()[1]:
+        pytest.skip("tesseract has no English language data")
+    return tesserocr
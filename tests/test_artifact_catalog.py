@@ -0,0 +1,102 @@
+import os
+import threading
+
+import pytest
+
+from artifact_catalog import ArtifactCatalog
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write("x")
+    return path
+
+
+def test_parse_accepts_page_artifacts_only():
+    assert ArtifactCatalog.parse("data/page_12.yml") == (12, "billing")
+    assert ArtifactCatalog.parse("page_3.png") == (3, "image")
+    assert ArtifactCatalog.parse("page_3.tmp") is None
+    assert ArtifactCatalog.parse("manifest.json") is None
+
+
+def test_groups_are_in_page_and_stage_order(tmp_path):
+    catalog = ArtifactCatalog(str(tmp_path))
+    directory = str(tmp_path / "2024" / "essen")
+    paths = [touch(os.path.join(directory, name))
+             for name in ("page_10.png", "page_10.yml", "page_2.png", "page_2.yml", "notes.txt")]
+    catalog.add(*paths, os.path.join(directory, "page_5.png"), None)
+
+    document = catalog.get_document(directory)
+    assert document == "2024/essen"
+    assert catalog.get_groups(document, ["billing", "image"]) == [
+        [paths[3], paths[2]], [paths[1], paths[0]]]
+    assert catalog.get(document, 5, "image") is None
+
+    catalog.remove(paths[0])
+    assert catalog.get(document, 10, "image") is None
+    assert catalog.get(document, 10, "billing") == paths[1]
+
+
+def test_catalog_survives_save_and_load(tmp_path):
+    catalog = ArtifactCatalog(str(tmp_path))
+    path = touch(str(tmp_path / "doc" / "page_0.txt"))
+    catalog.add(path)
+    catalog.save()
+    assert ArtifactCatalog(str(tmp_path)).get("doc", 0, "text") == path
+
+
+def test_scan_indexes_an_existing_directory(tmp_path):
+    directory = str(tmp_path / "doc")
+    touch(os.path.join(directory, "page_0.json"))
+    touch(os.path.join(directory, "page_1.json"))
+    catalog = ArtifactCatalog(str(tmp_path))
+    assert not catalog.has_document("doc")
+    assert catalog.scan(directory) == "doc"
+    assert len(catalog.get_groups("doc", ["json"])) == 2
+
+
+def test_concurrent_saves(tmp_path):
+    catalog = ArtifactCatalog(str(tmp_path))
+    errors = []
+
+    def _save_pages(document: str):
+        try:
+            for page in range(30):
+                catalog.add(touch(str(tmp_path / document / f"page_{page}.txt")))
+                catalog.save()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_save_pages, args=(f"doc_{i}",)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    loaded = ArtifactCatalog(str(tmp_path))
+    assert all(len(loaded.get_groups(f"doc_{i}")) == 30 for i in range(6))
+    assert not os.path.exists(catalog.path + ".tmp")
+
+
+def test_batch_with_concurrent_documents(tmp_path, llm_server, monkeypatch):
+    pytest.importorskip("langchain")
+    from batch import BatchRunner
+    from benchmark import SyntheticReceipts
+
+    monkeypatch.chdir(tmp_path)
+    input_directory = tmp_path / "input"
+    data_directory = tmp_path / "data"
+    input_directory.mkdir()
+    data_directory.mkdir()
+    for i in range(6):
+        SyntheticReceipts(seed=i).create_pdf(str(input_directory / f"receipts_{i}.pdf"), 3, scanned=False)
+    with open(data_directory / "user_data.txt", "w") as user_data_file:
+        user_data_file.write("Host\nAnna\nBernd\n######\nProjekt A")
+
+    runner = BatchRunner(str(input_directory), str(data_directory), document_workers=6, ocr_workers=1,
+                         llm_base_url=llm_server.url, page_chunk_size=1)
+    summary = runner.run()
+    assert summary["failed_documents"] == 0, summary["failures"]
+    catalog = ArtifactCatalog(str(data_directory))
+    assert all(len(catalog.get_groups(f"receipts_{i}", ["billing"])) == 3 for i in range(6))
@@ -0,0 +1,91 @@
+import os
+import json
+from collections import Counter
+
+import pytest
+import yaml
+
+import cli
+from assignment import AssignmentEngine
+from user_data_handler import UserDataHandler
+
+USER_DATA = "Host\nAnna\nBernd\nCarla\nDieter\nEmma\n######\nProjekt A\nProjekt B\nProjekt C"
+
+
+@pytest.fixture
+def user_data_handler(tmp_path):
+    with open(tmp_path / "user_data.txt", "w") as user_data_file:
+        user_data_file.write(USER_DATA)
+    user_data_handler = UserDataHandler(directory=str(tmp_path), interactive=False)
+    user_data_handler.run()
+    return user_data_handler
+
+
+def get_receipts(count: int):
+    return [(f"page_{i}", {"date": f"2024.Jan.{i + 1:02d}", "total_with_tip": 60.0}) for i in range(count)]
+
+
+def test_assignment_is_balanced_and_reproducible(user_data_handler):
+    assignments = AssignmentEngine(user_data_handler, seed=3).assign(get_receipts(10))
+    assert all(assignment["names"][0] == "Host" for assignment in assignments.values())
+    attendances = Counter(name for assignment in assignments.values() for name in assignment["names"][1:])
+    assert max(attendances.values()) - min(attendances.values()) <= 1
+    assert AssignmentEngine(user_data_handler, seed=3).assign(get_receipts(10)) == assignments
+    assert AssignmentEngine(user_data_handler, seed=4).assign(get_receipts(10)) != assignments
+
+
+def run_batch(tmp_path, llm_server, seed: int):
+    from batch import BatchRunner
+
+    runner = BatchRunner(str(tmp_path / "input"), str(tmp_path / "data"), ocr_workers=1,
+                         llm_base_url=llm_server.url, assignment_seed=seed)
+    summary = runner.run()
+    assert summary["failed_documents"] == 0, summary["failures"]
+    return runner
+
+
+def read_batch(tmp_path):
+    """Extracted values and billing data by document-qualified page id."""
+    values, billing = {}, {}
+    for document in ("receipts_0", "receipts_1", "receipts_2"):
+        for page in ("page_0", "page_1"):
+            path = os.path.join(str(tmp_path / "data"), document, page)
+            with open(path + ".json", "r") as json_file:
+                values[f"{document}/{page}"] = json.load(json_file)["data_sets"][3]
+            with open(path + ".yml", "r") as billing_file:
+                billing[f"{document}/{page}"] = yaml.safe_load(billing_file)
+    return values, billing
+
+
+def test_batch_assigns_across_all_documents(tmp_path, llm_server, monkeypatch):
+    pytest.importorskip("langchain")
+    from benchmark import SyntheticReceipts
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input").mkdir()
+    (tmp_path / "data").mkdir()
+    for i in range(3):
+        SyntheticReceipts(seed=i).create_pdf(str(tmp_path / "input" / f"receipts_{i}.pdf"), 2, scanned=False)
+    with open(tmp_path / "data" / "user_data.txt", "w") as user_data_file:
+        user_data_file.write(USER_DATA)
+
+    runner = run_batch(tmp_path, llm_server, seed=7)
+    values, billing = read_batch(tmp_path)
+    expected = AssignmentEngine(runner.resources["user_data_handler"], seed=7).assign(list(values.items()))
+    assert {page_id: {"names": data["names"], "topic": data["topic"]} for page_id, data in billing.items()} == \
+        expected
+    assert AssignmentEngine(runner.resources["user_data_handler"], seed=8).assign(list(values.items())) != \
+        expected
+
+    run_batch(tmp_path, llm_server, seed=8)
+    _, billing = read_batch(tmp_path)
+    assert {page_id: data["names"] for page_id, data in billing.items()} != \
+        {page_id: assignment["names"] for page_id, assignment in expected.items()}
+
+
+@pytest.mark.parametrize("command", ["extract", "batch", "serve"])
+def test_assignment_seed_option(command):
+    parser, _ = cli.get_parser()
+    positional = {"extract": ["data"], "batch": ["input", "data"], "serve": ["inbox", "data"]}[command]
+    assert parser.parse_args([command, *positional]).assignment_seed == 0
+    assert parser.parse_args([command, *positional, "--assignment-seed", "5"]).assignment_seed == 5
@@ -0,0 +1,76 @@
+import os
+import json
+
+import pytest
+
+from atomic_files import is_complete, remove_partial_files, replacing, write_text
+
+
+def test_failed_write_keeps_the_previous_file(tmp_path):
+    path = str(tmp_path / "page_0.json")
+    write_text(path, '{"data_sets": []}')
+    with pytest.raises(RuntimeError):
+        with replacing(path) as temp_path:
+            with open(temp_path, "w") as file:
+                file.write('{"data_sets": [')
+            raise RuntimeError("killed")
+    assert os.listdir(str(tmp_path)) == ["page_0.json"]
+    assert is_complete(path)
+
+
+def test_is_complete_detects_truncated_artifacts(tmp_path):
+    import fitz
+
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 20, 20), False)
+    png = pix.tobytes("png")
+    with fitz.open() as doc:
+        doc.new_page()
+        pdf = doc.tobytes()
+    for name, content in (("page_0.png", png), ("page_0.pdf", pdf), ("page_0.json", b'{"data_sets": []}')):
+        path = str(tmp_path / name)
+        with open(path, "wb") as file:
+            file.write(content)
+        assert is_complete(path)
+        with open(path, "wb") as file:
+            file.write(content[:len(content) // 2])
+        assert not is_complete(path)
+    assert not is_complete(str(tmp_path / "page_1.png"))
+
+
+def test_remove_partial_files(tmp_path):
+    for name in ("page_0.png", "page_1.png.tmp", "manifest.json.tmp"):
+        (tmp_path / name).write_text("x")
+    assert remove_partial_files(str(tmp_path)) == 2
+    assert os.listdir(str(tmp_path)) == ["page_0.png"]
+    assert remove_partial_files(str(tmp_path / "missing")) == 0
+
+
+def test_interrupted_chunked_run_resumes_after_the_last_chunk(make_main, llm_server, monkeypatch):
+    main = make_main(use_local_parser=False, page_chunk_size=2)
+    run_chunk = main.run_chunk
+
+    def _run_chunk(pages, overwrite=False):
+        if pages.start == 2:
+            # Killed while writing the first image of the second chunk.
+            open(os.path.join(main.data_directory_path, "page_2.png.tmp"), "w").close()
+            raise KeyboardInterrupt
+        return run_chunk(pages, overwrite)
+
+    monkeypatch.setattr(main, "run_chunk", _run_chunk)
+    with pytest.raises(KeyboardInterrupt):
+        main.run()
+    assert llm_server.request_count == 2
+    assert main.manifest.get("document", "document") is None
+
+    main = make_main(use_local_parser=False, page_chunk_size=2)
+    assert len(main.run()) == 4
+    # Only the pages of the unfinished chunk are extracted.
+    assert llm_server.request_count == 4
+    assert {"name": "pages_skipped_total", "labels": {"reason": "fresh", "stage": "extract"},
+            "value": 2} in main.metrics.to_dict()["counters"]
+    assert not os.path.exists(os.path.join(main.data_directory_path, "page_2.png.tmp"))
+    for i in range(4):
+        with open(os.path.join(main.data_directory_path, f"page_{i}.json"), "r") as json_file:
+            assert json.load(json_file)["data_sets"]
+    assert make_main(use_local_parser=False, page_chunk_size=2).run() == main.extracted_billing_paths
+    assert llm_server.request_count == 4
@@ -0,0 +1,64 @@
+import os
+import json
+
+import pytest
+
+from test_assignment import USER_DATA
+
+
+@pytest.fixture
+def batch_input(tmp_path, monkeypatch):
+    """Two documents with the same file name in different folders and a broken PDF."""
+    from benchmark import SyntheticReceipts
+
+    monkeypatch.chdir(tmp_path)
+    for i, folder in enumerate(("2024 Jan", "2024 Feb")):
+        (tmp_path / "input" / folder).mkdir(parents=True)
+        SyntheticReceipts(seed=i).create_pdf(str(tmp_path / "input" / folder / "receipts.pdf"), 2, scanned=False)
+    (tmp_path / "input" / "broken.pdf").write_bytes(b"%PDF-1.7 truncated")
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "user_data.txt").write_text(USER_DATA)
+    return tmp_path
+
+
+def get_runner(tmp_path, llm_server, input_directory="input"):
+    pytest.importorskip("langchain")
+    from batch import BatchRunner
+
+    return BatchRunner(str(tmp_path / input_directory), str(tmp_path / "data"), ocr_workers=1,
+                       llm_base_url=llm_server.url, use_local_parser=False)
+
+
+def test_documents_are_namespaced_by_their_path(batch_input, llm_server):
+    runner = get_runner(batch_input, llm_server)
+    assert runner.get_document_id(str(batch_input / "input" / "2024 Jan" / "receipts.pdf")) == \
+        "2024_Jan/receipts"
+    assert runner.get_document_id(str(batch_input / "input" / "a&b.PDF")) == "a_b"
+    assert [os.path.relpath(path, str(batch_input / "input")) for path in runner.find_pdfs()] == \
+        ["broken.pdf", os.path.join("2024 Feb", "receipts.pdf"), os.path.join("2024 Jan", "receipts.pdf")]
+
+
+def test_data_directory_inside_the_input_is_skipped(batch_input, llm_server):
+    (batch_input / "data" / "copy.pdf").write_bytes(b"%PDF-1.7")
+    runner = get_runner(batch_input, llm_server, input_directory="")
+    assert runner.find_pdfs()
+    assert not any(path.startswith(str(batch_input / "data")) for path in runner.find_pdfs())
+
+
+def test_batch_summary(batch_input, llm_server):
+    summary = get_runner(batch_input, llm_server).run()
+    data_directory = str(batch_input / "data")
+    for document in ("2024_Feb/receipts", "2024_Jan/receipts"):
+        for page in ("page_0", "page_1"):
+            assert os.path.exists(os.path.join(data_directory, *document.split("/"), f"{page}.json"))
+    assert (summary["documents"], summary["failed_documents"], summary["pages"]) == (3, 1, 4)
+    assert [failure["document"] for failure in summary["failures"]] == ["broken"]
+    assert {document["document"]: document["pages"] for document in summary["details"]} == \
+        {"2024_Feb/receipts": 2, "2024_Jan/receipts": 2, "broken": 0}
+    # Each page of the two documents is extracted once.
+    assert (summary["llm_cache_misses"], llm_server.request_count) == (4, 4)
+    with open(os.path.join(data_directory, "batch_summary.json"), "r") as summary_file:
+        assert json.load(summary_file) == summary
+    assert not [name for name in os.listdir(data_directory) if name.endswith(".tmp")]
+    with open(os.path.join(data_directory, "batch_metrics.json"), "r") as metrics_file:
+        assert {"name": "documents_failed_total", "labels": {}, "value": 1} in json.load(metrics_file)["counters"]
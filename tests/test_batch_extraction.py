@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from fake_llm_server import SAMPLE_BILLING_VALUES
+from metrics import Metrics
+from text_compactor import estimate_tokens
+
+
+def get_batch_chain(server, tmp_path, **options):
+    pytest.importorskip("langchain")
+    from chains import Chains
+    from response_cache import ResponseCache
+
+    chains = Chains(base_url=server.url, max_retries=0, metrics=Metrics(),
+                    cache=ResponseCache(str(tmp_path / "llm_cache.sqlite")))
+    return chains.BatchBillingDataJson(chains.BillingDataJson(chains), **options)
+
+
+def get_items(count: int):
+    return [(f"page_{i}", f"Gasthaus {i}\nSumme EUR {i + 10},50\nMwSt 19% 1,{i}0") for i in range(count)]
+
+
+def get_counter(chain, name: str, **labels):
+    return next((counter["value"] for counter in chain.chains.metrics.to_dict()["counters"]
+                 if counter["name"] == name and counter["labels"] == labels), 0)
+
+
+def test_batches_fit_the_token_budget(tmp_path, llm_server):
+    chain = get_batch_chain(llm_server, tmp_path, token_budget=2000, max_batch_size=3, output_tokens=250)
+    overhead = estimate_tokens(chain.prompt_template) + estimate_tokens(json.dumps(chain.schema))
+    items = get_items(7) + [("page_long", "x" * 20000)] + get_items(2)
+    batches = chain.get_batches(items)
+    # In order, within the budget and the batch size; an item over the budget goes alone.
+    assert [item for batch in batches for item in batch] == items
+    assert [page_id for page_id, _ in batches[-2][:1]] == ["page_long"] and len(batches[-2]) == 1
+    for batch in batches:
+        assert len(batch) <= 3
+        if len(batch) > 1:
+            assert overhead + sum(estimate_tokens(text) + 250 + 5 for _, text in batch) <= 2000
+    assert [len(batch) for batch in chain.get_batches(get_items(7))] == [3, 3, 1]
+    assert [len(batch) for batch in get_batch_chain(llm_server, tmp_path, token_budget=overhead + 300)
+            .get_batches(get_items(3))] == [1, 1, 1]
+    assert chain.get_batches([]) == []
+
+
+def test_missing_and_invalid_receipts_are_extracted_one_by_one(tmp_path, llm_server, monkeypatch):
+    get_arguments = llm_server.get_arguments
+
+    def _get_arguments(function, request=None):
+        arguments = get_arguments(function, request)
+        if "receipts" in arguments:
+            # page_1 is missing, page_2 fails validation and page_9 wasn't asked for.
+            receipts = [receipt for receipt in arguments["receipts"] if receipt["page_id"] != "page_1"]
+            receipts[1] = {**receipts[1], "total_with_tip": "unbekannt"}
+            arguments["receipts"] = receipts + [{**receipts[0], "page_id": "page_9"}]
+        return arguments
+
+    monkeypatch.setattr(llm_server, "get_arguments", _get_arguments)
+    chain = get_batch_chain(llm_server, tmp_path)
+    items = get_items(4)
+    results = chain.run_many(items)
+    assert results == {page_id: SAMPLE_BILLING_VALUES for page_id, _ in items}
+    # One batch request and one single request for each of page_1 and page_2.
+    assert llm_server.request_count == 3
+    assert get_counter(chain, "llm_batch_fallbacks_total") == 2
+    assert get_counter(chain, "llm_requests_total", mode="batch") == 1
+
+    # Every result is stored under the single-page cache key.
+    for _, text in items:
+        assert chain.single.run(text) == SAMPLE_BILLING_VALUES
+    assert chain.run_many(items) == results
+    assert llm_server.request_count == 3
+
+
+def test_failed_batch_falls_back_to_single_requests(tmp_path, monkeypatch):
+    from fake_llm_server import FakeLlmServer
+
+    monkeypatch.setenv("OPENAIKEY", "test")
+    with FakeLlmServer(error_count=1, error_status=400) as server:
+        chain = get_batch_chain(server, tmp_path)
+        assert chain.run_many(get_items(3)) == {f"page_{i}": SAMPLE_BILLING_VALUES for i in range(3)}
+        assert server.request_count == 4
+    assert get_counter(chain, "llm_batch_fallbacks_total") == 3
+
+
+def test_single_receipt_batches_use_the_single_request(tmp_path, llm_server):
+    chain = get_batch_chain(llm_server, tmp_path)
+    assert chain.run_many(get_items(1)) == {"page_0": SAMPLE_BILLING_VALUES}
+    assert get_counter(chain, "llm_requests_total", mode="batch") == 0
+    assert get_counter(chain, "llm_batch_fallbacks_total") == 0
+
+
+def test_prefetched_pages_count_their_compaction_once(make_main, llm_server):
+    main = make_main(use_local_parser=False, llm_batch_token_budget=3000)
+    main.run()
+    assert llm_server.request_count == 1
+    [histogram] = [histogram for histogram in main.metrics.to_dict()["histograms"]
+                   if histogram["name"] == "llm_prompt_text_tokens"]
+    assert histogram["count"] == 4
+    saved = 0
+    for text_path in main.processed_images_text_paths:
+        with open(text_path, "r") as text_file:
+            _, tokens_before, tokens_after = main.text_compactor.compact(text_file.read())
+        saved += tokens_before - tokens_after
+    assert {"name": "llm_tokens_saved_total", "labels": {}, "value": saved} in main.metrics.to_dict()["counters"]
@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import subprocess
+
+import fitz
+import yaml
+
+import cli
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BILLING_VALUES = {"date": "2024.Oct.12", "location_name": "Restaurant Lindenhof",
+                  "address": "Lindenallee 3, 80331 München", "currency_symbol": "€", "currency_code": "EUR",
+                  "taxes": [{"percentage": 19.0, "amount_taxed": 43.11, "value_added": 8.19}],
+                  "total_without_tip": 51.3, "total_with_tip": 56.43, "tip_amount": 5.13, "tip_percentage": 0.1,
+                  "topic": "Projectbesprechung Projekt A", "names": ["Host", "Carla"]}
+
+
+def run_cli(*argv: str):
+    """Run a command in a fresh interpreter; returns the module names it imported."""
+    script = f"import sys, json, cli\ncli.main({list(argv)!r})\nprint(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPOSITORY, capture_output=True,
+                            text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def write_receipt(directory):
+    with open(directory / "page_0.yml", "w") as billing_file:
+        yaml.safe_dump(BILLING_VALUES, billing_file, allow_unicode=True)
+    for name, size in (("page_0.png", (200, 300)), ("signature.png", (145, 357))):
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, *size), False)
+        pix.clear_with(255)
+        pix.save(str(directory / name))
+
+
+def test_render_without_receipts_imports_no_heavy_modules(tmp_path):
+    modules = run_cli("render", str(tmp_path))
+    for module in ("fitz", "pymupdf", "loguru", "yaml", "langchain", "numpy"):
+        assert module not in modules
+
+
+def test_render_writes_the_receipt_pdfs(tmp_path):
+    write_receipt(tmp_path)
+    combined = str(tmp_path / "receipts.pdf")
+    modules = run_cli("render", str(tmp_path), "--workers", "1", "--combined", combined)
+    assert "fitz" in modules and "loguru" not in modules
+    with fitz.open(str(tmp_path / "page_0.pdf")) as doc:
+        assert doc.page_count == 2
+        assert "Restaurant Lindenhof" in doc[0].get_text()
+    with fitz.open(combined) as doc:
+        assert doc.get_toc()[0][1] == "2024.Oct.12 Restaurant Lindenhof"
+
+
+def test_config_file_provides_defaults(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"workers": 3, "combined": "all.pdf"}))
+    parser, subparsers = cli.get_parser()
+    for subparser in subparsers.choices.values():
+        subparser.set_defaults(**cli.load_config(str(config_path)))
+    args = parser.parse_args(["render", str(tmp_path), "--workers", "2"])
+    assert (args.workers, args.combined) == (2, "all.pdf")
+
+
+def test_user_data_messages_stay_off_stdout_without_interactive(tmp_path, capsys):
+    from user_data_handler import UserDataHandler
+
+    (tmp_path / "user_data.txt").write_text("Host\nAnna\n######\nProjekt A")
+    UserDataHandler(directory=str(tmp_path), interactive=False).run()
+    assert capsys.readouterr().out == ""
+    handler = UserDataHandler(directory=str(tmp_path))
+    handler.run()
+    assert "Host\nAnna\nUsing the existing" in capsys.readouterr().out
+    assert handler.get_names() == ["Host", "Anna"]
+
+
+def test_batch_prints_only_the_json_summary(tmp_path, llm_server):
+    from benchmark import SyntheticReceipts
+
+    (tmp_path / "input").mkdir()
+    SyntheticReceipts(seed=0).create_pdf(str(tmp_path / "input" / "receipts.pdf"), 2, scanned=False)
+    (tmp_path / "user_data.txt").write_text("Host\nAnna\nBernd\n######\nProjekt A")
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, cli\nsys.exit(cli.main(sys.argv[1:]))", "--verbose", "batch",
+         str(tmp_path / "input"), str(tmp_path / "data"), "--user-data", str(tmp_path / "user_data.txt"),
+         "--workers", "1", "--llm-base-url", llm_server.url],
+        cwd=REPOSITORY, capture_output=True, text=True, check=True)
+    summary = json.loads(result.stdout)
+    assert (summary["documents"], summary["pages"], summary["failed_documents"]) == (1, 2, 0)
+    assert "Using the existing" in result.stderr
@@ -0,0 +1,110 @@
+import os
+import re
+import json
+
+from dedup import DuplicateIndex, hamming_distance, text_hash
+from results_store import ResultsStore
+
+RECEIPT = "\n".join([
+    "Gasthaus Zur Post", "Hauptstraße 12", "10115 Berlin", "12.03.2024 19:41", "",
+    "Schnitzel                  18,90", "Apfelschorle                3,90", "",
+    "Summe EUR                  22,80", "MwSt 19%  Netto 19,16  MwSt 3,64", "Vielen Dank für Ihren Besuch!",
+])
+
+
+def test_text_hash_tolerates_ocr_noise():
+    assert text_hash(RECEIPT) == text_hash(RECEIPT.replace("  ", " ").replace("Summe", "SUMME"))
+    noisy = hamming_distance(text_hash(RECEIPT), text_hash(RECEIPT.replace("Schnitzel", "Schnitze1")))
+    other = hamming_distance(text_hash(RECEIPT), text_hash(RECEIPT.replace("Gasthaus Zur Post", "Café Central")))
+    assert noisy < other
+    assert text_hash("Summe 12,50") is None
+
+
+def test_index_finds_the_closest_page_within_the_distance(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.sqlite"))
+    key = index.get_key(str(tmp_path / "receipts_0" / "page_3.txt"))
+    assert key == "receipts_0/page_3"
+    value = text_hash(RECEIPT)
+    index.add("text", key, value, source="hash")
+    assert index.find("text", value ^ 0b101, 6) == (key, 2)
+    assert index.find("text", value ^ 0b101, 1) is None
+    assert index.find("text", value, 6, exclude=key) is None
+    assert index.get_source("text", key) == "hash"
+    index.remove("text", key)
+    assert index.count("text") == 0
+    index.close()
+
+
+def test_results_store_leaves_out_duplicates(tmp_path):
+    for page, values in (("page_0", {"total_with_tip": 22.8}),
+                         ("page_1", {"total_with_tip": 22.8, "duplicate_of": "page_0"})):
+        (tmp_path / f"{page}.json").write_text(json.dumps({"data_sets": [values]}))
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    assert store.import_directory(str(tmp_path)) == 1
+    store.add("document", "page_2", {"total_with_tip": 10.0})
+    store.remove("document", "page_2")
+    assert store.aggregate()[0]["total_with_tip"] == 22.8
+    store.close()
+
+
+def append_copy_of_first_page(pdf_file_path: str):
+    import fitz
+
+    with fitz.open(pdf_file_path) as doc:
+        doc.fullcopy_page(0)
+        doc.saveIncr()
+
+
+def test_copy_is_reused_and_counted_once(make_main, receipts):
+    pdf_file_path, _, expected = receipts
+    append_copy_of_first_page(pdf_file_path)
+    main = make_main()
+    main.run()
+    assert main.duplicates == {"page_4": {"text": {"duplicate_of": "page_0", "distance": 0}}}
+    # Receipts of the same restaurant and layout are not taken for copies of each other.
+    assert [source for _, source in sorted(main.page_sources.items())] == ["text_layer"] * 5
+    aggregate = main.results_store.aggregate()[0]
+    assert aggregate["receipts"] == 4
+    assert aggregate["total_without_tip"] == round(sum(page["total_without_tip"] for page in expected), 2)
+
+
+def get_first_page_text(main, data_directory_path: str):
+    main.run()
+    with open(os.path.join(data_directory_path, "page_0.txt"), "r") as text_file:
+        return text_file.read()
+
+
+def test_similar_text_with_another_total_is_not_a_copy(make_main, receipts):
+    _, data_directory_path, _ = receipts
+    main = make_main()
+    text = get_first_page_text(main, data_directory_path)
+    total = main.total_parser.get_total(text.splitlines())
+    changed_total = f"{total + 1:.2f}".replace(".", ",")
+    other_text = text.replace(f"{total:.2f}".replace(".", ","), changed_total)
+    assert other_text != text
+
+    text_path = os.path.join(data_directory_path, "page_9.txt")
+    assert main.find_duplicate_values(text_path, text)[1] == ("page_0", 0)
+    assert hamming_distance(text_hash(text), text_hash(other_text)) <= main.text_duplicate_distance
+    assert main.find_duplicate_values(text_path, other_text) == (None, None)
+
+
+def test_same_text_with_another_date_or_address_is_not_a_copy(make_main, receipts):
+    # Monthly bills of the same restaurant differ in little more than the date.
+    _, data_directory_path, _ = receipts
+    main = make_main()
+    text = get_first_page_text(main, data_directory_path)
+    text_path = os.path.join(data_directory_path, "page_9.txt")
+    date = main.total_parser.get_date(text)
+    day, month, year = re.search(r"(\d{1,2})\.(\d{1,2})\.(\d{2,4})", text).groups()
+    other_date = text.replace(f"{day}.{month}.{year}", f"{int(day) % 28 + 1:02d}.{month}.{year}", 1)
+    assert main.total_parser.get_date(other_date) not in (None, date)
+    assert hamming_distance(text_hash(text), text_hash(other_date)) <= main.text_duplicate_distance
+    assert main.find_duplicate_values(text_path, other_date) == (None, None)
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    address = main.total_parser.get_location(lines)[1]
+    postal_code = re.search(r"\b\d{5}\b", text).group()
+    other_address = text.replace(postal_code, f"{(int(postal_code) + 1) % 100000:05d}")
+    assert main.total_parser.get_location(other_address.splitlines())[1] not in (None, address)
+    assert main.find_duplicate_values(text_path, other_address) == (None, None)
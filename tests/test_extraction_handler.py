@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+import extraction_handler
+from extraction_handler import ExtractionHandler, TokenBucket, get_retry_after
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """The backoff delays of the retries, without sleeping."""
+    delays = []
+    monkeypatch.setattr(extraction_handler.time, "sleep", delays.append)
+    return delays
+
+
+def get_extractor(server, **options):
+    pytest.importorskip("langchain")
+    from chains import Chains
+
+    handler = ExtractionHandler(backoff_base=0.01, **options)
+    chains = Chains(base_url=server.url, max_retries=0)
+    return chains.BillingDataJson(chains, guard=handler.guard)
+
+
+def fake_server(monkeypatch, **options):
+    from fake_llm_server import FakeLlmServer
+
+    monkeypatch.setenv("OPENAIKEY", "test")
+    return FakeLlmServer(**options)
+
+
+def test_rate_limited_calls_are_retried(monkeypatch, delays):
+    with fake_server(monkeypatch, error_count=2, error_status=429) as server:
+        values = get_extractor(server, max_retries=3).invoke("Summe 12,50")
+    assert values["total_without_tip"] == 100.0
+    assert server.request_count == 3
+    assert len(delays) == 2 and all(delay <= 0.02 for delay in delays)
+
+
+def test_gives_up_after_max_retries(monkeypatch, delays):
+    with fake_server(monkeypatch, error_rate=1.0, error_status=503) as server:
+        with pytest.raises(Exception) as error:
+            get_extractor(server, max_retries=2).invoke("Summe 12,50")
+    assert extraction_handler.get_status_code(error.value) == 503
+    assert server.request_count == 3
+    assert len(delays) == 2
+
+
+def test_client_errors_are_not_retried(monkeypatch, delays):
+    with fake_server(monkeypatch, error_count=1, error_status=400) as server:
+        with pytest.raises(Exception):
+            get_extractor(server, max_retries=3).invoke("Summe 12,50")
+    assert server.request_count == 1
+    assert delays == []
+
+
+def test_retry_after_is_a_lower_bound_for_the_backoff(monkeypatch, delays):
+    with fake_server(monkeypatch, error_count=2, retry_after=1.5) as server:
+        get_extractor(server, max_retries=3).invoke("Summe 12,50")
+    assert server.request_count == 3
+    assert delays == [1.5, 1.5]
+
+
+def test_retry_after_headers():
+    class Response:
+        def __init__(self, headers):
+            self.headers = headers
+
+    class Error(Exception):
+        def __init__(self, headers):
+            self.response = Response(headers)
+
+    assert get_retry_after(Error({"retry-after": "2"})) == 2.0
+    assert get_retry_after(Error({"retry-after-ms": "250", "retry-after": "1"})) == 0.25
+    assert get_retry_after(Error({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
+    assert get_retry_after(ValueError()) is None
+    assert ExtractionHandler(backoff_base=0.01).get_backoff(0, 3.0) == 3.0
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=20, capacity=5)
+    start_time = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # The burst is free; every further call waits for its token.
+    assert time.monotonic() - start_time < 0.05
+    for _ in range(10):
+        bucket.acquire()
+    assert 0.45 <= time.monotonic() - start_time < 1.0
+
+
+def test_map_keeps_the_input_order():
+    handler = ExtractionHandler(concurrency=4)
+    assert handler.map(lambda i: time.sleep(0.01 * (5 - i)) or i, list(range(5))) == list(range(5))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from image_preprocessor import ImagePreprocessor
+
+
+def threshold_by_loops(gray, block_size: int, offset: float):
+    radius = max(1, block_size // 2)
+    height, width = gray.shape
+    binary = np.full(gray.shape, 255, dtype=np.uint8)
+    for y in range(height):
+        for x in range(width):
+            block = gray[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1]
+            if gray[y, x] < block.mean() - offset:
+                binary[y, x] = 0
+    return binary
+
+
+@pytest.mark.parametrize("shape", [(5, 7), (40, 33), (1, 50), (31, 1)])
+@pytest.mark.parametrize("block_size", [3, 15, 51])
+def test_adaptive_threshold_matches_the_neighbourhood_mean(shape, block_size):
+    gray = np.random.default_rng(block_size).integers(0, 256, shape, dtype=np.uint8)
+    np.testing.assert_array_equal(ImagePreprocessor.adaptive_threshold(gray, block_size, 10),
+                                  threshold_by_loops(gray, block_size, 10))
+
+
+def test_adaptive_threshold_on_a_full_page():
+    # A white 300 DPI page overflows a uint32 integral image; the neighbourhood sums must not.
+    gray = np.full((3508, 2480), 255, dtype=np.uint8)
+    gray[1000:1010, 500:1500] = 20
+    binary = ImagePreprocessor.adaptive_threshold(gray)
+    assert binary.dtype == np.uint8
+    assert (binary[1000:1010, 500:1500] == 0).all()
+    assert (binary == 0).sum() == 10 * 1000
+
+
+def test_crop_to_content_keeps_a_margin():
+    binary = np.full((100, 80), 255, dtype=np.uint8)
+    binary[40:50, 20:60] = 0
+    assert ImagePreprocessor.crop_to_content(binary, margin=5).shape == (20, 50)
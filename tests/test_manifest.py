@@ -0,0 +1,117 @@
+import os
+import json
+
+import pytest
+
+from manifest import Manifest
+
+
+def write(path, content: str):
+    with open(path, "w") as file:
+        file.write(content)
+    return str(path)
+
+
+def test_hash_values_depends_on_order_and_types():
+    assert Manifest.hash_values("a", 1) == Manifest.hash_values("a", 1)
+    assert Manifest.hash_values("a", 1) != Manifest.hash_values(1, "a")
+    assert Manifest.hash_values({"b": 1, "a": 2}) == Manifest.hash_values({"a": 2, "b": 1})
+    assert Manifest.hash_values("ab", "c") != Manifest.hash_values("a", "bc")
+
+
+def test_hash_file_follows_content_changes(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    path = write(tmp_path / "page_0.txt", "Summe 12,50")
+    first = manifest.hash_file(path)
+    assert manifest.hash_file(path) == first
+    write(path, "Summe 12,60")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert manifest.hash_file(path) != first
+    assert manifest.hash_file(str(tmp_path / "missing.txt")) is None
+
+
+def test_entry_is_stale_when_inputs_change_or_outputs_are_gone(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    output = write(tmp_path / "page_0.json", "{}")
+    manifest.record("extract", "page_0", {"text": "a"}, [output])
+    assert manifest.is_fresh("extract", "page_0", {"text": "a"})
+    assert not manifest.is_fresh("extract", "page_0", {"text": "b"})
+    assert not manifest.is_fresh("extract", "page_1", {"text": "a"})
+    os.remove(output)
+    assert not manifest.is_fresh("extract", "page_0", {"text": "a"})
+
+
+def test_entries_survive_save_and_load(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record("yaml", "page_3", "hash", [], source="ocr")
+    manifest.save()
+    assert not os.path.exists(str(tmp_path / "manifest.json.tmp"))
+
+    loaded = Manifest(str(tmp_path))
+    assert loaded.get("yaml", "page_3") == {"inputs": "hash", "outputs": [], "source": "ocr"}
+
+
+def test_unreadable_manifest_starts_empty(tmp_path):
+    write(tmp_path / "manifest.json", '{"stages": {"yaml": ')
+    assert Manifest(str(tmp_path)).entries == {}
+
+
+def test_adopt_skips_truncated_outputs(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    complete = write(tmp_path / "page_0.json", json.dumps({"data_sets": []}))
+    truncated = write(tmp_path / "page_1.json", '{"data_sets": [')
+    assert manifest.adopt("extract", "page_0", "hash", [complete])
+    assert not manifest.adopt("extract", "page_1", "hash", [truncated])
+    assert manifest.get("extract", "page_1") is None
+    # Recorded entries are never replaced by adopt.
+    assert not manifest.adopt("extract", "page_0", "other", [complete])
+    assert manifest.get("extract", "page_0")["inputs"] == "hash"
+
+
+def test_user_data_change_only_reruns_the_user_data_steps(make_main, llm_server):
+    main = make_main(use_local_parser=False, validate=False)
+    main.run()
+    requests = llm_server.request_count
+    json_path = main.extracted_json_paths[0]
+    with open(json_path, "r") as json_file:
+        values = json.load(json_file)["data_sets"][0]
+
+    with open(os.path.join(main.data_directory_path, "user_data.txt"), "a") as user_data_file:
+        user_data_file.write("\nProjekt C")
+    main = make_main(use_local_parser=False, validate=False)
+    assert len(main.run()) == 4
+    assert llm_server.request_count == requests
+    with open(json_path, "r") as json_file:
+        assert json.load(json_file)["data_sets"][0] == values
+    assert {"name": "pages_skipped_total", "labels": {"reason": "user_data_only", "stage": "extract"},
+            "value": 4} in main.metrics.to_dict()["counters"]
+
+
+def test_text_entries_are_recorded_after_their_outputs(make_main, receipts, monkeypatch):
+    from benchmark import SyntheticReceipts
+
+    pdf_file_path, data_directory_path, _ = receipts
+    make_main().run()
+    text_path = os.path.join(data_directory_path, "page_0.txt")
+    with open(text_path, "r") as text_file:
+        old_text = text_file.read()
+
+    SyntheticReceipts(seed=5).create_pdf(pdf_file_path, 4, scanned=False)
+    main = make_main()
+
+    def run_chunk(pages, overwrite=False):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(main, "run_chunk", run_chunk)
+    with pytest.raises(KeyboardInterrupt):
+        main.run(overwrite=True)
+    # The old texts are not taken for outputs of the new PDF.
+    assert not make_main().manifest.is_fresh(
+        "text", "page_0", main.get_text_inputs(main.manifest.hash_file(pdf_file_path), 0))
+
+    main = make_main()
+    main.run()
+    with open(text_path, "r") as text_file:
+        assert text_file.read() != old_text
+    assert main.manifest.is_fresh(
+        "text", "page_0", main.get_text_inputs(main.manifest.hash_file(pdf_file_path), 0))
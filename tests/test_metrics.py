@@ -0,0 +1,61 @@
+import os
+import json
+
+import pytest
+
+from metrics import Metrics
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics()
+    metrics.increment("pages_total", 3)
+    metrics.increment("extractions_total", method="llm")
+    metrics.increment("extractions_total", 2, method="local")
+    metrics.observe("llm_prompt_text_tokens", 80, buckets=(50, 100))
+    metrics.observe("llm_prompt_text_tokens", 120, buckets=(10,))
+    with pytest.raises(ValueError):
+        with metrics.span("ocr", page="page_0"):
+            raise ValueError("no text")
+    return metrics
+
+
+def test_json_export(metrics, tmp_path):
+    path = metrics.export(str(tmp_path / "metrics.json"))
+    with open(path, "r") as metrics_file:
+        data = json.load(metrics_file)
+    assert os.listdir(str(tmp_path)) == ["metrics.json"]
+    assert data["counters"] == [
+        {"name": "extractions_total", "labels": {"method": "llm"}, "value": 1},
+        {"name": "extractions_total", "labels": {"method": "local"}, "value": 2},
+        {"name": "pages_total", "labels": {}, "value": 3},
+        {"name": "stage_errors_total", "labels": {"stage": "ocr"}, "value": 1},
+    ]
+    # The buckets are those of the first observation.
+    assert data["histograms"][0] == {"name": "llm_prompt_text_tokens", "labels": {}, "count": 2,
+                                     "sum": 200.0, "buckets": {"50": 0, "100": 1}}
+    [span] = data["spans"]
+    assert (span["stage"], span["page"], span["error"]) == ("ocr", "page_0", "no text")
+
+
+def test_prometheus_export(metrics, tmp_path):
+    path = metrics.export(str(tmp_path / "receipts.prom"))
+    with open(path, "r") as metrics_file:
+        lines = metrics_file.read().splitlines()
+    assert "# TYPE receipts_extractions_total counter" in lines
+    assert 'receipts_extractions_total{method="local"} 2.0' in lines
+    assert "receipts_pages_total 3.0" in lines
+    assert "# TYPE receipts_llm_prompt_text_tokens histogram" in lines
+    assert 'receipts_llm_prompt_text_tokens_bucket{le="100"} 1' in lines
+    assert 'receipts_llm_prompt_text_tokens_bucket{le="+Inf"} 2' in lines
+    assert "receipts_llm_prompt_text_tokens_sum 200.0" in lines
+    assert 'receipts_stage_duration_seconds_count{stage="ocr"} 1' in lines
+
+
+def test_prometheus_label_values_are_escaped():
+    metrics = Metrics(prefix="test")
+    metrics.increment("errors_total", error='bad "page"\\n\nsecond line', page=None)
+    assert metrics.to_prometheus() == (
+        "# TYPE test_errors_total counter\n"
+        'test_errors_total{error="bad \\"page\\"\\\\n\\nsecond line"} 1.0\n'
+    )
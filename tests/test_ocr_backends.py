@@ -0,0 +1,58 @@
+import pytest
+
+import ocr_backends
+
+
+def render_text_image(text: str):
+    import fitz
+    from PIL import Image
+
+    with fitz.open() as doc:
+        page = doc.new_page(width=300, height=80)
+        page.insert_text(fitz.Point(20, 45), text, fontname="cour", fontsize=14)
+        pix = page.get_pixmap(dpi=200, colorspace=fitz.csGRAY)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def test_tesserocr_backend_reads_an_image(tesserocr):
+    backend = ocr_backends.TesserocrBackend(oem=tesserocr.OEM.LSTM_ONLY)
+    try:
+        text = backend.image_to_text(render_text_image("TOTAL 12.50"), psm=tesserocr.PSM.SINGLE_LINE)
+        assert "TOTAL 12.50" in text
+        # Without psm the engine's default mode is restored.
+        assert "TOTAL" in backend.image_to_text(render_text_image("TOTAL 12.50"))
+    finally:
+        backend.close()
+
+
+def test_auto_prefers_tesserocr(tesserocr):
+    engine = ocr_backends.create_engine("auto")
+    try:
+        assert engine.name == "tesserocr"
+    finally:
+        engine.close()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown OCR backend"):
+        ocr_backends.create_engine("easyocr")
+
+
+@pytest.mark.parametrize("error, level", [
+    (ImportError("No module named 'tesserocr'"), "DEBUG"),
+    (RuntimeError("Failed to init API, possibly an invalid tessdata path: /missing/"), "WARNING"),
+], ids=["not installed", "init failure"])
+def test_auto_falls_back_to_pytesseract(monkeypatch, caplog, error, level):
+    pytest.importorskip("pytesseract")
+
+    def fail(self, language=None, oem=None):
+        raise error
+
+    monkeypatch.setattr(ocr_backends.TesserocrBackend, "__init__", fail)
+    with caplog.at_level("DEBUG"):
+        engine = ocr_backends.create_engine("auto", language="deu")
+    assert engine.name == "pytesseract" and engine.language == "deu"
+    assert [record.levelname for record in caplog.records if "using pytesseract" in record.getMessage()] == [level]
+    # An explicit backend doesn't fall back.
+    with pytest.raises(type(error)):
+        ocr_backends.create_engine("tesserocr")
@@ -0,0 +1,86 @@
+import os
+
+from ocr_handler import OcrHandler
+
+
+def write_page_images(directory, texts: list):
+    import fitz
+
+    image_paths = []
+    for i, text in enumerate(texts):
+        with fitz.open() as doc:
+            page = doc.new_page(width=300, height=80)
+            page.insert_text(fitz.Point(20, 45), text, fontname="cour", fontsize=14)
+            image_paths.append(str(directory / f"page_{i}.png"))
+            page.get_pixmap(dpi=200, colorspace=fitz.csGRAY).save(image_paths[-1])
+    return image_paths
+
+
+def test_pool_returns_texts_in_page_order_and_keeps_existing_ones(tmp_path, tesserocr):
+    image_paths = write_page_images(tmp_path, [f"TOTAL {i}2.50" for i in range(6)])
+    (tmp_path / "page_2.txt").write_text("kept")
+    ocr_handler = OcrHandler(workers=2, backend="tesserocr")
+    try:
+        text_paths = ocr_handler.extract_texts(image_paths)
+    finally:
+        ocr_handler.close()
+
+    assert text_paths == [str(tmp_path / f"page_{i}.txt") for i in range(6)]
+    texts = [open(path).read().strip() for path in text_paths]
+    assert texts[2] == "kept"
+    assert [text for i, text in enumerate(texts) if i != 2] == [f"TOTAL {i}2.50" for i in (0, 1, 3, 4, 5)]
+    # Only the pages without a text file went through OCR.
+    assert sorted(ocr_handler.page_durations) == [path for i, path in enumerate(image_paths) if i != 2]
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+
+
+def write_pdf(path, texts: list):
+    import fitz
+
+    with fitz.open() as doc:
+        for text in texts:
+            doc.new_page(width=300, height=80).insert_text(fitz.Point(20, 45), text, fontname="cour", fontsize=14)
+        doc.save(str(path))
+    return str(path)
+
+
+def test_saved_pages_are_rendered_once(tmp_path, tesserocr, monkeypatch):
+    import fitz
+
+    pdf_path = write_pdf(tmp_path / "receipts.pdf", ["TOTAL 12.50", "TOTAL 22.50"])
+    renders = []
+    get_pixmap = fitz.Page.get_pixmap
+    monkeypatch.setattr(fitz.Page, "get_pixmap", lambda page, *args, **kwargs: renders.append(page.number) or
+                        get_pixmap(page, *args, **kwargs))
+    ocr_handler = OcrHandler(workers=1, backend="tesserocr")
+    try:
+        image_paths, text_paths = ocr_handler.extract_texts_from_pdf(pdf_path, str(tmp_path))
+    finally:
+        ocr_handler.close()
+    assert renders == [0, 1]
+    assert [open(path).read().strip() for path in text_paths] == ["TOTAL 12.50", "TOTAL 22.50"]
+    with fitz.open(image_paths[0]) as image:
+        assert image[0].get_pixmap().n == 3
+
+
+def test_threads_keep_their_own_document_open(tmp_path):
+    import threading
+    import ocr_handler
+
+    paths = [write_pdf(tmp_path / f"receipts_{i}.pdf", ["TOTAL"]) for i in range(2)]
+    documents = {}
+
+    def _open(i):
+        documents[i] = ocr_handler._get_document(paths[i])
+
+    try:
+        for i in range(2):
+            thread = threading.Thread(target=_open, args=(i,))
+            thread.start()
+            thread.join()
+        # The second thread opened another document without closing the first thread's.
+        assert not documents[0].is_closed
+        assert ocr_handler._get_document(paths[0]) is not documents[0]
+    finally:
+        ocr_handler._close_documents()
+    assert documents[0].is_closed and documents[1].is_closed
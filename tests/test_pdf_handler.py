@@ -0,0 +1,127 @@
+import os
+
+import fitz
+import pytest
+
+from pdf_handler import PdfHandler
+
+
+def write_pdf(path, pages: list):
+    """One page per entry: text for a text layer, None for a scanned page without one."""
+    with fitz.open() as doc:
+        for text in pages:
+            page = doc.new_page(width=300, height=420)
+            if text is None:
+                pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 100, 140), False)
+                pix.clear_with(200)
+                page.insert_image(page.rect, pixmap=pix)
+            else:
+                page.insert_text(fitz.Point(20, 30), text, fontname="cour", fontsize=9)
+        doc.save(str(path))
+    return str(path)
+
+
+def test_text_layer_threshold(tmp_path):
+    pdf_path = write_pdf(tmp_path / "receipts.pdf", [
+        "Gasthaus Zur Post\nSumme EUR 22,80\nMwSt 19% 3,64", None,
+        # 24 and 25 letters and digits; punctuation and spaces don't count.
+        "Summe: 1234 5678 9012 3456 789, --", "Summe: 1234 5678 9012 3456 7890, --",
+    ])
+    sources = PdfHandler().extract_text_layers(pdf_path, str(tmp_path))
+    assert sources == {0: "text_layer", 1: "ocr", 2: "ocr", 3: "text_layer"}
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".txt")) == \
+        ["page_0.txt", "page_3.txt"]
+    with open(tmp_path / "page_0.txt") as text_file:
+        assert "Summe EUR 22,80" in text_file.read()
+
+    assert PdfHandler().extract_text_layers(pdf_path, str(tmp_path), min_chars=100) == \
+        {0: "ocr", 1: "ocr", 2: "ocr", 3: "ocr"}
+
+
+def test_existing_text_files_are_kept_unless_overwritten(tmp_path):
+    pdf_path = write_pdf(tmp_path / "receipts.pdf", ["Gasthaus Zur Post\nSumme EUR 22,80"])
+    (tmp_path / "page_0.txt").write_text("corrected")
+    PdfHandler().extract_text_layers(pdf_path, str(tmp_path))
+    assert (tmp_path / "page_0.txt").read_text() == "corrected"
+    PdfHandler().extract_text_layers(pdf_path, str(tmp_path), overwrite=True)
+    assert "Gasthaus Zur Post" in (tmp_path / "page_0.txt").read_text()
+
+
+def write_png(path, gray: int = 120, size: tuple = (60, 80)):
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, *size), False)
+    pix.clear_with(gray)
+    pix.save(str(path))
+    return str(path)
+
+
+BILLING_DATA = {"date": "2024.Mar.12", "location_name": "Gasthaus Zur Post",
+                "address": "Hauptstraße 12, 10115 Berlin, Deutschland", "names": ["Host", "Anna"],
+                "topic": "Projekt A", "total_without_tip": 22.8, "tip_amount": 2.2,
+                "total_with_tip": 25.0, "currency_code": "EUR"}
+
+
+def write_groups(tmp_path, count: int):
+    import yaml
+
+    groups = []
+    for i in range(count):
+        billing_path = tmp_path / f"page_{i}.yml"
+        billing_path.write_text(yaml.dump({**BILLING_DATA, "date": f"2024.Mar.{i + 1:02d}"}, allow_unicode=True))
+        groups.append(([str(billing_path), write_png(tmp_path / f"page_{i}.png", 100 + i)],
+                       str(tmp_path / f"receipt_{i}.pdf")))
+    # A group without billing data is named after its first file.
+    groups.append(([write_png(tmp_path / "scan.png")], str(tmp_path / "scan.pdf")))
+    return groups
+
+
+def test_groups_are_combined_with_a_bookmark_per_receipt(tmp_path):
+    groups = write_groups(tmp_path, 3)
+    combined_path = str(tmp_path / "combined.pdf")
+    results = PdfHandler().create_pdfs_from_groups(
+        groups, write_png(tmp_path / "signature.png", 0, (40, 40)), combined_target=combined_path)
+    assert results == [(str(tmp_path / f"receipt_{i}.pdf"), f"2024.Mar.{i + 1:02d} Gasthaus Zur Post")
+                       for i in range(3)] + [(str(tmp_path / "scan.pdf"), "scan.png")]
+    for target, _ in results[:3]:
+        with fitz.open(target) as doc:
+            assert doc.page_count == 2
+            assert "Gasthaus Zur Post" in doc[0].get_text()
+    with fitz.open(combined_path) as doc:
+        assert doc.page_count == 7
+        assert doc.get_toc() == [[1, "2024.Mar.01 Gasthaus Zur Post", 1], [1, "2024.Mar.02 Gasthaus Zur Post", 3],
+                                 [1, "2024.Mar.03 Gasthaus Zur Post", 5], [1, "scan.png", 7]]
+        # The signature streams of the receipts are merged into one when the combined PDF is saved.
+        signature_xrefs = {image[0] for page in doc for image in page.get_images(full=True)
+                           if image[2:4] == (40, 40)}
+        assert len(signature_xrefs) == 1
+
+
+def test_groups_are_built_in_worker_processes(tmp_path):
+    groups = write_groups(tmp_path, 4)
+    signature_path = write_png(tmp_path / "signature.png", 0)
+    results = PdfHandler().create_pdfs_from_groups(groups, signature_path, workers=2, min_parallel_groups=2)
+    assert [target for target, _ in results] == [target for _, target in groups]
+    for target, _ in results:
+        with fitz.open(target) as doc:
+            assert doc.page_count in (1, 2)
+
+
+@pytest.mark.parametrize("data", [
+    BILLING_DATA,
+    # Incomplete blocks keep the lines up to the missing field.
+    {key: value for key, value in BILLING_DATA.items() if key not in ("address", "topic", "tip_amount")},
+    {"date": "2024.Mar.12", "location_name": "Gasthaus Zur Post"},
+], ids=["full", "partial", "minimal"])
+def test_template_page_renders_like_the_hand_built_page(tmp_path, data):
+    import yaml
+
+    billing_path = tmp_path / "page_0.yml"
+    billing_path.write_text(yaml.dump(data, allow_unicode=True))
+    with open(write_png(tmp_path / "signature.png", 0, (40, 40)), "rb") as signature_file:
+        signature_stream = signature_file.read()
+    pages = []
+    for use_template in (True, False):
+        doc, title = PdfHandler(use_template=use_template).build_pdf([str(billing_path)], signature_stream)
+        pages.append((doc[0].get_pixmap(dpi=72).samples, doc[0].get_text(), title))
+        doc.close()
+    assert pages[0] == pages[1]
+    assert pages[0][1].startswith("Bewirtungsbeleg\n(nach § 4 Abs. 5 Nr. 2 EStG)\nDatum: 2024.Mar.12\n")
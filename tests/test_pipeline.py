@@ -0,0 +1,81 @@
+import pytest
+
+from pipeline import Pipeline, Stage, PageJob
+
+
+def get_jobs(count: int, fail_at: int = None):
+    for i in range(count):
+        if i == fail_at:
+            raise RuntimeError(f"render failed at page {i}")
+        yield PageJob(i, "receipts.pdf", "data")
+
+
+def test_items_pass_all_stages():
+    def _double(job):
+        job.value = job.index * 2
+        return job
+
+    def _increment(job):
+        job.value += 1
+        return job
+
+    pipeline = Pipeline([Stage("double", _double, workers=3), Stage("increment", _increment)], queue_size=2)
+    jobs = sorted(pipeline.run(get_jobs(20)), key=lambda job: job.index)
+    assert [job.value for job in jobs] == [i * 2 + 1 for i in range(20)]
+    assert all(set(job.durations) == {"double", "increment"} for job in jobs)
+
+
+def test_stage_failure_marks_the_item_and_skips_later_stages():
+    def _fail_odd(job):
+        if job.index % 2:
+            raise ValueError("unreadable")
+        return job
+
+    later = []
+    pipeline = Pipeline([Stage("ocr", _fail_odd), Stage("extract", lambda job: later.append(job.index) or job)])
+    jobs = sorted(pipeline.run(get_jobs(6)), key=lambda job: job.index)
+    assert [job.error for job in jobs] == [None, "ocr: unreadable"] * 3
+    assert sorted(later) == [0, 2, 4]
+
+
+def test_source_failure_is_raised_after_the_finished_items():
+    finished = []
+    pipeline = Pipeline([Stage("ocr", lambda job: job)])
+    with pytest.raises(RuntimeError, match="page 5"):
+        for job in pipeline.run(get_jobs(12, fail_at=5)):
+            finished.append(job.index)
+    assert finished == [0, 1, 2, 3, 4]
+
+
+def test_streaming_run_with_a_render_failure_is_not_recorded_as_done(make_main, monkeypatch):
+    main = make_main()
+    render_page_job = main.render_page_job
+
+    def _render_page_job(doc, i, overwrite=False):
+        if i == 2:
+            raise RuntimeError("render failed")
+        return render_page_job(doc, i, overwrite)
+
+    monkeypatch.setattr(main, "render_page_job", _render_page_job)
+    with pytest.raises(RuntimeError, match="render failed"):
+        main.run(streaming=True)
+    assert main.manifest.get("document", "document") is None
+
+    # The re-run finishes the missing pages instead of reporting that there is nothing to do.
+    results = make_main().run(streaming=True)
+    assert sorted(job.index for job in results) == [0, 1, 2, 3]
+    assert all(job.error is None for job in results)
+
+
+def test_streaming_in_memory_ocr_without_pool_holds_the_fitz_lock(make_main, monkeypatch):
+    main = make_main(in_memory=True, use_text_layer=False)
+    locked = []
+
+    def _ocr_page(image_path=None, pdf_path=None, page_index=None):
+        locked.append(main.pdf_handler.lock.locked())
+        return "Summe EUR 12,50", 0.0
+
+    monkeypatch.setattr(main.ocr_handler, "ocr_page", _ocr_page)
+    results = main.run(streaming=True)
+    assert all(job.error is None for job in results)
+    assert locked == [True] * 4
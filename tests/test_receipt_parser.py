@@ -0,0 +1,118 @@
+import pytest
+
+from fake_llm_server import SAMPLE_BILLING_VALUES
+from receipt_parser import ReceiptParser
+
+RESTAURANT = """Gasthaus Zur Post
+Inh. M. Huber
+Hauptstraße 12
+10115 Berlin
+Tel. 030 1234567
+Tisch 7   Bed. Anna
+12.03.2024 19:41
+2 x Schnitzel Wiener Art    37,80
+1 x Apfelschorle 0,4l        3,90
+1 x Weißbier 0,5l            4,60
+Summe EUR                   46,30
+Trinkgeld                    4,70
+Gesamt mit Trinkgeld        51,00
+MwSt 19%  Netto 38,91  MwSt 7,39
+Vielen Dank für Ihren Besuch!"""
+
+SUPERMARKET = """REWE Markt GmbH
+Bahnhofplatz 3
+D-80335 München
+UID Nr. DE812706034
+Bananen                 1,49 B
+Vollmilch 3,5%          1,19 B
+Spülmittel              2,49 A
+Pfand                   0,25 A
+--------------------------------
+ZU ZAHLEN EUR           5,42
+Geg. EC-Karte EUR       5,42
+Steuer %   Netto   Steuer  Brutto
+A= 19,0%    2,30    0,44    2,74
+B=  7,0%    2,50    0,18    2,68
+2024-11-05 08:15 Bon-Nr. 4711"""
+
+
+def test_restaurant_receipt_with_tip():
+    values, confidence, problems = ReceiptParser().parse(RESTAURANT)
+    assert problems == [] and confidence == 1.0
+    assert values["date"] == "2024.Mar.12"
+    assert values["location_name"] == "Gasthaus Zur Post"
+    assert values["address"] == "Hauptstraße 12, 10115 Berlin, Deutschland"
+    assert (values["currency_symbol"], values["currency_code"]) == ("€", "EUR")
+    assert values["taxes"] == [{"percentage": 19.0, "amount_taxed": 38.91, "value_added": 7.39}]
+    # The total with tip is not taken for the total.
+    assert values["total_without_tip"] == 46.3
+    assert (values["tip_amount"], values["total_with_tip"], values["tip_percentage"]) == (4.7, 51.0, 0.1)
+
+
+def test_supermarket_receipt_with_two_vat_rates():
+    values, confidence, problems = ReceiptParser().parse(SUPERMARKET)
+    assert problems == [] and confidence == 1.0
+    # ISO dates win; the "3,5%" of the milk is neither a VAT line nor an amount.
+    assert values["date"] == "2024.Nov.05"
+    assert values["location_name"] == "REWE Markt GmbH"
+    assert values["address"] == "Bahnhofplatz 3, 80335 München, Deutschland"
+    assert values["taxes"] == [{"percentage": 19.0, "amount_taxed": 2.3, "value_added": 0.44},
+                               {"percentage": 7.0, "amount_taxed": 2.5, "value_added": 0.18}]
+    assert values["total_without_tip"] == values["total_with_tip"] == 5.42
+    assert values["tip_amount"] == 0.0
+
+
+def test_amounts_and_dates():
+    parser = ReceiptParser()
+    assert parser.get_amounts("Summe 1.234,50 EUR") == [1234.5]
+    assert parser.get_amounts("Total 12.50 (19%)") == [12.5]
+    assert parser.get_date("Datum: 1.2.24") == "2024.Feb.01"
+    assert parser.get_date("31.13.2024") is None
+    assert parser.get_tax(7.0, [0.35]) == {"percentage": 7.0, "amount_taxed": 5.0, "value_added": 0.35}
+
+
+@pytest.mark.parametrize("text, problem", [
+    (RESTAURANT.replace("12.03.2024", "heute"), "missing date"),
+    (RESTAURANT.replace("10115 Berlin", "Berlin"), "missing address"),
+    (RESTAURANT.replace("MwSt 19%  Netto 38,91  MwSt 7,39", ""), "missing taxes"),
+    (RESTAURANT.replace("MwSt 7,39", "MwSt 7,39\nMwSt 7%  Netto 2,80  MwSt 0,20"), "totals don't reconcile"),
+    (RESTAURANT.replace("Gesamt mit Trinkgeld        51,00", "").replace("Summe EUR                   46,30",
+                                                                        "Summe EUR                   46,80"),
+     "totals don't reconcile"),
+], ids=["date", "address", "taxes", "vat", "tip"])
+def test_incomplete_or_inconsistent_receipts_are_rejected(text, problem):
+    values, confidence, problems = ReceiptParser().parse(text)
+    assert values is None
+    assert problem in problems
+    assert confidence < 0.9
+
+
+def test_unknown_currency_lowers_the_confidence():
+    values, confidence, _ = ReceiptParser().parse(RESTAURANT.replace("Summe EUR", "Summe"))
+    assert values["currency_code"] == "EUR"
+    assert 0.9 <= confidence < 1.0
+
+
+@pytest.mark.parametrize("text", [RESTAURANT, SUPERMARKET], ids=["restaurant", "supermarket"])
+def test_complete_receipts_are_extracted_locally(make_main, llm_server, text):
+    main = make_main()
+    values = main.extract_billing_values(text)
+    assert values == ReceiptParser().parse(text)[0]
+    assert llm_server.request_count == 0
+    assert {"name": "extractions_total", "labels": {"method": "local"}, "value": 1} in \
+        main.metrics.to_dict()["counters"]
+
+
+@pytest.mark.parametrize("text, options", [
+    (RESTAURANT.replace("12.03.2024", "heute"), {}),
+    (RESTAURANT.replace("Netto 38,91  MwSt 7,39", "Netto 30,00  MwSt 5,70"), {}),
+    (RESTAURANT.replace("Summe EUR", "Summe"), {"min_parser_confidence": 0.95}),
+    (RESTAURANT, {"use_local_parser": False}),
+], ids=["missing field", "vat mismatch", "low confidence", "disabled"])
+def test_fallback_to_the_llm(make_main, llm_server, text, options):
+    main = make_main(**options)
+    values = main.extract_billing_values(text)
+    assert values["total_without_tip"] == SAMPLE_BILLING_VALUES["total_without_tip"]
+    assert llm_server.request_count == 1
+    assert {"name": "extractions_total", "labels": {"method": "llm"}, "value": 1} in \
+        main.metrics.to_dict()["counters"]
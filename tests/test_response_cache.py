@@ -0,0 +1,39 @@
+from response_cache import ResponseCache
+
+
+def test_values_persist_across_instances(tmp_path):
+    path = str(tmp_path / "cache" / "llm_cache.sqlite")
+    cache = ResponseCache(path)
+    cache.set("key", {"total_with_tip": 12.5})
+    cache.close()
+
+    cache = ResponseCache(path)
+    assert cache.get("key") == {"total_with_tip": 12.5}
+    assert cache.get("other") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_key_ignores_whitespace_only_differences():
+    assert ResponseCache.get_key("Summe  EUR\n12,50", "model") == ResponseCache.get_key("Summe EUR 12,50", "model")
+    assert ResponseCache.get_key("Summe EUR 12,50", "model") != ResponseCache.get_key("Summe EUR 12,50", "other")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "llm_cache.sqlite"), max_bytes=100)
+    cache.set("old", "x" * 40)
+    cache.set("used", "y" * 40)
+    cache.get("used")
+    cache.set("new", "z" * 40)
+    assert cache.get("old") is None
+    assert cache.get("used") == "y" * 40
+    assert cache.get("new") == "z" * 40
+
+
+def test_rerun_makes_no_llm_requests(make_main, llm_server):
+    make_main(use_local_parser=False, validate=False).run()
+    requests = llm_server.request_count
+    assert requests > 0
+
+    # A new Main starts cold, so the second run can only skip the pages through the manifest and cache.
+    make_main(use_local_parser=False, validate=False).run(overwrite=True)
+    assert llm_server.request_count == requests
@@ -0,0 +1,88 @@
+import os
+import json
+
+import pytest
+
+from results_store import ResultsStore, normalize_date
+
+
+def write_page(directory, page: str, values: dict, extension: str = "json"):
+    os.makedirs(str(directory), exist_ok=True)
+    with open(os.path.join(str(directory), f"{page}.{extension}"), "w") as page_file:
+        if extension == "json":
+            json.dump({"data_sets": [{"date": "ignored"}, values]}, page_file)
+        else:
+            page_file.write("\n".join(f"{key}: {value}" for key, value in values.items()))
+
+
+def receipt(date: str, total: float, **values):
+    return {"date": date, "location_name": "Gasthaus Zur Post", "currency_code": "EUR",
+            "total_without_tip": total, "total_with_tip": round(total * 1.1, 2), "tip_amount": round(total * 0.1, 2),
+            "taxes": [{"percentage": 19.0, "amount_taxed": round(total / 1.19, 2),
+                       "value_added": round(total - total / 1.19, 2)}], **values}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    yield store
+    store.close()
+
+
+def test_normalize_date():
+    assert normalize_date("2024.Mar.12") == "2024-03-12"
+    assert normalize_date("2024.Mär.12") == "2024-03-12"
+    assert normalize_date("12.03.24") == "2024-03-12"
+    assert normalize_date("2024-03-12") == "2024-03-12"
+    assert normalize_date("2024.Feb.30") is None
+    assert normalize_date(None) is None
+
+
+def test_import_keys_documents_like_main_and_the_batch(tmp_path, store):
+    data = tmp_path / "receipts_2024"
+    write_page(data, "page_0", receipt("2024.Jan.05", 50.0))
+    write_page(data, "page_1", receipt("2024.Jan.20", 30.0))
+    # The JSON wins over the YAML of the same page.
+    write_page(data, "page_1", {"total_with_tip": 1000.0}, extension="yml")
+    write_page(data / "2024 Feb" / "receipts", "page_0", {"date": "2024.Feb.02", "total_with_tip": 20.0},
+               extension="yml")
+    write_page(data, "page_2", receipt("2024.Jan.21", 30.0, duplicate_of="page_1"))
+    # A malformed amount skips the page, not the import.
+    write_page(data, "page_3", receipt("2024.Jan.22", 10.0, taxes=[{"value_added": "zehn"}]))
+    (data / "page_4.json").write_text('{"data_sets": [')
+
+    assert store.import_directory(str(data)) == 3
+    assert [(row["document"], row["page"]) for row in store.query()] == [
+        ("receipts_2024", "page_0"), ("receipts_2024", "page_1"), ("2024 Feb/receipts", "page_0")]
+    assert store.query(document="receipts_2024")[1]["total_with_tip"] == 33.0
+
+
+def test_import_is_idempotent(tmp_path, store):
+    write_page(tmp_path / "data", "page_0", receipt("2024.Jan.05", 50.0))
+    assert store.import_directory(str(tmp_path / "data")) == 1
+    store.add("data", "page_0", receipt("2024.Jan.05", 60.0))
+    assert store.import_directory(str(tmp_path / "data") + os.sep) == 1
+    [row] = store.query()
+    assert row["total_without_tip"] == 50.0
+
+
+def test_aggregate(store):
+    for i, (date, total, currency) in enumerate([("2024.Jan.05", 50.0, "EUR"), ("2024.Feb.10", 30.0, "EUR"),
+                                                 ("2024.Apr.01", 20.0, "EUR"), ("2024.Apr.02", 40.0, "CHF")]):
+        store.add("receipts", f"page_{i}", receipt(date, total, currency_code=currency))
+    assert [(row["grp"], row["receipts"], row["total_without_tip"]) for row in store.aggregate("quarter")] == \
+        [("2024-Q1", 2, 80.0), ("2024-Q2", 2, 60.0)]
+    [eur] = store.aggregate(currency="EUR", date_from="2024-02-01")
+    assert (eur["receipts"], eur["total_with_tip"], eur["tip_amount"], eur["average_total"]) == (2, 55.0, 5.0, 27.5)
+    assert eur["value_added"] == round(30.0 - 30.0 / 1.19 + 20.0 - 20.0 / 1.19, 2)
+    with pytest.raises(ValueError):
+        store.aggregate(unknown="x")
+
+
+def test_main_and_import_share_their_rows(make_main):
+    main = make_main()
+    main.run()
+    rows = main.results_store.query()
+    assert len(rows) == 4
+    assert main.results_store.import_directory(main.data_directory_path) == 4
+    assert main.results_store.query() == rows
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import threading
+import http.client
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+from service import PollingWatcher
+
+
+@pytest.fixture
+def pdf_content(receipts):
+    with open(receipts[0], "rb") as pdf_file:
+        return pdf_file.read()
+
+
+@pytest.fixture
+def make_service(tmp_path, receipts, llm_server):
+    """Factory for a ReceiptService with an empty inbox on the data directory of the receipts; stopped at the end."""
+    pytest.importorskip("langchain")
+    from service import ReceiptService
+
+    _, data_directory_path, _ = receipts
+    services = []
+
+    def _make_service(**options):
+        options = {"port": 0, "watcher": "polling", "poll_interval": 0.1, "ocr_workers": 1,
+                   "llm_base_url": llm_server.url, **options}
+        services.append(ReceiptService(str(tmp_path / "inbox"), data_directory_path, **options))
+        return services[-1]
+
+    yield _make_service
+    for service in services:
+        service.stop()
+
+
+def request(service, path: str, content: bytes = None):
+    """Status and JSON body of a GET, or of a POST of the content."""
+    try:
+        with urlopen(Request(service.url + path, data=content), timeout=30) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+def wait_for_job(service, job_id: str, timeout: float = 120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, job = request(service, f"/jobs/{job_id}")
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(f"Job {job_id} didn't finish")
+
+
+def test_upload_and_job_status(make_service, pdf_content):
+    service = make_service().start()
+    status, health = request(service, "/health")
+    assert (status, health["status"], health["watcher"]) == (200, "ok", "polling")
+
+    status, job = request(service, "/jobs?name=..%2F2024%20M%C3%A4rz%20%26%20April.pdf", pdf_content)
+    assert (status, job["source"]) == (202, "upload") and job["status"] in ("queued", "running")
+    assert os.path.basename(job["path"]) == "2024_März_April.pdf"
+    job = wait_for_job(service, job["id"])
+    assert (job["status"], job["document"], job["pages"], job["error"]) == ("done", "2024_März_April", 4, None)
+    assert all(os.path.exists(path) for path in job["receipts"]) and job["receipts"]
+    assert request(service, "/jobs")[1] == [job]
+    assert request(service, "/health")[1]["done"] == 1
+    assert request(service, "/jobs/unknown") == (404, {"error": "Unknown job"})
+
+
+def test_invalid_uploads_are_rejected(make_service):
+    service = make_service(max_upload_bytes=100).start()
+    assert request(service, "/jobs", b"not a pdf")[0] == 400
+    assert request(service, "/jobs", b"%PDF" + b"x" * 100)[0] == 413
+    assert request(service, "/receipts", b"%PDF")[0] == 404
+
+    host, port = service.server.server_address[:2]
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    connection.putrequest("POST", "/jobs")
+    connection.putheader("Content-Length", "-1")
+    connection.endheaders()
+    response = connection.getresponse()
+    assert (response.status, json.load(response)) == (400, {"error": "Invalid Content-Length"})
+    connection.close()
+    assert request(service, "/jobs")[1] == []
+    assert os.listdir(service.inbox_directory) == []
+
+
+def test_full_queue_rejects_uploads(make_service, pdf_content, monkeypatch):
+    service = make_service(queue_size=1)
+    started, release = threading.Event(), threading.Event()
+    process = service.process
+
+    def _process(job):
+        started.set()
+        release.wait(60)
+        process(job)
+
+    monkeypatch.setattr(service, "process", _process)
+    service.start()
+    status, running = request(service, "/jobs?name=first", pdf_content)
+    assert status == 202 and started.wait(30)
+    assert request(service, "/jobs?name=second", pdf_content)[0] == 202
+    assert request(service, "/jobs?name=third", pdf_content) == (503, {"error": "Job queue is full"})
+    # The rejected upload doesn't stay in the inbox to be picked up later.
+    assert sorted(os.listdir(service.inbox_directory)) == ["first.pdf", "second.pdf"]
+    release.set()
+    assert wait_for_job(service, running["id"])["status"] == "done"
+
+
+def test_jobs_are_deduplicated_by_path_and_signature(make_service, pdf_content):
+    service = make_service(port=None)
+    path = os.path.join(service.inbox_directory, "receipts.pdf")
+    with open(path, "wb") as pdf_file:
+        pdf_file.write(pdf_content)
+    job = service.submit(path)
+    assert service.submit(path) is job
+    assert service.submit(path, source="upload") is job
+    assert service.queue.qsize() == 1
+
+    service.process(service.queue.get())
+    assert job.status == "done"
+    # The unchanged file is not processed again, a changed one is.
+    assert service.submit(path) is None
+    with open(path, "ab") as pdf_file:
+        pdf_file.write(b"\n")
+    changed = service.submit(path)
+    assert changed is not None and changed is not job
+    service.queue.get()
+
+
+class Looks:
+    """Stop event for a watcher that runs one step between looks at the inbox and stops after the last."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    def is_set(self):
+        return not self.steps
+
+    def wait(self, timeout=None):
+        self.steps.pop(0)()
+
+
+def test_polling_watcher_reports_files_that_stopped_changing(tmp_path):
+    complete, growing = tmp_path / "a.pdf", tmp_path / "b.PDF"
+    complete.write_bytes(b"%PDF complete")
+    growing.write_bytes(b"%PDF")
+    (tmp_path / "c.pdf.tmp").write_bytes(b"%PDF")
+    (tmp_path / "notes.txt").write_text("")
+    (tmp_path / "folder.pdf").mkdir()
+
+    def grow():
+        with open(str(growing), "ab") as pdf_file:
+            pdf_file.write(b" still writing")
+
+    reported = []
+    PollingWatcher(str(tmp_path), interval=0).watch(reported.append, Looks(grow, lambda: None, lambda: None))
+    # Nothing at the first look, the growing file only after it kept its size for a look.
+    assert reported == [str(complete), str(complete), str(growing)]
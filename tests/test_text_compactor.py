@@ -0,0 +1,46 @@
+import pytest
+
+from metrics import Metrics, TOKEN_BUCKETS
+from text_compactor import KEYWORD_PATTERN, TextCompactor
+
+
+@pytest.mark.parametrize("line", [
+    "Summe EUR 12,50", "Zwischensumme 9,80", "Gesamtbetrag 3,20", "MwSt 19% 1,96", "USt-IdNr DE123456789",
+    "12,50EUR", "Kartenzahlung", "EC-Karte", "Tel.: 030 1234", "Hauptstraße 12", "Hauptstr. 5",
+    "Lindenallee 3", "Trinkgeld 2,00", "12.03.2024 19:41", "10115 Berlin",
+])
+def test_keyword_lines(line):
+    assert KEYWORD_PATTERN.search(line)
+
+
+@pytest.mark.parametrize("line", [
+    "Hotel Adlon", "Gustav August", "Rhabarber", "Heringsalat", "Feuerwehr teuer", "multiple",
+])
+def test_keywords_inside_other_words_do_not_count(line):
+    assert not KEYWORD_PATTERN.search(line)
+
+
+def test_compact_keeps_the_header_and_the_lines_around_keywords():
+    text = "\n".join([
+        "Gasthaus Zur Post", "Hauptstraße 12", "10115 Berlin", "-------------",
+        "Rhabarberschorle    3,90", "Heringsalat         7,80", "Gustav August Kellner",
+        "Hotelgutschein", "Schnitzel          18,90", "",
+        "Summe EUR          30,60", "MwSt 19% Netto 25,71 MwSt 4,89", "~~~~~~~~~~", "Vielen Dank!",
+    ])
+    compacted, tokens_before, tokens_after = TextCompactor().compact(text)
+    assert compacted.splitlines() == [
+        "Gasthaus Zur Post", "Hauptstraße 12", "10115 Berlin", "Rhabarberschorle 3,90",
+        "Schnitzel 18,90", "Summe EUR 30,60", "MwSt 19% Netto 25,71 MwSt 4,89", "Vielen Dank!"]
+    assert tokens_after < tokens_before
+
+
+def test_token_counts_use_token_buckets():
+    metrics = Metrics()
+    for tokens in (80, 250, 5000):
+        metrics.observe("llm_prompt_text_tokens", tokens, buckets=TOKEN_BUCKETS)
+    metrics.observe("stage_duration_seconds", 0.2)
+    histograms = {histogram["name"]: histogram for histogram in metrics.to_dict()["histograms"]}
+    assert histograms["llm_prompt_text_tokens"]["buckets"]["100"] == 1
+    assert histograms["llm_prompt_text_tokens"]["buckets"]["300"] == 2
+    assert histograms["llm_prompt_text_tokens"]["buckets"]["3200"] == 2
+    assert histograms["stage_duration_seconds"]["buckets"]["0.25"] == 1
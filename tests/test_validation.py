@@ -0,0 +1,54 @@
+import os
+import json
+
+from fake_llm_server import SAMPLE_BILLING_VALUES
+from validation import ReceiptValidator
+
+# The VAT line doesn't add up to the total, before and after re-extraction.
+INVALID_BILLING_VALUES = {**SAMPLE_BILLING_VALUES, "total_without_tip": 90.0, "total_with_tip": 90.0}
+
+
+def test_validator_reports_only_failing_pages():
+    anomalies = ReceiptValidator().validate([
+        ("page_0", SAMPLE_BILLING_VALUES),
+        ("page_1", INVALID_BILLING_VALUES),
+        ("page_2", {**SAMPLE_BILLING_VALUES, "taxes": [{"percentage": 12.0, "amount_taxed": 84.03,
+                                                        "value_added": 15.97}]}),
+    ])
+    assert anomalies == {
+        "page_1": ["VAT lines don't add up to the total without tip"],
+        "page_2": ["VAT doesn't match its rate", "unknown VAT rate"],
+    }
+
+
+def test_invalid_pages_are_reextracted_once(make_main, llm_server):
+    llm_server.response_values = INVALID_BILLING_VALUES
+    main = make_main(use_local_parser=False)
+    main.run()
+    # One extraction and one re-extraction per page.
+    assert llm_server.request_count == 8
+    assert sorted(main.anomalies) == ["page_0", "page_1", "page_2", "page_3"]
+
+    main = make_main(use_local_parser=False)
+    main.run()
+    assert llm_server.request_count == 8
+
+    with open(os.path.join(main.data_directory_path, "user_data.txt"), "a") as user_data_file:
+        user_data_file.write("\nProjekt C")
+    main = make_main(use_local_parser=False)
+    main.run()
+    assert llm_server.request_count == 8
+    assert {"name": "pages_skipped_total", "labels": {"reason": "attempted", "stage": "reextract"},
+            "value": 4} in main.metrics.to_dict()["counters"]
+    with open(os.path.join(main.data_directory_path, "validation.json"), "r") as validation_file:
+        assert sorted(json.load(validation_file)) == ["page_0", "page_1", "page_2", "page_3"]
+
+
+def test_changed_extraction_settings_allow_another_attempt(make_main, llm_server):
+    llm_server.response_values = INVALID_BILLING_VALUES
+    make_main(use_local_parser=False).run()
+    requests = llm_server.request_count
+
+    make_main(use_local_parser=False, compact_llm_text=False).run()
+    # New settings miss the response cache; each page is extracted and re-extracted once more.
+    assert llm_server.request_count == requests + 8
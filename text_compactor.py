@@ -0,0 +1,110 @@
+import re
+import logging
+
+
+# Lines that carry BillingValues fields: totals, VAT, tip, date, currency and the address.
+# Keywords must not touch other letters on the sides marked below, so "teuer", "Hotel" and
+# "August" don't count. Digits may touch them, since OCR often glues "12,50EUR" together.
+NOT_LETTER_BEFORE = r"(?<![^\W\d_])"
+NOT_LETTER_AFTER = r"(?![^\W\d_])"
+KEYWORD_PATTERN = re.compile(
+    # Words that also start compounds: Gesamtbetrag, Kartenzahlung, Steuernummer.
+    NOT_LETTER_BEFORE + r"(?:summe|total|gesamt|betrag|zu zahlen|karte|bargeld|barzahlung|gegeben|rückgeld"
+    r"|mwst|steuer|netto|brutto|trinkgeld|bedienung|datum|telefon)"
+    # Words that also end them: Zwischensumme, Hauptstraße, Marktplatz.
+    r"|(?:summe|betrag|steuer|straße|strasse|platz|weg|allee|gasse|damm)" + NOT_LETTER_AFTER + r"|str\."
+    # Short words and abbreviations, only on their own.
+    r"|" + NOT_LETTER_BEFORE + r"(?:bar|ec|visa|mastercard|ust|vat|tax|tips?|date|eur|euro|chf|usd|tel|fon|ring)"
+    + NOT_LETTER_AFTER +
+    r"|%|€|\$|£|www\.|@"
+    r"|\b\d{1,2}[./-]\d{1,2}[./-]\d{2,4}\b|\b\d{4}[./-]\d{1,2}[./-]\d{1,2}\b|\b\d{5}\b",
+    re.IGNORECASE)
+SEPARATOR_PATTERN = re.compile(r"^[\W_]*$")
+REPEATED_PATTERN = re.compile(r"([^\w\s])\1{2,}")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str):
+    """Rough token count, about four characters per token."""
+    return len(text) // 4 + 1
+
+
+class TextCompactor:
+    """
+    Shrinks OCR text before it goes into the LLM prompt: drops noise and separator lines,
+    collapses whitespace and keeps the header (the place's name) plus the lines around
+    totals, VAT, tip, date and address keywords, within a maximum token count.
+    """
+
+    def __init__(self, max_tokens: int = 600, header_lines: int = 3, context_lines: int = 1,
+                 min_characters: int = 3, logger=None):
+        """
+        Args:
+            max_tokens (int): Upper limit of the estimated tokens of the compacted text.
+            header_lines (int): Leading lines that are always kept; receipts start with the place's name.
+            context_lines (int): Lines kept before and after each keyword line.
+            min_characters (int): Lines with fewer letters and digits are noise.
+        """
+        self.max_tokens = max_tokens
+        self.header_lines = header_lines
+        self.context_lines = context_lines
+        self.min_characters = min_characters
+        self.logger = logger or logging
+
+    def get_config(self):
+        return {"max_tokens": self.max_tokens, "header_lines": self.header_lines,
+                "context_lines": self.context_lines, "min_characters": self.min_characters}
+
+    def clean_lines(self, text: str):
+        """Normalized lines without separators, OCR noise and consecutive duplicates."""
+        lines = []
+        for line in text.splitlines():
+            line = WHITESPACE_PATTERN.sub(" ", REPEATED_PATTERN.sub(r"\1", line)).strip()
+            if not line or SEPARATOR_PATTERN.match(line):
+                continue
+            if sum(char.isalnum() for char in line) < self.min_characters and not KEYWORD_PATTERN.search(line):
+                continue
+            if lines and lines[-1] == line:
+                continue
+            lines.append(line)
+        return lines
+
+    def compact(self, text: str):
+        """
+        Returns:
+            tuple: The compacted text, and its estimated tokens before and after.
+        """
+        lines = self.clean_lines(text)
+        # Priority 0: header and keyword lines, 1: their context.
+        priorities = {}
+        for i in range(min(self.header_lines, len(lines))):
+            priorities[i] = 0
+        for i, line in enumerate(lines):
+            if KEYWORD_PATTERN.search(line):
+                priorities[i] = 0
+                for j in range(max(0, i - self.context_lines), min(len(lines), i + self.context_lines + 1)):
+                    priorities.setdefault(j, 1)
+        if len(priorities) <= self.header_lines:
+            # Nothing recognizable; let the model see the cleaned text.
+            priorities = {i: 0 for i in range(len(lines))}
+
+        kept = sorted(priorities)
+        compacted = "\n".join(lines[i] for i in kept)
+        if estimate_tokens(compacted) > self.max_tokens:
+            kept = [i for i in kept if priorities[i] == 0]
+            compacted = "\n".join(lines[i] for i in kept)
+        if estimate_tokens(compacted) > self.max_tokens:
+            # Keep the header and the lines closest to the end, where the totals are.
+            budget = self.max_tokens * 4
+            header = [i for i in kept if i < self.header_lines]
+            selected = set(header)
+            used = sum(len(lines[i]) + 1 for i in header)
+            for i in reversed(kept):
+                if i in selected:
+                    continue
+                if used + len(lines[i]) + 1 > budget:
+                    continue
+                selected.add(i)
+                used += len(lines[i]) + 1
+            compacted = "\n".join(lines[i] for i in sorted(selected))
+        return compacted, estimate_tokens(text), estimate_tokens(compacted)
@@ -33,11 +33,15 @@ class UserData:
         self.set("projects", projects)
 
 class UserDataHandler:
-    def __init__(self, logger=None, directory: str = None):
+    def __init__(self, logger=None, directory: str = None, interactive: bool = True, seed=None):
         self.logger = logger or logging
+        # Without interactive, a missing user_data.txt is an error instead of a prompt.
+        self.interactive = interactive
         self.directory = directory if directory is not None else input(
             "Enter directory path: ")
         self.data = UserData()
+        # Seeded, so the names and topics picked are the same on every run.
+        self.random = random.Random(seed)
         self.billing_value_per_name = 18
         self.user_data_file = "user_data.txt"
         self.user_data_separator = "######"
@@ -51,18 +55,20 @@ class UserDataHandler:
     def get_billing_value_per_name(self, billing_value: int):
         return self.billing_value_per_name + (billing_value * 0.08)
     
-    def get_names_billing_sub_set(self, name_count: int):
+    def get_names_billing_sub_set(self, name_count: int, rng: random.Random = None):
         names = self.get_names()
         first_name = names[0]
         subset = names[1:]
-        random.shuffle(subset)
+        (rng or self.random).shuffle(subset)
         subset = subset[:name_count - 1]
         return [first_name] + subset
 
-    def get_topic(self, index: int = None):
-        topics = self.get_projects()
-        random.shuffle(topics)
-        index = index if index is not None and index < len(topics) else random.randint(0, len(topics) - 1)
+    def get_topic(self, index: int = None, rng: random.Random = None):
+        rng = rng or self.random
+        # Shuffle a copy; the projects list is shared.
+        topics = list(self.get_projects())
+        rng.shuffle(topics)
+        index = index if index is not None and index < len(topics) else rng.randint(0, len(topics) - 1)
         return topics[index]
 
     def get_data_and_write_to_file(self):
@@ -93,18 +99,24 @@ class UserDataHandler:
 
         return file_contents
     
+    def show(self, message: str):
+        """Print for the user at the prompt; without interactive, log, so stdout stays free for results."""
+        if self.interactive:
+            print(message)
+        else:
+            self.logger.info(message)
+
     def read_existing_data(self):
         file_path = os.path.join(self.directory, self.user_data_file)
         if os.path.exists(file_path):
             with open(file_path, "r") as file:
-                print("Contents of existing 'user_data.txt' file:")
                 lines = []
                 for line in file:
                     data = line.strip()
                     if data == self.user_data_separator:
                         break
-                    print(data)
                     lines.append(data)
+                self.show("\n".join(["Contents of existing 'user_data.txt' file:"] + lines))
                 return lines
         return None
 
@@ -112,10 +124,13 @@ class UserDataHandler:
         if os.path.exists(self.directory):
             existing_data = self.read_existing_data()
             if existing_data:
-                print(f"Using the existing {os.path.join(self.directory, self.user_data_file)}.")
+                self.show(f"Using the existing {os.path.join(self.directory, self.user_data_file)}.")
+            elif not self.interactive:
+                raise FileNotFoundError(
+                    f"No user data in {os.path.join(self.directory, self.user_data_file)}")
             else:
                 data = self.get_data_and_write_to_file()
-                print(f"{data}\nhave been written to a new {self.user_data_file} file.")
+                self.show(f"{data}\nhave been written to a new {self.user_data_file} file.")
             
             self.data.setDataFromFile(os.path.join(self.directory, self.user_data_file))
 
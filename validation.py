@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import logging
+import argparse
+
+import numpy as np
+
+
+# German VAT rates; 16 and 5 were in force in the second half of 2020.
+VAT_RATES = (0.0, 5.0, 7.0, 16.0, 19.0)
+
+
+class ReceiptArrays:
+    """The extracted values of many receipts as flat arrays; taxes are flattened with their record index."""
+
+    def __init__(self, records: list):
+        """
+        Args:
+            records (list): (page_id, values) tuples with values as written to the page JSON.
+        """
+        self.page_ids = [page_id for page_id, _ in records]
+        count = len(records)
+        self.total_without_tip = np.full(count, np.nan)
+        self.total_with_tip = np.full(count, np.nan)
+        self.tip_amount = np.full(count, np.nan)
+        self.tip_percentage = np.full(count, np.nan)
+        tax_records, percentages, amounts_taxed, values_added = [], [], [], []
+        for i, (_, values) in enumerate(records):
+            self.total_without_tip[i] = self.to_float(values.get("total_without_tip"))
+            self.total_with_tip[i] = self.to_float(values.get("total_with_tip"))
+            self.tip_amount[i] = self.to_float(values.get("tip_amount"))
+            self.tip_percentage[i] = self.to_float(values.get("tip_percentage"))
+            for tax in values.get("taxes") or []:
+                if isinstance(tax, dict):
+                    tax_records.append(i)
+                    percentages.append(self.to_float(tax.get("percentage")))
+                    amounts_taxed.append(self.to_float(tax.get("amount_taxed")))
+                    values_added.append(self.to_float(tax.get("value_added")))
+        self.tax_record = np.array(tax_records, dtype=np.int64)
+        self.tax_percentage = np.array(percentages, dtype=np.float64)
+        self.tax_amount_taxed = np.array(amounts_taxed, dtype=np.float64)
+        self.tax_value_added = np.array(values_added, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.page_ids)
+
+    @staticmethod
+    def to_float(value):
+        try:
+            return float(str(value).replace(",", ".")) if value is not None else np.nan
+        except ValueError:
+            return np.nan
+
+
+class ReceiptValidator:
+    """
+    Checks the invariants of all extracted receipts at once with array operations:
+    VAT lines add up to the total, each VAT line matches its rate, the rate exists,
+    and the tip, its percentage and the total with tip agree.
+    """
+
+    def __init__(self, tolerance: float = 0.02, tip_tolerance: float = 0.005, vat_rates: tuple = VAT_RATES,
+                 logger=None):
+        """
+        Args:
+            tolerance (float): Allowed rounding difference in currency units, per VAT line.
+            tip_tolerance (float): Allowed difference of the tip, relative to the total without tip.
+            vat_rates (tuple): Valid VAT percentages.
+        """
+        self.tolerance = tolerance
+        self.tip_tolerance = tip_tolerance
+        self.vat_rates = np.array(vat_rates, dtype=np.float64)
+        self.logger = logger or logging
+
+    def get_checks(self, arrays: ReceiptArrays):
+        """Boolean failure masks over the records, by reason."""
+        count = len(arrays)
+        index = arrays.tax_record
+
+        def _per_record(mask):
+            return np.bincount(index[mask], minlength=count) > 0
+
+        tax_lines = np.bincount(index, minlength=count)
+        amount_taxed = np.bincount(index, weights=np.nan_to_num(arrays.tax_amount_taxed), minlength=count)
+        value_added = np.bincount(index, weights=np.nan_to_num(arrays.tax_value_added), minlength=count)
+        tax_missing = np.isnan(arrays.tax_amount_taxed) | np.isnan(arrays.tax_value_added) | \
+            np.isnan(arrays.tax_percentage)
+
+        total = arrays.total_without_tip
+        with np.errstate(invalid="ignore"):
+            tip_fraction = np.where(arrays.tip_percentage > 1, arrays.tip_percentage / 100, arrays.tip_percentage)
+            return {
+                "missing total": np.isnan(total) | np.isnan(arrays.total_with_tip),
+                "negative amount": (total < 0) | (arrays.total_with_tip < 0) | (arrays.tip_amount < 0),
+                "no VAT lines": tax_lines == 0,
+                "incomplete VAT line": _per_record(tax_missing),
+                "VAT lines don't add up to the total without tip":
+                    (tax_lines > 0) & (np.abs(amount_taxed + value_added - total) >
+                                       self.tolerance * np.maximum(1, tax_lines)),
+                "VAT doesn't match its rate": _per_record(
+                    np.abs(arrays.tax_amount_taxed * arrays.tax_percentage / 100 - arrays.tax_value_added) >
+                    self.tolerance),
+                "unknown VAT rate": _per_record(
+                    ~np.isin(np.round(arrays.tax_percentage, 1), self.vat_rates) & ~tax_missing),
+                "total with tip is not total without tip plus tip":
+                    np.abs(total + np.nan_to_num(arrays.tip_amount) - arrays.total_with_tip) > self.tolerance,
+                "tip doesn't match its percentage":
+                    ~np.isnan(tip_fraction) & ~np.isnan(arrays.tip_amount) &
+                    (np.abs(total * tip_fraction - arrays.tip_amount) > self.tolerance + self.tip_tolerance * total),
+            }
+
+    def validate(self, records: list):
+        """
+        Args:
+            records (list): (page_id, values) tuples.
+
+        Returns:
+            dict: Reasons by page id, only for the pages that fail a check.
+        """
+        arrays = ReceiptArrays(records)
+        anomalies = {}
+        for reason, mask in self.get_checks(arrays).items():
+            for i in np.nonzero(mask)[0]:
+                anomalies.setdefault(arrays.page_ids[i], []).append(reason)
+        self.logger.info(
+            f"Validated {len(arrays)} receipts, {len(anomalies)} with anomalies")
+        return anomalies
+
+    @staticmethod
+    def load_files(paths: list, directory: str):
+        """(page_id, values) of the last data set of each page JSON; page ids are relative to directory."""
+        records = []
+        for path in paths:
+            try:
+                with open(path, "r") as json_file:
+                    data_sets = json.load(json_file).get("data_sets") or []
+            except (OSError, ValueError):
+                continue
+            if data_sets and isinstance(data_sets[-1], dict):
+                page_id = os.path.relpath(os.path.splitext(path)[0], directory).replace(os.sep, "/")
+                records.append((page_id, data_sets[-1]))
+        return records
+
+    @classmethod
+    def load_directory(cls, directory: str):
+        """(page_id, values) of every page_*.json below directory."""
+        pattern = re.compile(r"^page_\d+\.json$")
+        paths = [os.path.join(current, file_name)
+                 for current, _, file_names in os.walk(directory)
+                 for file_name in sorted(file_names) if pattern.match(file_name)]
+        return cls.load_files(paths, directory)
+
+    def validate_directory(self, directory: str, report_path: str = None):
+        anomalies = self.validate(self.load_directory(directory))
+        if report_path is not None:
+            with open(report_path, "w") as report_file:
+                json.dump(anomalies, report_file, indent=2, sort_keys=True)
+        return anomalies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the extracted receipts below a data directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    parser.add_argument("--report", default=None)
+    args = parser.parse_args()
+
+    result = ReceiptValidator(tolerance=args.tolerance).validate_directory(args.directory, args.report)
+    print(json.dumps(result, indent=2, sort_keys=True))